@@ -0,0 +1,158 @@
+"""ASGI 入口：同一个 Flask 应用（同样的路由、缓存和存储逻辑）跑在 uvicorn 的事件循环上
+
+    uvicorn --app-dir api asgi:app --workers 4
+    python api/asgi.py [端口]     # 单进程 uvicorn（开发、压测用）
+
+HTTP 解析、keep-alive 和各种超时都交给 uvicorn，这里只做分发：
+- 普通请求：用 a2wsgi 的 WSGIMiddleware 放进有上限的线程池（BOOKING_ASGI_THREADS）执行，
+  请求体按需从连接读取（大小上限见 index.BookingRequest）。线程池满时请求在事件循环里排队，
+  不占线程；排队的也超过 BOOKING_ASGI_BACKLOG 时直接返回 503
+- 座位实时推送（/api/tours/<id>/events）：建立连接时在线程池里订阅并取快照，之后不占线程，
+  推送线程有新事件时通过 Subscriber.notify 唤醒事件循环，空闲长连接只是一个协程。
+  所以这个入口下座位推送默认打开（没设置 BOOKING_SSE 时），预订页不用轮询
+
+Flask 的 before/after_request 钩子（指标、抽样分析）对普通请求照常生效；
+流式响应（管理后台）在同一个工作线程里边生成边发送。
+"""
+import asyncio
+import os
+import re
+import sys
+
+# 必须在导入 events / index 之前设置
+os.environ.setdefault('BOOKING_SSE', '1')
+
+from a2wsgi import WSGIMiddleware
+
+import events
+import index
+import metrics
+
+ASGI_THREADS = int(os.environ.get('BOOKING_ASGI_THREADS', '32'))
+ASGI_BACKLOG = int(os.environ.get('BOOKING_ASGI_BACKLOG', '1024'))
+
+EVENTS_PATH = re.compile(r'/api/tours/(\d+)/events')
+EVENTS_ROUTE = '/api/tours/<int:tour_id>/events'
+EVENT_STREAM_HEADERS = [(b'content-type', b'text/event-stream; charset=utf-8')] + [
+    (name.lower().encode('latin-1'), value.encode('latin-1'))
+    for name, value in index.EVENT_STREAM_HEADERS.items()]
+
+
+class AsgiApp:
+    """座位推送走原生 ASGI，其它请求交给 WSGIMiddleware，并限制排队的请求数"""
+
+    def __init__(self, wsgi_app, threads=ASGI_THREADS, backlog=ASGI_BACKLOG):
+        self.wsgi = WSGIMiddleware(wsgi_app, workers=threads)
+        self.pool = self.wsgi.executor
+        self.limit = threads + backlog
+        self.pending = 0  # 正在线程池里执行或排队的请求数（只在事件循环线程里修改）
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f'不支持的连接类型: {scope["type"]}')
+        match = EVENTS_PATH.fullmatch(scope['path'])
+        if match and scope['method'] == 'GET':
+            await self._event_stream(int(match.group(1)), receive, send)
+            return
+        if self.pending >= self.limit:
+            metrics.asgi_rejected.inc()
+            await send_json(send, 503, {'success': False, 'message': '服务器繁忙，请稍后重试'},
+                            [(b'retry-after', b'5')])
+            return
+        self.pending += 1
+        try:
+            await self.wsgi(scope, receive, send)
+        finally:
+            self.pending -= 1
+
+    # ---------- 内部实现 ----------
+    async def _event_stream(self, tour_id, receive, send):
+        """座位推送：不经过线程池等待，事件循环直接等订阅者的新事件"""
+        loop = asyncio.get_running_loop()
+        try:
+            opened = await loop.run_in_executor(self.pool, index.open_seat_stream, tour_id)
+        except events.BrokerFull as e:
+            await send_json(send, 503, {'success': False, 'message': str(e)}, [(b'retry-after', b'30')])
+            return
+        if opened is None:
+            await send_json(send, 404, {'success': False, 'message': '班次不存在'})
+            return
+        metrics.http_requests.inc(EVENTS_ROUTE, 'GET', '200')
+        sub, version, seats = opened
+        ready = asyncio.Event()
+        sub.notify = lambda: loop.call_soon_threadsafe(ready.set)
+        if sub.queue or sub.lagged:
+            # 订阅之后、装上 notify 之前到达的事件
+            ready.set()
+        disconnected = loop.create_task(wait_disconnect(receive))
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': EVENT_STREAM_HEADERS})
+            await send_text(send, events.stream_start(version, seats))
+            deadline = loop.time() + events.STREAM_MAX_SECONDS
+            while loop.time() < deadline:
+                waiter = loop.create_task(ready.wait())
+                await asyncio.wait((waiter, disconnected), timeout=events.HEARTBEAT_INTERVAL,
+                                   return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                if disconnected.done():
+                    return
+                ready.clear()
+                batch = sub.drain()
+                if not batch:
+                    await send_text(send, events.HEARTBEAT)
+                    continue
+                text, finished = events.encode_events(batch, version)
+                if text:
+                    await send_text(send, text)
+                if finished:
+                    break
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            sub.notify = None
+            events.broker.unsubscribe(sub)
+            disconnected.cancel()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.pool.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def send_text(send, text):
+    await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': True})
+
+
+async def send_json(send, status, data, headers=()):
+    body = index.app.json.dumps(data).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'),
+                            (b'content-length', str(len(body)).encode('latin-1')), *headers]})
+    await send({'type': 'http.response.body', 'body': body, 'more_body': False})
+
+
+# uvicorn 加载的应用
+app = AsgiApp(index.app)
+
+
+@metrics.registry.collector
+def collect_asgi_metrics():
+    metrics.asgi_pending.set(value=app.pending)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host='0.0.0.0', port=int(sys.argv[1]) if len(sys.argv) > 1 else 3000)
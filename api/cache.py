@@ -0,0 +1,228 @@
+"""进程内数据集缓存：团期、预订以及派生索引
+
+每次读之前只查一次数据集版本号（journal 序号）：
+- 版本没变：直接用内存里的数据（命中），不做任何解析
+- 版本变了：按 journal 增量重放这段时间的修改；journal 已被裁剪时整体重新加载
+- 冷启动：有可用的快照（snapshot.py）时先加载快照，再重放快照之后的 journal
+
+团期和预订是 models.Tour / models.Booking 记录；journal 里的字典在重放时转成记录。
+读者拿到的 tours 字典在变化时整体替换（写时复制，团期记录也是复制后修改），可以放心遍历；
+其它索引只做按键查找，原地更新。
+"""
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+
+import snapshot
+import storage
+from models import Booking, Tour
+from search import BookingSearchIndex
+from seatmap import SeatMap
+
+
+# 出发时间无法解析的团期排在索引最前面；区间查询都跳过它们，过期清理也不会删
+UNPARSED = float('-inf')
+
+
+class DatasetCache:
+    """团期/预订的进程级缓存，附带命中/未命中计数"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.tours = {}             # tour_id -> Tour（按ID顺序）
+        self.seat_maps = {}         # tour_id -> SeatMap
+        self.bookings = []          # 按创建顺序的所有预订
+        self.bookings_by_tour = {}  # tour_id -> [预订]
+        self.bookings_by_code = {}  # 预订码 -> 预订
+        self.search = BookingSearchIndex()  # 手机号/姓名搜索索引
+        self.departures = []        # 按出发时间戳排序的 (departs_at, tour_id)
+        self.tour_versions = {}     # tour_id -> 最后一次影响该团期的 journal 序号
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.replayed = 0
+        self.snapshot_loads = 0
+
+    def refresh(self):
+        """确保缓存与数据库版本一致，返回缓存自身
+
+        需要版本号的调用方应先读 version 再读数据，拿到的数据只会比版本号新。
+        """
+        version = storage.current_version()
+        if version == self.version:
+            self.hits += 1
+            return self
+        with self.lock:
+            if self.version is not None and self.version >= version:
+                self.hits += 1
+                return self
+            self.misses += 1
+            self._catch_up()
+        return self
+
+    def tour_version(self, tour_id):
+        """团期的版本号：内容相同的团期在任何进程里都对应同一个或更大的序号"""
+        return self.tour_versions.get(tour_id, 0)
+
+    def find_booking(self, code):
+        """按预订码查预订（哈希表，O(1)）；忽略首尾空白和大小写，找不到返回 None"""
+        if not isinstance(code, str):
+            return None
+        return self.bookings_by_code.get(code.strip().upper())
+
+    def export(self):
+        """在锁内取一份一致的 (版本号, [(团期, 座位占用表)], [预订])，供写快照用
+
+        团期记录和座位表都是写时复制的，这里只复制列表，不复制记录，持锁时间很短。
+        """
+        self.refresh()
+        with self.lock:
+            seat_maps = self.seat_maps
+            return self.version, [(t, seat_maps[t.id]) for t in self.tours.values()], list(self.bookings)
+
+    def stats(self):
+        """命中率等统计信息"""
+        total = self.hits + self.misses
+        return {
+            'version': self.version,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 4) if total else 0.0,
+            'reloads': self.reloads,
+            'replayed': self.replayed,
+            'snapshot_loads': self.snapshot_loads,
+            'tours': len(self.tours),
+            'bookings': len(self.bookings),
+        }
+
+    # ---------- 按出发时间的区间查询（二分） ----------
+    def departed_count(self, now=None, after=UNPARSED):
+        """出发时间在 (after, now) 之间的班次数，默认即所有已发车班次（无法解析的不算）"""
+        now = time.time() if now is None else now
+        departures = self.departures
+        return max(0, bisect_left(departures, (now,)) - bisect_right(departures, (after, float('inf'))))
+
+    def departed_before(self, cutoff):
+        """出发时间不晚于 cutoff 的班次ID；出发时间无法解析（departs_at 为空）的不算，不能据此删除"""
+        departures = self.departures
+        start = bisect_right(departures, (UNPARSED, float('inf')))
+        return [tour_id for _, tour_id in departures[start:bisect_right(departures, (cutoff, float('inf')))]]
+
+    # ---------- 内部实现 ----------
+    def _catch_up(self):
+        if self.version is None:
+            self._reload(from_snapshot=True)
+        while True:
+            entries = storage.read_journal(self.version)
+            if entries is None:
+                self._reload()
+                return
+            if not entries:
+                return
+            self._apply(entries)
+
+    def _reload(self, from_snapshot=False):
+        loaded = snapshot.load_usable() if from_snapshot else None
+        if loaded is not None:
+            self.snapshot_loads += 1
+        version, tours, bookings = loaded or storage.load_all()
+        by_tour = {}
+        by_code = {}
+        for b in bookings:
+            by_tour.setdefault(b.tour_id, []).append(b)
+            by_code[b.code] = b
+        search = BookingSearchIndex()
+        search.rebuild(bookings)
+        departures = sorted((departure_key(t), t.id) for t, _ in tours)
+        self.tours = {t.id: t for t, _ in tours}
+        self.seat_maps = {t.id: m for t, m in tours}
+        self.bookings = bookings
+        self.bookings_by_tour = by_tour
+        self.bookings_by_code = by_code
+        self.search = search
+        self.departures = departures
+        # 整体加载时不知道每个团期最后的修改序号，统一用当前版本号（只会偏大，不会错）
+        self.tour_versions = dict.fromkeys(self.tours, version)
+        self.version = version
+        self.reloads += 1
+
+    def _apply(self, entries):
+        """按顺序重放一批 journal 记录"""
+        tours = dict(self.tours)
+        for seq, op, payload in entries:
+            if op == 'book':
+                self._apply_book(tours, payload)
+                touched = [payload['tour_id']]
+            elif op == 'hold':
+                self._update_seats(tours, payload['tour_id'], lambda m: m.hold(payload['seats']))
+                touched = [payload['tour_id']]
+            elif op == 'unhold':
+                self._update_seats(tours, payload['tour_id'], lambda m: m.release(payload['seats']))
+                touched = [payload['tour_id']]
+            elif op == 'create_tour':
+                tour = Tour.from_dict(payload)
+                tours[tour.id] = tour
+                self.seat_maps[tour.id] = SeatMap(tour.max_seats)
+                insort(self.departures, (departure_key(tour), tour.id))
+                touched = [tour.id]
+            elif op == 'delete_tour':
+                touched = self._drop_tours(tours, [payload['tour_id']])
+            elif op == 'purge':
+                touched = self._drop_tours(tours, payload['tour_ids'], drop_orphans=True)
+            else:
+                touched = []
+            for tour_id in touched:
+                self.tour_versions[tour_id] = seq
+            self.replayed += 1
+        # 先发布新的 tours 再更新版本号：读者先读版本号再读数据，数据不会比版本号旧
+        self.tours = tours
+        self.version = seq
+
+    def _apply_book(self, tours, payload):
+        booking = Booking.from_dict(payload)
+        tour_id = booking.tour_id
+        self.bookings.append(booking)
+        self.bookings_by_tour.setdefault(tour_id, []).append(booking)
+        self.bookings_by_code[booking.code] = booking
+        self.search.add(booking)
+        self._update_seats(tours, tour_id, lambda m: m.take(booking.seats))
+
+    def _update_seats(self, tours, tour_id, change):
+        """复制一份座位表修改后替换，同时让团期的已预订人数跟着变"""
+        tour = tours.get(tour_id)
+        seat_map = self.seat_maps.get(tour_id)
+        if tour is None or seat_map is None:
+            return
+        seat_map = SeatMap(tour.max_seats, seat_map.states)
+        change(seat_map)
+        self.seat_maps[tour_id] = seat_map
+        tours[tour_id] = tour.replace(booked=seat_map.booked)
+
+    def _drop_tours(self, tours, tour_ids, drop_orphans=False):
+        """去掉一批班次和它们的预订；过期清理时连孤立预订一起去掉。返回受影响的团期ID"""
+        for tour_id in tour_ids:
+            tours.pop(tour_id, None)
+            self.seat_maps.pop(tour_id, None)
+        dropped = set(tour_ids)
+        if drop_orphans:
+            dropped.update(tid for tid in self.bookings_by_tour if tid not in tours)
+        # 一次清理可能删掉大量预订：各列表都只过滤重建一次，不逐条 del（逐条删是 O(k·n)）
+        self.departures = [entry for entry in self.departures if entry[1] not in dropped]
+        removed = []
+        for tour_id in dropped:
+            for b in self.bookings_by_tour.pop(tour_id, []):
+                self.bookings_by_code.pop(b.code, None)
+                removed.append(b)
+        self.search.remove_many(removed)
+        self.bookings = [b for b in self.bookings if b.tour_id not in dropped]
+        return dropped
+
+
+def departure_key(tour):
+    """排序用的出发时间戳，直接使用建团时存下的 departs_at"""
+    return UNPARSED if tour.departs_at is None else tour.departs_at
+
+
+# 进程内唯一的缓存实例
+dataset = DatasetCache()
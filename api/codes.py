@@ -0,0 +1,76 @@
+"""预订码生成：BK + 5位编码后的序号 + 1位校验字符（格式和原来的 BK + 6位一样）
+
+原来是6位随机字符，从不检查重复，预订多了以后必然撞码。现在：
+- 序号存在 meta 表里，在保存预订的写事务里分配；写事务跨进程互斥，所以多进程也不会重复
+- 序号先在 36^5 范围内做一次一一映射再编码，相邻两单的预订码看不出先后
+- 最后一位是 ISO 7064 MOD 37,36 校验字符，输错一位或相邻两位颠倒都能发现
+- 旧数据里的随机码可能碰巧等于新码：分配时按预订码索引查一次，撞上就跳过这个序号
+"""
+import string
+
+ALPHABET = string.digits + string.ascii_uppercase
+PREFIX = 'BK'
+BODY_LENGTH = 5
+SPACE = len(ALPHABET) ** BODY_LENGTH
+# 与 SPACE（2^10 * 3^10）互素的乘数，seq -> (seq * MULTIPLIER + OFFSET) % SPACE 是一一映射
+MULTIPLIER = 1000003
+OFFSET = 20240101
+# 连续这么多个序号都撞上旧码时放弃（正常情况下一次就成功）
+MAX_ATTEMPTS = 100
+
+SEQ_KEY = 'booking_code_seq'
+
+
+def check_char(body):
+    """ISO 7064 MOD 37,36 校验字符"""
+    p = 36
+    for ch in body:
+        s = (p + ALPHABET.index(ch)) % 36 or 36
+        p = s * 2 % 37
+    return ALPHABET[(1 - p) % 36]
+
+
+def encode(seq):
+    """第 seq 个预订码"""
+    n = (seq * MULTIPLIER + OFFSET) % SPACE
+    chars = []
+    for _ in range(BODY_LENGTH):
+        n, r = divmod(n, len(ALPHABET))
+        chars.append(ALPHABET[r])
+    body = ''.join(reversed(chars))
+    return PREFIX + body + check_char(body)
+
+
+def looks_like_code(code):
+    """格式是否像预订码（BK + 6位数字/大写字母），不看校验位；旧数据里的随机码也是这个格式"""
+    return (isinstance(code, str) and len(code) == len(PREFIX) + BODY_LENGTH + 1 and code.startswith(PREFIX)
+            and all(ch in ALPHABET for ch in code[len(PREFIX):]))
+
+
+def is_valid(code):
+    """是否是本模块生成的预订码（格式和校验位都对）；旧数据里的随机码通常不是"""
+    return looks_like_code(code) and check_char(code[len(PREFIX):-1]) == code[-1]
+
+
+def is_mistyped(code):
+    """格式像预订码但校验位不对。旧数据里的随机码也会这样，所以只在按码没查到预订时才据此判断输错"""
+    code = code.strip().upper() if isinstance(code, str) else code
+    return looks_like_code(code) and not is_valid(code)
+
+
+def allocate(conn, count=1):
+    """在调用方的写事务里分配 count 个不重复的预订码"""
+    row = conn.execute('SELECT value FROM meta WHERE key = ?', (SEQ_KEY,)).fetchone()
+    seq = int(row['value']) if row else 0
+    result = []
+    for _ in range(count):
+        for _ in range(MAX_ATTEMPTS):
+            code = encode(seq)
+            seq += 1
+            if not conn.execute('SELECT 1 FROM bookings WHERE code = ?', (code,)).fetchone():
+                break
+        else:
+            raise RuntimeError('无法生成不重复的预订码')
+        result.append(code)
+    conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (SEQ_KEY, str(seq)))
+    return result
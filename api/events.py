@@ -0,0 +1,249 @@
+"""团期座位变化的实时推送（Server-Sent Events）
+
+一个后台线程（每个进程一个，有订阅者时才工作）顺着 journal 读新的修改，
+按团期分发给订阅者，所以别的进程里完成的预订也能推送出来：
+- taken：座位被预订；held：座位被别人临时保留；released：保留的座位被释放（保留到期、取消或被替换）
+- closed：班次被删除或清理
+- reset：journal 已被裁剪或订阅者积压太多，随后结束这条流，浏览器自动重连拿快照
+
+每个订阅者只是一个有上限的队列加一个 Event，空闲连接不占额外线程；
+总订阅数有上限，超出时拒绝新连接。WSGI 下每条连接由 stream() 占一个线程等待，
+ASGI 下（asgi.py）由 notify 回调唤醒事件循环，不占线程。
+
+默认不开启：同步 WSGI worker 或 Vercel 函数里每条长连接一直占着一个 worker / 一次调用，
+几十个打开的预订页就能把服务占满。这时预订页改为定时轮询座位快照（带 ETag，多数是304）。
+部署方式能承受长连接时设置 BOOKING_SSE=1 打开；asgi.py 入口下长连接不占线程，默认打开。
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import storage
+
+ENABLED = os.environ.get('BOOKING_SSE', '0') == '1'
+POLL_INTERVAL = float(os.environ.get('BOOKING_SSE_POLL', '0.5'))
+HEARTBEAT_INTERVAL = float(os.environ.get('BOOKING_SSE_HEARTBEAT', '15'))
+# 单个连接最长保持多久，之后由浏览器自动重连（避免代理或函数超时把连接掐断在半路）
+STREAM_MAX_SECONDS = float(os.environ.get('BOOKING_SSE_MAX_SECONDS', '600'))
+MAX_SUBSCRIBERS = int(os.environ.get('BOOKING_SSE_MAX_CLIENTS', '5000'))
+# 每个订阅者最多积压多少条事件，超出后只发一个 reset
+QUEUE_SIZE = 100
+# 浏览器断线后多久重连（毫秒）
+RETRY_MS = 3000
+
+logger = logging.getLogger(__name__)
+
+
+class BrokerFull(Exception):
+    """订阅数已达上限"""
+
+
+class Subscriber:
+    """一个 SSE 连接的事件队列"""
+    __slots__ = ('tour_id', 'queue', 'ready', 'lagged', 'notify')
+
+    def __init__(self, tour_id):
+        self.tour_id = tour_id
+        self.queue = deque()
+        self.ready = threading.Event()
+        self.lagged = False
+        self.notify = None  # 有新事件时额外调用（在推送线程里），ASGI 用它唤醒事件循环
+
+    def push(self, event):
+        if len(self.queue) >= QUEUE_SIZE:
+            self.lagged = True
+        else:
+            self.queue.append(event)
+        self.ready.set()
+        notify = self.notify
+        if notify is not None:
+            notify()
+
+    def wait(self, timeout):
+        """等到有事件或超时，返回取出的事件列表；积压过多时只返回一个 reset"""
+        self.ready.wait(timeout)
+        self.ready.clear()
+        return self.drain()
+
+    def drain(self):
+        """不等待，取出当前积压的事件"""
+        if self.lagged:
+            self.lagged = False
+            self.queue.clear()
+            return [(None, 'reset', {})]
+        events = []
+        while self.queue:
+            events.append(self.queue.popleft())
+        return events
+
+
+class EventBroker:
+    """按团期分发 journal 里的座位变化"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}  # tour_id -> set(Subscriber)
+        self.count = 0
+        self.cursor = None     # 已分发到的 journal 序号
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.delivered = 0
+
+    def subscribe(self, tour_id):
+        """登记一个订阅者，超过上限时抛出 BrokerFull"""
+        sub = Subscriber(tour_id)
+        with self.lock:
+            if self.count >= MAX_SUBSCRIBERS:
+                raise BrokerFull('实时连接数已满')
+            if self.cursor is None:
+                self.cursor = storage.current_version()
+            self.subscribers.setdefault(tour_id, set()).add(sub)
+            self.count += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='sse-broker', daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            subs = self.subscribers.get(sub.tour_id)
+            if subs and sub in subs:
+                subs.discard(sub)
+                self.count -= 1
+                if not subs:
+                    del self.subscribers[sub.tour_id]
+
+    def wake(self):
+        """本进程写入后调用，让推送不必等到下一次轮询"""
+        self.wakeup.set()
+
+    def stats(self):
+        return {'subscribers': self.count, 'tours': len(self.subscribers),
+                'cursor': self.cursor, 'delivered': self.delivered}
+
+    # ---------- 内部实现 ----------
+    def _run(self):
+        while True:
+            self.wakeup.wait(POLL_INTERVAL)
+            self.wakeup.clear()
+            if not self.count:
+                # 没人订阅时不读 journal，重新订阅时从当时的版本开始
+                with self.lock:
+                    if not self.count:
+                        self.cursor = None
+                continue
+            try:
+                self._poll()
+            except Exception:
+                logger.exception('读取座位变化失败')
+
+    def _poll(self):
+        while True:
+            entries = storage.read_journal(self.cursor)
+            if entries is None:
+                # journal 已被裁剪，无法补发中间的变化：让所有订阅者重新拿快照
+                self.cursor = storage.current_version()
+                self._broadcast((self.cursor, 'reset', {}))
+                return
+            if not entries:
+                return
+            for seq, op, payload in entries:
+                for tour_id, event in journal_events(op, payload):
+                    self._publish(tour_id, (seq, event, payload_data(event, payload)))
+            self.cursor = entries[-1][0]
+
+    def _publish(self, tour_id, event):
+        with self.lock:
+            subs = list(self.subscribers.get(tour_id, ()))
+        for sub in subs:
+            sub.push(event)
+        self.delivered += len(subs)
+
+    def _broadcast(self, event):
+        with self.lock:
+            subs = [sub for subs in self.subscribers.values() for sub in subs]
+        for sub in subs:
+            sub.push(event)
+
+
+def journal_events(op, payload):
+    """一条 journal 记录对应的 (团期ID, 事件名) 列表"""
+    if op == 'book':
+        return [(payload['tour_id'], 'taken')]
+    if op == 'hold':
+        return [(payload['tour_id'], 'held')]
+    if op == 'unhold':
+        return [(payload['tour_id'], 'released')]
+    if op == 'delete_tour':
+        return [(payload['tour_id'], 'closed')]
+    if op == 'purge':
+        return [(tour_id, 'closed') for tour_id in payload['tour_ids']]
+    return []
+
+
+def payload_data(event, payload):
+    """推给浏览器的事件内容：只带座位号，不带预订人信息"""
+    if event == 'taken':
+        return {'seats': payload['seat_numbers']}
+    if event in ('held', 'released'):
+        return {'seats': payload['seats']}
+    return {}
+
+
+def format_event(event, data, event_id=None):
+    """编码成一条 SSE 消息"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append('data: ' + json.dumps(data, ensure_ascii=False))
+    return '\n'.join(lines) + '\n\n'
+
+
+# 注释行作为心跳，防止代理把空闲连接断开
+HEARTBEAT = ': ping\n\n'
+
+
+def stream_start(snapshot_version, snapshot):
+    """连接开头的内容：重连间隔和当前快照"""
+    return f'retry: {RETRY_MS}\n\n' + format_event('snapshot', snapshot, snapshot_version)
+
+
+def encode_events(events, snapshot_version):
+    """把一批事件编码成 SSE 文本，返回 (文本, 是否应结束这条流)"""
+    parts = []
+    for seq, event, data in events:
+        # 快照里已经包含的变化不再重复推送
+        if seq is not None and seq <= snapshot_version:
+            continue
+        parts.append(format_event(event, data, seq))
+        if event in ('closed', 'reset'):
+            return ''.join(parts), True
+    return ''.join(parts), False
+
+
+def stream(sub, snapshot_version, snapshot):
+    """一个连接的事件流：先发快照，之后推送增量和心跳注释，到时间后结束让浏览器重连"""
+    try:
+        yield stream_start(snapshot_version, snapshot)
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        while time.monotonic() < deadline:
+            events = sub.wait(HEARTBEAT_INTERVAL)
+            if not events:
+                yield HEARTBEAT
+                continue
+            text, finished = encode_events(events, snapshot_version)
+            if text:
+                yield text
+            if finished:
+                return
+    finally:
+        broker.unsubscribe(sub)
+
+
+# 进程内唯一的推送中心
+broker = EventBroker()
@@ -0,0 +1,135 @@
+"""预订导出：CSV / NDJSON，边生成边输出
+
+- 数据来自进程内缓存（cache.DatasetCache），不再扫数据库；每条预订按 tour_id 在团期字典里
+  取日期、目的地和车型，不逐行查找
+- 按出发日期导出时用缓存里按出发时间排好序的 departures 二分定位，只遍历范围内的班次
+- 输出攒够 CHUNK_SIZE 再交出去，由服务器分块发送；内存占用与导出行数无关
+
+导出期间新写入的预订可能出现也可能不出现在结果里（缓存的列表只在末尾追加或整体替换）。
+"""
+import csv
+import io
+import json
+from bisect import bisect_left
+from itertools import islice
+
+import storage
+
+CHUNK_SIZE = 64 * 1024
+FORMATS = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson; charset=utf-8'}
+
+TOUR_COLUMNS = ['tour_id', 'date', 'time', 'destination', 'vehicle_model']
+BOOKING_COLUMNS = ['code', 'name', 'phone', 'seat_numbers'] + TOUR_COLUMNS + ['created_at']
+# 乘客名单：每个座位一行，按座位号排序
+MANIFEST_COLUMNS = ['seat', 'code', 'name', 'phone'] + TOUR_COLUMNS + ['created_at']
+
+
+def date_range_tours(cache, date_from=None, date_to=None):
+    """出发日期在 [date_from, date_to] 之间的班次ID（按出发时间排序），日期格式不对时抛出 ValueError"""
+    departures = cache.departures
+    lo = hi = None
+    if date_from:
+        lo = storage.departure_timestamp(date_from, '00:00')
+        if lo is None:
+            raise ValueError('开始日期格式应为 YYYY-MM-DD')
+    if date_to:
+        hi = storage.departure_timestamp(date_to, '23:59')
+        if hi is None:
+            raise ValueError('结束日期格式应为 YYYY-MM-DD')
+    # 出发时间无法解析的班次（UNPARSED）排在最前面，不算在任何日期里
+    start = bisect_left(departures, (float('-inf'), float('inf'))) if lo is None else bisect_left(departures, (lo,))
+    end = len(departures) if hi is None else bisect_left(departures, (hi + 60,))
+    return [tour_id for _, tour_id in departures[start:end]]
+
+
+def booking_rows(cache, tour_id=None, date_from=None, date_to=None):
+    """预订行：不带条件时按创建顺序导出全部，否则按班次出发时间导出选中班次的预订"""
+    tours = cache.tours
+    if tour_id is not None:
+        tour_ids = [tour_id]
+    elif date_from or date_to:
+        tour_ids = date_range_tours(cache, date_from, date_to)
+    else:
+        tour_ids = None
+    return _booking_rows(cache, tours, tour_ids)
+
+
+def _booking_rows(cache, tours, tour_ids):
+    if tour_ids is None:
+        bookings = cache.bookings
+        selected = islice(bookings, len(bookings))
+    else:
+        by_tour = cache.bookings_by_tour
+        selected = (b for tid in tour_ids for b in by_tour.get(tid, ()))
+    for b in selected:
+        row = _tour_fields(tours.get(b.tour_id), b.tour_id)
+        row.update(code=b.code, name=b.name, phone=b.phone, seat_numbers=b.seats.tolist(),
+                   created_at=b.created_at)
+        yield row
+
+
+def manifest_rows(cache, tour_id):
+    """一个班次的乘客名单：每个座位一行，按座位号排序；没有座位号的预订排在最后"""
+    tour = cache.tours.get(tour_id)
+    entries = []
+    for b in cache.bookings_by_tour.get(tour_id, ()):
+        for seat in b.seats or (None,):
+            entries.append((seat is None, seat or 0, b))
+    entries.sort(key=lambda e: e[:2])
+    for _, seat, b in entries:
+        row = _tour_fields(tour, tour_id)
+        row.update(seat=seat or None, code=b.code, name=b.name, phone=b.phone, created_at=b.created_at)
+        yield row
+
+
+def _tour_fields(tour, tour_id):
+    if tour is None:
+        return {'tour_id': tour_id, 'date': None, 'time': None, 'destination': None, 'vehicle_model': None}
+    return {'tour_id': tour.id, 'date': tour.date, 'time': tour.time, 'destination': tour.destination,
+            'vehicle_model': tour.vehicle_model}
+
+
+# ---------- 输出格式 ----------
+def csv_chunks(rows, columns):
+    """CSV（带 BOM，Excel 直接打开不乱码）"""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    buf.write('\ufeff')
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([_cell(row[c]) for c in columns])
+        if buf.tell() >= CHUNK_SIZE:
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode('utf-8')
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return ' '.join(map(str, value))
+    # 防止以 = + - @ 开头的姓名等在表格软件里被当成公式执行
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@'):
+        return "'" + value
+    return value
+
+
+def ndjson_chunks(rows, columns):
+    """每行一个 JSON 对象"""
+    parts = []
+    size = 0
+    for row in rows:
+        line = json.dumps({c: row[c] for c in columns}, ensure_ascii=False) + '\n'
+        parts.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(parts).encode('utf-8')
+            parts = []
+            size = 0
+    yield ''.join(parts).encode('utf-8')
+
+
+def chunks(rows, columns, fmt):
+    return csv_chunks(rows, columns) if fmt == 'csv' else ndjson_chunks(rows, columns)
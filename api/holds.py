@@ -0,0 +1,161 @@
+"""选座时的临时座位保留（带过期时间）
+
+顾客选座时先保留座位 HOLD_TTL 秒，提交预订时凭保留凭证在同一事务里转成预订；
+别人在这段时间里看到这些座位不可选，不会到提交时才发现冲突。
+
+过期释放不靠定时扫表：本进程建的保留按到期时间放进小顶堆，后台线程睡到
+最早的到期时间，再按 holds.expires_at 索引取出到期的保留释放；别的进程建的
+保留由每 HOLD_SWEEP_INTERVAL 秒一次的索引查询兜底，预订/保留时也会顺带释放
+同一团期已到期的保留，所以即使后台线程没跑，过期保留也不会挡住别人。
+
+保留是匿名的，为了不让一个脚本把所有座位一直占着：每个客户端（按地址）同时最多
+MAX_HOLDS_PER_CLIENT 份保留、共 MAX_HELD_SEATS_PER_CLIENT 个座位，每个团期最多
+TOUR_HOLD_SHARE 比例的座位处于保留状态。超出时不保留，顾客仍可以直接提交预订。
+
+保留怎么结束（转成预订、取消、替换、过期）由 storage 在提交事务后统一计数
+（metrics.hold_ends），不管是后台线程释放的还是预订时顺带释放的都算在内。
+"""
+import heapq
+import logging
+import os
+import threading
+import time
+
+import metrics
+import storage
+
+HOLD_TTL = float(os.environ.get('BOOKING_HOLD_TTL', '300'))
+HOLD_SWEEP_INTERVAL = float(os.environ.get('BOOKING_HOLD_SWEEP_INTERVAL', '60'))
+MAX_HOLDS_PER_CLIENT = int(os.environ.get('BOOKING_HOLD_MAX_PER_CLIENT', '3'))
+MAX_HELD_SEATS_PER_CLIENT = int(os.environ.get('BOOKING_HOLD_MAX_SEATS', '10'))
+TOUR_HOLD_SHARE = float(os.environ.get('BOOKING_HOLD_TOUR_SHARE', '0.5'))
+LIMITS = (MAX_HOLDS_PER_CLIENT, MAX_HELD_SEATS_PER_CLIENT, TOUR_HOLD_SHARE)
+
+logger = logging.getLogger(__name__)
+
+
+class HoldReaper:
+    """到期保留的释放线程，附带保留请求的计数（保留怎么结束的由 metrics.hold_ends 计数）"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.heap = []  # (到期时间戳, 保留凭证)
+        self.thread = None
+        self.created = 0
+        self.conflicts = 0
+        self.limited = 0
+        self.convert_failed = 0
+        self.stale_tokens = 0
+        self.reaped = 0
+        self.reap_runs = 0
+        self.reap_seconds = 0.0
+
+    def track(self, token, expires_at):
+        """登记一份本进程建的保留，到期时唤醒释放线程"""
+        with self.cond:
+            heapq.heappush(self.heap, (expires_at, token))
+            if self.heap[0][1] == token:
+                self.cond.notify()
+
+    def start(self):
+        """启动后台释放线程（守护线程，每个进程一个）"""
+        self.thread = threading.Thread(target=self._run, name='hold-reaper', daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def reap(self, now=None):
+        """释放所有已到期的保留，返回份数"""
+        started = time.perf_counter()
+        expired = storage.expire_holds(now)
+        self.reap_runs += 1
+        self.reap_seconds += time.perf_counter() - started
+        self.reaped += expired
+        return expired
+
+    def stats(self):
+        """保留转化率和过期释放吞吐"""
+        ends = metrics.hold_ends
+        converted = ends.get('converted')
+        cancelled = ends.get('cancelled')
+        expired = ends.get('expired')
+        finished = converted + expired + cancelled
+        return {
+            'active': storage.count_holds(),
+            'pending_timers': len(self.heap),
+            'created': self.created,
+            'replaced': ends.get('replaced'),
+            'cancelled': cancelled,
+            'conflicts': self.conflicts,
+            'limited': self.limited,
+            'converted': converted,
+            'convert_failed': self.convert_failed,
+            'stale_tokens': self.stale_tokens,
+            'expired': expired,
+            'conversion_ratio': round(converted / finished, 4) if finished else 0.0,
+            'reap_runs': self.reap_runs,
+            'reaped': self.reaped,
+            'expired_per_second': round(self.reaped / self.reap_seconds, 1) if self.reap_seconds else 0.0,
+        }
+
+    # ---------- 内部实现 ----------
+    def _run(self):
+        while True:
+            with self.cond:
+                now = time.time()
+                next_due = self.heap[0][0] if self.heap else now + HOLD_SWEEP_INTERVAL
+                if next_due > now:
+                    self.cond.wait(min(next_due - now, HOLD_SWEEP_INTERVAL))
+                now = time.time()
+                # 到期的计时器全部出堆：保留可能早已转成预订或被取消，统一交给索引查询处理
+                while self.heap and self.heap[0][0] <= now:
+                    heapq.heappop(self.heap)
+            try:
+                self.reap(now)
+            except Exception:
+                logger.exception('座位保留过期释放失败')
+
+
+def hold(tour_id, seats, token=None, client=None):
+    """保留座位（或替换 token 原来的保留），返回 (新凭证, 到期时间戳)；seats 为空时只取消
+
+    座位已被占用时抛出 storage.BookingConflict，超出保留上限时抛出 storage.HoldLimitExceeded。
+    """
+    expires_at = time.time() + HOLD_TTL
+    try:
+        new_token = storage.hold_seats(tour_id, seats, expires_at, token, client, LIMITS)
+    except storage.BookingConflict:
+        reaper.conflicts += 1
+        raise
+    except storage.HoldLimitExceeded:
+        reaper.limited += 1
+        raise
+    if new_token is None:
+        return None, None
+    reaper.created += 1
+    reaper.track(new_token, expires_at)
+    return new_token, expires_at
+
+
+def cancel(token):
+    """取消保留，返回释放的座位（保留已不存在时为 None）"""
+    return storage.release_hold(token)
+
+
+def book(booking, token):
+    """把保留转成预订（同一事务），冲突时抛出 storage.BookingConflict"""
+    try:
+        converted = storage.reserve_seats(booking, token)
+    except storage.BookingConflict:
+        reaper.convert_failed += 1
+        raise
+    if not converted:
+        # 凭证对应的保留已经过期或不存在，但座位还空着，按普通预订成功；不算转化失败
+        reaper.stale_tokens += 1
+
+
+def start_reaper():
+    return reaper.start()
+
+
+# 进程内唯一的释放线程
+reaper = HoldReaper()
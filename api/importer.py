@@ -0,0 +1,223 @@
+"""批量导入团期和预订（CSV / NDJSON）
+
+    python api/importer.py tours schedule.csv
+    python api/importer.py bookings bookings.ndjson --dry-run
+    POST /admin/import/tours?format=csv      （管理员，请求体就是文件内容）
+
+- 边读边解析，每 BATCH_SIZE 行（最多 MAX_BATCH_SIZE）一批，每批一个写事务（executemany），
+  大文件不会长时间占着写锁，别的预订可以在批与批之间提交
+- 一批里有任何一行出错这一批整体回滚，其它批照常写入；报告出错行的行号和原因，
+  以及每一批的行号范围和是否已写入，改好出错的行后只需重新导入没写入的那几批
+- 团期ID在每批的事务里从 meta 里的计数器连续分配（删掉的ID不会重用）；没给预订码的预订用 codes.allocate 分配
+- 试运行时每批都回滚，但前面各批本会占掉的座位和预订码会带到后面的批次，结果和真正导入一致
+- 报告行数、耗时和每秒行数
+
+团期字段：date, time, destination, vehicle_model（可省略）, max_seats
+预订字段：tour_id, name, phone, seat_numbers（CSV 里用空格或逗号分隔）, code 和 created_at（可省略）
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import storage
+from models import MAX_SEAT
+
+KINDS = ['tours', 'bookings']
+FORMATS = ['csv', 'ndjson']
+BATCH_SIZE = 1000
+MAX_BATCH_SIZE = 5000
+# 报告里最多列出多少个出错行（总数另给）
+MAX_REPORTED_ERRORS = 100
+
+
+# ---------- 解析 ----------
+def read_rows(stream, fmt):
+    """逐行读出 (行号, 字段字典)；某一行无法解析时字段字典换成错误原因字符串"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_no, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_no, '不是有效的 JSON'
+            continue
+        yield line_no, row if isinstance(row, dict) else '每行应是一个 JSON 对象'
+
+
+def _text(row, name, required=True):
+    value = row.get(name)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise ValueError(f'缺少 {name}')
+    return value
+
+
+def _int(row, name):
+    value = _text(row, name)
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{name} 应为整数')
+
+
+def parse_tour(row):
+    """校验一行团期，返回 storage.import_tours 要的字典"""
+    tour = {
+        'date': _text(row, 'date'),
+        'time': _text(row, 'time'),
+        'destination': _text(row, 'destination'),
+        'vehicle_model': _text(row, 'vehicle_model', required=False) or '未指定',
+        'max_seats': _int(row, 'max_seats'),
+    }
+    if storage.parse_departure(tour['date'], tour['time']) is None:
+        raise ValueError('出发日期或时间格式不对（YYYY-MM-DD / HH:MM）')
+    if not 1 <= tour['max_seats'] <= MAX_SEAT:
+        raise ValueError(f'max_seats 应在 1~{MAX_SEAT} 之间')
+    return tour
+
+
+def parse_booking(row, created_at):
+    """校验一行预订（座位号的范围和占用由 storage.import_bookings 在事务里检查）"""
+    seats = row.get('seat_numbers')
+    if isinstance(seats, str):
+        seats = seats.replace(',', ' ').replace(';', ' ').split()
+    if seats in (None, '', []):
+        raise ValueError('请至少选择一个座位')
+    return {
+        'tour_id': _int(row, 'tour_id'),
+        'name': _text(row, 'name'),
+        'phone': _text(row, 'phone'),
+        'seat_numbers': seats,
+        'code': _text(row, 'code', required=False).upper() or None,
+        'created_at': _text(row, 'created_at', required=False) or created_at,
+    }
+
+
+def batches(rows, parse, batch_size, counter):
+    """把行攒成批，逐批给出 (起始行号, 结束行号, [解析成功的行], {行号: 解析错误})
+
+    counter['rows'] 累计读到的行数
+    """
+    batch = []
+    errors = {}
+    first_row = last_row = None
+    for row_no, row in rows:
+        counter['rows'] += 1
+        if first_row is None:
+            first_row = row_no
+        last_row = row_no
+        try:
+            if isinstance(row, str):
+                raise ValueError(row)
+            batch.append(parse(row_no, row))
+        except ValueError as e:
+            errors[row_no] = str(e)
+        if len(batch) + len(errors) >= batch_size:
+            yield first_row, last_row, batch, errors
+            batch = []
+            errors = {}
+            first_row = None
+    if first_row is not None:
+        yield first_row, last_row, batch, errors
+
+
+# ---------- 导入 ----------
+def import_batch(kind, batch, errors, dry_run, claimed):
+    """在一个事务里写入一批，返回这一批的报告；出错或试运行时这一批回滚"""
+    result = {}
+    try:
+        if kind == 'tours':
+            if errors:
+                raise storage.ImportRolledBack(len(batch))
+            first_id, count = storage.import_tours(batch, dry_run)
+            result.update(first_tour_id=first_id, last_tour_id=first_id + count - 1 if count else None)
+        else:
+            count = storage.import_bookings(batch, errors, dry_run, claimed)
+        result.update(committed=True, imported=count)
+    except storage.ImportRolledBack:
+        result.update(committed=False, imported=0)
+    return result
+
+
+def run(kind, stream, fmt, dry_run=False, batch_size=BATCH_SIZE):
+    """导入一个文件流，返回报告字典"""
+    started = time.perf_counter()
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    errors = {}
+    counter = {'rows': 0}
+    report_batches = []
+    claimed = {'seats': {}, 'codes': set()}
+    if kind == 'tours':
+        parse = lambda row_no, row: parse_tour(row)
+    else:
+        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        parse = lambda row_no, row: (row_no, parse_booking(row, created_at))
+    try:
+        for first_row, last_row, batch, batch_errors in batches(read_rows(stream, fmt), parse, batch_size, counter):
+            result = import_batch(kind, batch, batch_errors, dry_run, claimed)
+            errors.update(batch_errors)
+            report_batches.append(dict(first_row=first_row, last_row=last_row, error_count=len(batch_errors),
+                                       **result))
+    except UnicodeDecodeError:
+        errors[counter['rows'] + 1] = '文件不是 UTF-8 编码'
+    seconds = time.perf_counter() - started
+    imported = sum(b['imported'] for b in report_batches)
+    rejected = sum(1 for b in report_batches if b['error_count'])
+    if dry_run:
+        message = f'{len(errors)} 行有错误（试运行，未写入）' if errors else \
+            f'校验通过，共 {counter["rows"]} 行（试运行，未写入）'
+    elif errors:
+        message = f'{len(errors)} 行有错误，所在的 {rejected} 批未导入；其余 {imported} 行已导入'
+    else:
+        message = f'导入成功，共 {imported} 行'
+    return {
+        'kind': kind,
+        'format': fmt,
+        'dry_run': dry_run,
+        'success': not errors,
+        'message': message,
+        'rows': counter['rows'],
+        'valid': counter['rows'] - len(errors),
+        'imported': imported,
+        'error_count': len(errors),
+        'errors': [{'row': row_no, 'message': errors[row_no]} for row_no in sorted(errors)[:MAX_REPORTED_ERRORS]],
+        'batch_size': batch_size,
+        'batches': report_batches,
+        'seconds': round(seconds, 3),
+        'rows_per_sec': round(counter['rows'] / seconds, 1) if seconds else 0.0,
+    }
+
+
+def guess_format(filename):
+    return 'ndjson' if os.path.splitext(filename)[1].lower() in ('.ndjson', '.jsonl', '.json') else 'csv'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量导入团期或预订（CSV / NDJSON）')
+    parser.add_argument('kind', choices=KINDS)
+    parser.add_argument('file')
+    parser.add_argument('--format', choices=FORMATS, help='默认按扩展名判断（.ndjson/.jsonl 为 NDJSON，其余按 CSV）')
+    parser.add_argument('--dry-run', action='store_true', help='只校验，不写入')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help=f'每批（每个事务）的行数，最多 {MAX_BATCH_SIZE}')
+    args = parser.parse_args()
+
+    storage.init_db()
+    with open(args.file, 'rb') as f:
+        report = run(args.kind, f, args.format or guess_format(args.file), args.dry_run, args.batch_size)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    sys.exit(0 if report['success'] else 1)
+
+
+if __name__ == '__main__':
+    main()
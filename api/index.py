@@ -1,305 +1,201 @@
-from flask import Flask, request, jsonify, session, redirect
-import json
-import random
-import string
+from flask import Flask, Request, Response, request, jsonify, session, redirect, make_response, stream_with_context, g
+from werkzeug.middleware.proxy_fix import ProxyFix
+from functools import wraps
+from urllib.parse import urlencode
+import time
 from datetime import datetime, timedelta
 import os
 
+import codes
+import events
+import export
+import holds
+import importer
+import metrics
+import storage
+import schedules
+import search
+import snapshot
+import sweeper
+from cache import dataset
+from models import Booking, Tour
+from profiling import SORT_KEYS, profiler
+from render import esc, get_html_template, page_parts
+from seatmap import normalize_seats
+
+# 请求体上限（字节）：超出时返回 413，读到一半超出的分块请求也一样。批量导入的文件可以大一些
+MAX_BODY_BYTES = int(os.environ.get('BOOKING_MAX_BODY', str(1 << 20)))
+MAX_IMPORT_BYTES = int(os.environ.get('BOOKING_IMPORT_MAX_BODY', str(64 << 20)))
+
+
+class BookingRequest(Request):
+    @property
+    def max_content_length(self):
+        return MAX_IMPORT_BYTES if self.path.startswith('/admin/import/') else MAX_BODY_BYTES
+
+
 app = Flask(__name__)
+app.request_class = BookingRequest
 # 设置一个密钥用于session
 app.secret_key = os.urandom(24)
+# 部署在反向代理（Vercel、nginx）后面时设置代理层数，request.remote_addr 才是真实的客户端地址
+# （座位保留按客户端地址限量）；不在代理后面时保持 0，否则客户端可以伪造 X-Forwarded-For
+PROXY_HOPS = int(os.environ.get('BOOKING_PROXY_HOPS', '0'))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS)
 
-# ============== 核心修改1：用文件存储替代内存，解决数据丢失问题 ==============
-# 定义数据文件路径，保存在Vercel的可写临时目录
-DATA_FILE = '/tmp/booking_data.json'
-
-def load_data():
-    """从文件加载所有数据（团期和预订记录）"""
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            # 如果文件读取失败，返回初始空数据
-            return {'tours': [], 'bookings': []}
-    # 文件不存在，返回初始空数据
-    return {'tours': [], 'bookings': []}
-
-def save_data(data):
-    """将所有数据保存到文件"""
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-# 程序启动时加载数据
-app_data = load_data()
-# 为了方便，将两个列表单独取出作为变量，但记住它们来自 app_data
-tours_db = app_data['tours']
-bookings_db = app_data['bookings']
+# ============== 核心修改1：用SQLite数据库存储，每次只读写涉及的行 ==============
+# 数据库位于Vercel的可写临时目录，旧的 /tmp/booking_data.json 会在首次启动时自动导入
+storage.init_db()
+# 后台定期做检查点并裁剪旧的修改记录（journal）
+storage.start_compactor()
+# 后台定期删除发车超过一周的班次及其预订
+sweeper.start_sweeper()
+# 后台按到期时间释放选座时的临时保留
+holds.start_reaper()
+# 后台定期把数据集写成二进制快照，新进程冷启动时先加载快照
+snapshot.start_snapshotter(dataset)
 # ============== 核心修改1结束 ==============
 
 # ---------- 工具函数 ----------
-def generate_booking_code():
-    return 'BK' + ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-
 # 简单的管理员密码验证（你可以修改这个密码）
 ADMIN_PASSWORD = "050522"
 
 # 检查管理员登录状态的装饰器
 def admin_required(f):
+    @wraps(f)
     def decorated_function(*args, **kwargs):
         if not session.get('is_admin'):
             return redirect('/admin/login')
         return f(*args, **kwargs)
     return decorated_function
 
-def is_tour_departed(tour_date, tour_time):
-    """检查班次是否已发车"""
-    try:
-        # 将日期和时间组合成datetime对象
-        tour_datetime_str = f"{tour_date} {tour_time}"
-        tour_datetime = datetime.strptime(tour_datetime_str, '%Y-%m-%d %H:%M')
-        
-        # 如果班次时间在当前时间之前，表示已发车
-        return tour_datetime < datetime.now()
-    except:
+def is_tour_departed(tour, now=None):
+    """检查班次是否已发车（用建团时存下的出发时间戳，不再每次解析日期）"""
+    departs_at = tour.departs_at
+    if departs_at is None:
+        # 日期时间格式不对的班次按未发车处理
         return False
+    return departs_at < (time.time() if now is None else now)
 
-def should_keep_tour(tour_date, tour_time):
-    """检查是否应该保留这个班次（发车后至少保留一周）"""
-    try:
-        tour_datetime_str = f"{tour_date} {tour_time}"
-        tour_datetime = datetime.strptime(tour_datetime_str, '%Y-%m-%d %H:%M')
-        current_time = datetime.now()
-        
-        # 如果班次已发车但未超过一周，保留
-        if tour_datetime < current_time:
-            # 计算发车后是否超过7天
-            time_passed = current_time - tour_datetime
-            return time_passed.days <= 7
-        
-        # 如果班次未发车，保留
-        return True
-    except:
-        return False
+# ---------- 请求指标 ----------
+# 抓取 /admin/metrics 时除了管理员登录，也可以用 Authorization: Bearer <BOOKING_METRICS_TOKEN>
+METRICS_TOKEN = os.environ.get('BOOKING_METRICS_TOKEN')
 
-def get_html_template(title, body_content):
-    """生成完整的HTML页面框架"""
-    return f'''
-<!DOCTYPE html>
-<html lang="zh-CN">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=5.0">
-    <title>{title} - 携程旅游订车助手</title>
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css">
-    <style>
-        /* 全局CSS样式 */
-        * {{ margin: 0; padding: 0; box-sizing: border-box; font-family: 'Segoe UI', 'Microsoft YaHei', sans-serif; }}
-        body {{ background: linear-gradient(135deg, #6a11cb 0%, #2575fc 100%); color: #333; min-height: 100vh; padding: 20px; }}
-        .container {{ max-width: 1200px; margin: 0 auto; }}
-        .navbar {{ background: white; padding: 15px 25px; border-radius: 12px; box-shadow: 0 4px 20px rgba(0,0,0,0.1); display: flex; justify-content: space-between; align-items: center; margin-bottom: 30px; }}
-        .logo {{ font-size: 1.5rem; font-weight: bold; color: #6a11cb; text-decoration: none; }}
-        .nav-links a {{ margin-left: 20px; color: #555; text-decoration: none; font-weight: 500; }}
-        .card {{ background: white; border-radius: 16px; padding: 25px; margin-bottom: 25px; box-shadow: 0 8px 30px rgba(0,0,0,0.12); transition: transform 0.3s; }}
-        .card:hover {{ transform: translateY(-5px); }}
-        .btn {{ display: inline-block; background: linear-gradient(to right, #6a11cb, #2575fc); color: white; padding: 12px 28px; border-radius: 50px; text-decoration: none; font-weight: 600; border: none; cursor: pointer; font-size: 1rem; }}
-        .btn:hover {{ opacity: 0.9; }}
-        .tour-card {{ border-left: 6px solid #6a11cb; }}
-        .status-available {{ background: #d4edda; color: #155724; padding: 5px 15px; border-radius: 20px; font-size: 0.9rem; display: inline-block; }}
-        .status-full {{ background: #f8d7da; color: #721c24; padding: 5px 15px; border-radius: 20px; font-size: 0.9rem; display: inline-block; }}
-        .status-departed {{ background: #e2e3e5; color: #383d41; padding: 5px 15px; border-radius: 20px; font-size: 0.9rem; display: inline-block; }}
-        .progress-bar {{ height: 10px; background: #e9ecef; border-radius: 5px; overflow: hidden; margin: 15px 0; }}
-        .progress-fill {{ height: 100%; background: linear-gradient(to right, #00b09b, #96c93d); border-radius: 5px; }}
-        /* 响应式设计 */
-        @media (max-width: 768px) {{
-            .container {{ padding: 0 10px; }}
-            .navbar {{ flex-direction: column; text-align: center; padding: 15px; }}
-            .nav-links {{ margin-top: 15px; }}
-            .nav-links a {{ margin: 0 10px; }}
-            .card {{ padding: 20px; }}
-        }}
-        /* 座位选择样式 */
-        .seat-map {{
-            display: grid;
-            grid-template-columns: repeat(5, 1fr); /* 每行最多5个座位 */
-            gap: 10px;
-            margin: 20px 0;
-        }}
-        .seat {{
-            padding: 15px;
-            text-align: center;
-            background: #e9ecef;
-            border-radius: 8px;
-            cursor: pointer;
-            font-weight: bold;
-            border: 2px solid #dee2e6;
-            transition: all 0.2s;
-        }}
-        .seat:hover {{
-            background: #d0ebff;
-            border-color: #74c0fc;
-        }}
-        .seat.selected {{
-            background: #51cf66;
-            color: white;
-            border-color: #2b8a3e;
-        }}
-        .seat.unavailable {{
-            background: #ffc9c9;
-            color: #868e96;
-            cursor: not-allowed;
-            border-color: #fa5252;
-        }}
-        /* 预订详情表格样式 */
-        .booking-details {{
-            margin-top: 20px;
-            border-top: 2px solid #eee;
-            padding-top: 20px;
-        }}
-        .booking-table {{
-            width: 100%;
-            border-collapse: collapse;
-            margin-top: 10px;
-        }}
-        .booking-table th, .booking-table td {{
-            padding: 10px;
-            text-align: left;
-            border-bottom: 1px solid #eee;
-        }}
-        .booking-table th {{
-            background: #f8f9fa;
-        }}
-        .booking-table tr:hover {{
-            background: #f5f5f5;
-        }}
-        /* 管理员登录样式 */
-        .login-container {{
-            max-width: 400px;
-            margin: 100px auto;
-            background: white;
-            padding: 40px;
-            border-radius: 16px;
-            box-shadow: 0 8px 30px rgba(0,0,0,0.15);
-        }}
-        .login-input {{
-            width: 100%;
-            padding: 12px;
-            margin: 15px 0;
-            border: 2px solid #ddd;
-            border-radius: 8px;
-            font-size: 1rem;
-        }}
-    </style>
-</head>
-<body>
-    <nav class="navbar">
-        <a href="/" class="logo"><i class="fas fa-bus"></i> 携程旅游订车助手</a>
-        <div class="nav-links">
-            <!-- 这是给客人看的首页链接 -->
-            <a href="/"><i class="fas fa-home"></i> 首页</a>
-            <!-- 这是管理员入口，需要密码验证 -->
-            <a href="/admin"><i class="fas fa-cog"></i> 管理</a>
-        </div>
-    </nav>
-    <div class="container">
-        {body_content}
-    </div>
-    <footer style="text-align: center; color: white; margin-top: 50px; padding: 20px; opacity: 0.8;">
-        <p>© 南野际</p>
-    </footer>
-    <script>
-        function showAlert(msg, type='success') {{
-            alert(msg);
-        }}
-        function copyToClipboard(text) {{
-            navigator.clipboard.writeText(text).then(() => alert('已复制: ' + text));
-        }}
-        function toggleBookingDetails(tourId) {{
-            const detailsDiv = document.getElementById('booking-details-' + tourId);
-            const toggleBtn = document.getElementById('toggle-btn-' + tourId);
-            if (detailsDiv.style.display === 'none') {{
-                detailsDiv.style.display = 'block';
-                toggleBtn.innerHTML = '<i class="fas fa-chevron-up"></i> 隐藏预订详情';
-                // 如果内容为空，则加载预订详情
-                if (detailsDiv.innerHTML.trim() === '') {{
-                    loadBookingDetails(tourId);
-                }}
-            }} else {{
-                detailsDiv.style.display = 'none';
-                toggleBtn.innerHTML = '<i class="fas fa-chevron-down"></i> 查看预订详情';
-            }}
-        }}
-        
-        async function loadBookingDetails(tourId) {{
-            try {{
-                const response = await fetch('/api/get_tour_bookings?tour_id=' + tourId);
-                const result = await response.json();
-                
-                if (result.success) {{
-                    const detailsDiv = document.getElementById('booking-details-' + tourId);
-                    let html = '';
-                    
-                    if (result.data.length === 0) {{
-                        html = '<p style="text-align: center; color: #666;">暂无预订记录</p>';
-                    }} else {{
-                        html = '<table class="booking-table">';
-                        html += '<tr><th>预订码</th><th>姓名</th><th>手机</th><th>座位号</th><th>预订时间</th></tr>';
-                        for (const booking of result.data) {{
-                            html += `<tr>
-                                <td><strong>${{booking.code}}</strong></td>
-                                <td>${{booking.name}}</td>
-                                <td>${{booking.phone}}</td>
-                                <td>${{Array.isArray(booking.seat_numbers) ? booking.seat_numbers.join(', ') : booking.seat_numbers}}</td>
-                                <td>${{booking.created_at}}</td>
-                            </tr>`;
-                        }}
-                        html += '</table>';
-                    }}
-                    
-                    detailsDiv.innerHTML = html;
-                }}
-            }} catch (error) {{
-                console.error('加载预订详情失败:', error);
-            }}
-        }}
-    </script>
-</body>
-</html>
-'''
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """按路由记录请求数、字节数；耗时在响应体发送完（关闭）时记录，流式页面也算完整"""
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    method = request.method
+    metrics.http_requests.inc(endpoint, method, str(response.status_code))
+    if request.content_length:
+        metrics.http_bytes.inc('in', amount=request.content_length)
+    if not response.is_streamed and response.content_length:
+        metrics.http_bytes.inc('out', amount=response.content_length)
+    # SSE 连接一开就是几分钟，不计入延迟直方图
+    if response.mimetype != 'text/event-stream':
+        response.call_on_close(
+            lambda: metrics.http_latency.observe(time.perf_counter() - started, endpoint, method))
+    return response
+
+# ---------- 抽样性能分析 ----------
+@app.before_request
+def start_profiling():
+    profile = profiler.start()
+    if profile is not None:
+        g.profile = profile
+
+@app.after_request
+def finish_profiling(response):
+    """分析到响应体发送完为止；SSE 长连接不做分析"""
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    if response.mimetype == 'text/event-stream':
+        profiler.discard(profile)
+        return response
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    response.call_on_close(lambda: profiler.finish(profile, endpoint))
+    return response
+
+@app.teardown_request
+def stop_profiling(exc):
+    # 请求异常中断、没走到 after_request 时也要关掉分析器
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.discard(profile)
+
+@metrics.registry.collector
+def collect_runtime_metrics():
+    """抓取时把缓存、实时连接和座位保留的状态填进 Gauge"""
+    stats = dataset.stats()
+    metrics.cache_lookups.set('hit', value=stats['hits'])
+    metrics.cache_lookups.set('miss', value=stats['misses'])
+    metrics.cache_lookups.set('reload', value=stats['reloads'])
+    metrics.cache_hit_ratio.set(value=stats['hit_ratio'])
+    metrics.dataset_size.set('tours', value=stats['tours'])
+    metrics.dataset_size.set('bookings', value=stats['bookings'])
+    metrics.live_connections.set(value=events.broker.count)
+    metrics.active_holds.set(value=storage.count_holds())
+
+# ---------- HTTP 缓存 ----------
+# 浏览器每次回源验证（多数得到304）；CDN/边缘节点可缓存几秒，过期后先返回旧内容再后台验证
+CDN_MAX_AGE = int(os.environ.get('BOOKING_CDN_MAX_AGE', '5'))
+CACHE_CONTROL = f'public, max-age=0, s-maxage={CDN_MAX_AGE}, stale-while-revalidate=30'
+# 含个人信息的响应只让浏览器缓存（每次回源验证），不让CDN缓存
+PRIVATE_CACHE_CONTROL = 'private, no-cache'
+# ETag 都以 storage.dataset_id() 开头：库在 /tmp 里，冷启动或另一个实例是新库，journal 序号从1重新数，
+# 只用序号的话不同内容会得到同一个 ETag（浏览器拿到304、CDN继续给旧页面）
+
+def with_cache_headers(response, etag, cache_control=CACHE_CONTROL):
+    """给响应加上 ETag 和 Cache-Control"""
+    response = make_response(response)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def not_modified(etag, cache_control=CACHE_CONTROL):
+    """客户端缓存的版本仍然有效时返回304响应（不渲染页面），否则返回None"""
+    if request.if_none_match.contains_weak(etag):
+        return with_cache_headers(Response(status=304), etag, cache_control)
+    return None
 
 # ---------- 网站页面路由 ----------
 @app.route('/')
 def home():
     """首页"""
-    # 从文件加载最新数据
-    global tours_db
-    app_data = load_data()
-    tours_db = app_data['tours']
-    
-    # 过滤掉超过一周的已发车班次
-    current_time = datetime.now()
-    valid_tours = []
-    expired_tours = []
+    # 从进程内缓存读取团期（数据没变时不访问数据库内容）；先取版本号再取数据
+    dataset.refresh()
+    version = dataset.version
+    tours_db = list(dataset.tours.values())
     
-    for tour in tours_db:
-        if should_keep_tour(tour['date'], tour['time']):
-            valid_tours.append(tour)
-        else:
-            expired_tours.append(tour)
+    # 不显示发车超过一周的班次；删除由后台清理线程负责，首页只读
+    now = time.time()
+    expired_ids = set(sweeper.expired_tour_ids(now))
+    valid_tours = [tour for tour in tours_db if tour.id not in expired_ids]
+    # 已发车但未过期的班次数：出发时间索引上的一次区间查询
+    departed_count = dataset.departed_count(now, after=sweeper.expiry_cutoff(now))
     
-    # 删除过期的班次（超过一周）
-    if expired_tours:
-        tours_db = valid_tours
-        app_data['tours'] = tours_db
-        save_data(app_data)
+    # 页面内容只取决于数据版本，以及随时间变化的“已发车/已过期”班次数
+    etag = f'{storage.dataset_id()}-home-{version}-{dataset.departed_count(now)}-{len(expired_ids)}'
+    cached = not_modified(etag)
+    if cached:
+        return cached
     
-    tours_html = ''
+    tour_rows = []
     for tour in valid_tours:
-        available = tour['max_seats'] - tour['booked']
-        percent = int((tour['booked'] / tour['max_seats']) * 100) if tour['max_seats'] > 0 else 0
+        available = tour.available
+        percent = int((tour.booked / tour.max_seats) * 100) if tour.max_seats > 0 else 0
         
         # 检查班次是否已发车
-        departed = is_tour_departed(tour['date'], tour['time'])
+        departed = is_tour_departed(tour, now)
         
         # 根据状态选择不同的CSS类和文本
         if departed:
@@ -314,39 +210,40 @@ def home():
         else:
             status_class = 'status-available'
             status_text = f'可预订 ({available}个空位)'
-            book_button = f'<button class="btn" onclick="location.href=\'/book/{tour["id"]}\'"><i class="fas fa-ticket-alt"></i> 选择座位并预订</button>'
+            book_button = f'<button class="btn" onclick="location.href=\'/book/{tour.id}\'"><i class="fas fa-ticket-alt"></i> 选择座位并预订</button>'
         
         # 显示车辆型号
-        vehicle_model = tour.get('vehicle_model', '未指定')
+        vehicle_model = esc(tour.vehicle_model)
         
-        tours_html += f'''
+        tour_rows.append(f'''
         <div class="card tour-card">
             <div style="display: flex; justify-content: space-between; align-items: start; margin-bottom: 15px;">
                 <div>
-                    <h2 style="color: #2575fc;">{tour['destination']}</h2>
+                    <h2 style="color: #2575fc;">{esc(tour.destination)}</h2>
                     <p style="color: #666; margin-top: 5px;"><i class="fas fa-car"></i> 车辆型号: {vehicle_model}</p>
                 </div>
                 <span class="{status_class}">{status_text}</span>
             </div>
-            <p><i class="far fa-calendar"></i> {tour['date']} {tour['time']} 出发</p>
-            <p><i class="fas fa-users"></i> 座位: {tour['booked']}/{tour['max_seats']} (满{tour['max_seats']}人发车)</p>
+            <p><i class="far fa-calendar"></i> {esc(tour.date)} {esc(tour.time)} 出发</p>
+            <p><i class="fas fa-users"></i> 座位: {tour.booked}/{tour.max_seats} (满{tour.max_seats}人发车)</p>
             <div class="progress-bar"><div class="progress-fill" style="width:{percent}%"></div></div>
             <div style="display: flex; justify-content: space-between; align-items: center; margin-top: 20px;">
-                <span>已报名 {tour['booked']} 人</span>
+                <span>已报名 {tour.booked} 人</span>
                 {book_button}
             </div>
             
             <!-- 新增：预订详情折叠区域 -->
             <div style="margin-top: 20px;">
-                <button id="toggle-btn-{tour['id']}" class="btn" style="background: #6c757d; padding: 8px 16px; font-size: 0.9rem;" onclick="toggleBookingDetails({tour['id']})">
+                <button id="toggle-btn-{tour.id}" class="btn" style="background: #6c757d; padding: 8px 16px; font-size: 0.9rem;" onclick="toggleBookingDetails({tour.id})">
                     <i class="fas fa-chevron-down"></i> 查看预订详情
                 </button>
-                <div id="booking-details-{tour['id']}" class="booking-details" style="display: none;">
+                <div id="booking-details-{tour.id}" class="booking-details" style="display: none;">
                     <!-- 预订详情将通过JavaScript动态加载 -->
                 </div>
             </div>
         </div>
-        '''
+        ''')
+    tours_html = ''.join(tour_rows)
     
     body_content = f'''
     <h1 style="color: white; text-align: center; margin-bottom: 30px;">🚌 在线车位预订</h1>
@@ -357,11 +254,11 @@ def home():
         </div>
         <div class="card" style="text-align: center; background: rgba(255,255,255,0.95);">
             <h3><i class="fas fa-user-check"></i> 总预订人数</h3>
-            <p style="font-size: 2.5rem; color: #00b09b; margin: 10px 0;">{sum(t.get('booked', 0) for t in valid_tours)}</p>
+            <p style="font-size: 2.5rem; color: #00b09b; margin: 10px 0;">{sum(t.booked for t in valid_tours)}</p>
         </div>
         <div class="card" style="text-align: center; background: rgba(255,255,255,0.95);">
             <h3><i class="fas fa-car"></i> 发车班次</h3>
-            <p style="font-size: 2.5rem; color: #ff6b6b; margin: 10px 0;">{sum(1 for t in valid_tours if is_tour_departed(t["date"], t["time"]))}</p>
+            <p style="font-size: 2.5rem; color: #ff6b6b; margin: 10px 0;">{departed_count}</p>
         </div>
     </div>
     <h2 style="color: white; margin-bottom: 20px;">班次列表（含已发车）</h2>
@@ -376,49 +273,48 @@ def home():
         </ul>
     </div>
     '''
-    return get_html_template('首页', body_content)
+    return with_cache_headers(get_html_template('首页', body_content), etag)
 
 @app.route('/book/<int:tour_id>')
 def book_page(tour_id):
     
-    global tours_db
-    app_data = load_data()
-    tours_db = app_data['tours']
-    
-    tour = next((t for t in tours_db if t['id'] == tour_id), None)
+    dataset.refresh()
+    tour_version = dataset.tour_version(tour_id)
+    tour = dataset.tours.get(tour_id)
+    seat_map = dataset.seat_maps.get(tour_id)
     if not tour:
         return get_html_template('错误', '<div class="card"><h2>班次不存在</h2></div>')
     
     # 检查班次是否已发车
-    if is_tour_departed(tour['date'], tour['time']):
+    if is_tour_departed(tour):
         return get_html_template('错误', '<div class="card"><h2>该班次已发车，不能预订</h2><p><a href="/" class="btn">返回首页</a></p></div>')
     
-    # 获取该班次的所有预订，找出已被选的座位号
-    bookings_for_tour = [b for b in app_data['bookings'] if b['tour_id'] == tour_id]
-    taken_seats = []
-    for b in bookings_for_tour:
-        # 将预订的座位号加入已选列表（一个预订可能有多个座位）
-        seat_nums = b.get('seat_numbers', [])
-        if isinstance(seat_nums, list):
-            taken_seats.extend(seat_nums)
-        elif seat_nums:  # 如果是单个数字
-            taken_seats.append(seat_nums)
+    # 座位图等内容只取决于该团期的版本号
+    etag = f'{storage.dataset_id()}-book-{tour_id}-{tour_version}'
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    
+    # 已被选的座位号直接来自团期的座位占用表
+    taken_seats = seat_map.taken_seats()
     
     # 生成座位图的HTML
-    seat_html = ''
-    for seat_num in range(1, tour['max_seats'] + 1):
-        seat_status = 'unavailable' if seat_num in taken_seats else 'available'
-        seat_html += f'<div class="seat {seat_status}" data-seat="{seat_num}" onclick="selectSeat(this)">{seat_num}号</div>'
+    seat_html = ''.join(
+        f'<div class="seat {"available" if seat_map.is_free(n) else "unavailable"}" data-seat="{n}" onclick="selectSeat(this)">{n}号</div>'
+        for n in range(1, tour.max_seats + 1)
+    )
     
-    # 显示车辆型号
-    vehicle_model = tour.get('vehicle_model', '未指定')
+    # 显示车辆型号和目的地（用户输入，需要转义）
+    vehicle_model = esc(tour.vehicle_model)
+    destination = esc(tour.destination)
+    departure = f"{esc(tour.date)} {esc(tour.time)}"
     
     body_content = f'''
     <div style="max-width: 900px; margin: 0 auto;">
         <a href="/" class="btn" style="background: #6c757d; margin-bottom: 20px;"><i class="fas fa-arrow-left"></i> 返回首页</a>
         <div class="card">
-            <h1><i class="fas fa-ticket-alt"></i> 预订 {tour['destination']}</h1>
-            <p style="color: #666; margin: 15px 0;"><i class="far fa-calendar"></i> {tour['date']} {tour['time']} 出发 | <i class="fas fa-car"></i> 车辆: {vehicle_model}</p>
+            <h1><i class="fas fa-ticket-alt"></i> 预订 {destination}</h1>
+            <p style="color: #666; margin: 15px 0;"><i class="far fa-calendar"></i> {departure} 出发 | <i class="fas fa-car"></i> 车辆: {vehicle_model}</p>
             
             <div style="display: grid; grid-template-columns: 1fr 1fr; gap: 30px; margin-top: 30px;">
                 <div>
@@ -442,8 +338,8 @@ def book_page(tour_id):
                         </div>
                         <div style="background: #f8f9fa; padding: 15px; border-radius: 8px; margin: 25px 0;">
                             <p><i class="fas fa-car"></i> 车辆型号: <strong>{vehicle_model}</strong></p>
-                            <p><i class="fas fa-info-circle"></i> 本班次总座位: <strong>{tour['max_seats']}</strong> 个</p>
-                            <p><i class="fas fa-chair"></i> 剩余空位: <strong style="color:#00b09b;">{tour['max_seats'] - tour['booked']}</strong> 个</p>
+                            <p><i class="fas fa-info-circle"></i> 本班次总座位: <strong>{tour.max_seats}</strong> 个</p>
+                            <p><i class="fas fa-chair"></i> 剩余空位: <strong class="free-count" style="color:#00b09b;">{seat_map.free_count()}</strong> 个</p>
                             <p id="seatSelectionWarning" style="color:#e74c3c; display:none;"><i class="fas fa-exclamation-triangle"></i> 请至少选择一个座位！</p>
                         </div>
                         <button type="submit" class="btn" style="width: 100%; padding: 15px; font-size: 1.1rem;">
@@ -456,32 +352,32 @@ def book_page(tour_id):
                     <h3><i class="fas fa-list-check"></i> 班次详情</h3>
                     <div style="background: #f8f9fa; padding: 20px; border-radius: 10px; margin-top: 20px;">
                         <div style="display: flex; justify-content: space-between; padding: 10px 0; border-bottom: 1px solid #dee2e6;">
-                            <span>目的地:</span><strong>{tour['destination']}</strong>
+                            <span>目的地:</span><strong>{destination}</strong>
                         </div>
                         <div style="display: flex; justify-content: space-between; padding: 10px 0; border-bottom: 1px solid #dee2e6;">
                             <span>车辆型号:</span><strong>{vehicle_model}</strong>
                         </div>
                         <div style="display: flex; justify-content: space-between; padding: 10px 0; border-bottom: 1px solid #dee2e6;">
-                            <span>出发时间:</span><strong>{tour['date']} {tour['time']}</strong>
+                            <span>出发时间:</span><strong>{departure}</strong>
                         </div>
                         <div style="display: flex; justify-content: space-between; padding: 10px 0; border-bottom: 1px solid #dee2e6;">
-                            <span>总座位数:</span><strong>{tour['max_seats']} 座</strong>
+                            <span>总座位数:</span><strong>{tour.max_seats} 座</strong>
                         </div>
                         <div style="display: flex; justify-content: space-between; padding: 10px 0; border-bottom: 1px solid #dee2e6;">
-                            <span>已预订:</span><strong>{tour['booked']} 人</strong>
+                            <span>已预订:</span><strong><span id="bookedCount">{tour.booked}</span> 人</strong>
                         </div>
                         <div style="display: flex; justify-content: space-between; padding: 10px 0;">
                             <span>状态:</span>
-                            <span class="{'status-available' if tour['max_seats'] - tour['booked'] > 0 else 'status-full'}">
-                                {'正常预订中' if tour['max_seats'] - tour['booked'] > 0 else '已满员'}
+                            <span class="{'status-available' if tour.available > 0 else 'status-full'}">
+                                {'正常预订中' if tour.available > 0 else '已满员'}
                             </span>
                         </div>
                     </div>
                     
                     <h3 style="margin-top: 30px;"><i class="fas fa-history"></i> 已预订座位</h3>
                     <div style="background: #f8f9fa; padding: 15px; border-radius: 8px; margin-top: 15px;">
-                        <p>已选座位: <strong>{", ".join(map(str, taken_seats)) if taken_seats else "暂无"}</strong></p>
-                        <p>剩余空位: <strong style="color:#00b09b;">{tour['max_seats'] - len(taken_seats)}</strong> 个</p>
+                        <p>已选座位: <strong id="takenSeatsList">{", ".join(map(str, taken_seats)) if taken_seats else "暂无"}</strong></p>
+                        <p>剩余空位: <strong class="free-count" style="color:#00b09b;">{seat_map.free_count()}</strong> 个</p>
                     </div>
                 </div>
             </div>
@@ -490,6 +386,11 @@ def book_page(tour_id):
     
     <script>
     let selectedSeats = [];
+    // 服务端座位保留的凭证：选座即保留，提交时凭它转成预订
+    let holdToken = null;
+    let holdQueue = Promise.resolve();
+    // 正在提交的座位：推送/快照里这些座位被订走可能就是自己这一单，不提示“被别人预订”
+    let submittingSeats = [];
     
     function selectSeat(element) {{
         // 如果座位不可用，直接返回
@@ -515,6 +416,107 @@ def book_page(tour_id):
         
         // 隐藏警告
         document.getElementById('seatSelectionWarning').style.display = 'none';
+        syncHold(seatNum);
+    }}
+    
+    // 把当前选中的座位同步成服务端的保留（按点击顺序依次发送）
+    function syncHold(seatNum) {{
+        const seats = selectedSeats.slice();
+        holdQueue = holdQueue.then(async function() {{
+            try {{
+                const response = await fetch('/api/holds', {{
+                    method: 'POST',
+                    headers: {{ 'Content-Type': 'application/json' }},
+                    body: JSON.stringify({{ tour_id: {tour_id}, seat_numbers: seats, hold_token: holdToken }})
+                }});
+                const result = await response.json();
+                if (result.success) {{
+                    holdToken = result.hold_token;
+                }} else if (result.limited) {{
+                    // 超出保留上限：座位没有保留，但仍可直接提交预订，不取消选择
+                }} else if (selectedSeats.indexOf(seatNum) !== -1) {{
+                    dropSelection(seatNum);
+                    showAlert(result.message, 'error');
+                }}
+            }} catch (error) {{
+                // 网络错误时不影响选座，提交时服务端仍会检查座位
+            }}
+        }});
+    }}
+    
+    function dropSelection(n) {{
+        const el = document.querySelector('.seat[data-seat="' + n + '"]');
+        if (el) el.classList.remove('selected');
+        selectedSeats.splice(selectedSeats.indexOf(n), 1);
+        document.getElementById('selectedSeatsDisplay').textContent =
+            selectedSeats.length > 0 ? selectedSeats.join(', ') : '无';
+        document.getElementById('selectedSeatsInput').value = selectedSeats.join(',');
+    }}
+    
+    // 自己选中（已保留）的座位不受别人保留/快照的影响
+    function notMine(seats) {{
+        return seats.filter(function(n) {{ return selectedSeats.indexOf(n) === -1; }});
+    }}
+    
+    // 实时更新座位图：别人订走或释放座位时立即反映到页面上
+    function markSeats(seats, taken) {{
+        seats.forEach(function(n) {{
+            const el = document.querySelector('.seat[data-seat="' + n + '"]');
+            if (!el) return;
+            el.classList.toggle('unavailable', taken);
+            el.classList.toggle('available', !taken);
+            if (taken && el.classList.contains('selected') && submittingSeats.indexOf(n) === -1) {{
+                dropSelection(n);
+                showAlert(n + '号座位刚被别人预订，请重新选择', 'error');
+            }}
+        }});
+        const takenSeats = Array.from(document.querySelectorAll('.seat.unavailable'))
+            .map(function(el) {{ return el.getAttribute('data-seat'); }});
+        const total = document.querySelectorAll('.seat').length;
+        document.querySelectorAll('.free-count').forEach(function(el) {{ el.textContent = total - takenSeats.length; }});
+        document.getElementById('bookedCount').textContent = takenSeats.length;
+        document.getElementById('takenSeatsList').textContent = takenSeats.length ? takenSeats.join(', ') : '暂无';
+    }}
+    
+    // 按完整的占座快照刷新座位图
+    function applySnapshot(taken) {{
+        const free = [];
+        document.querySelectorAll('.seat').forEach(function(el) {{
+            const n = parseInt(el.getAttribute('data-seat'));
+            if (taken.indexOf(n) === -1) free.push(n);
+        }});
+        markSeats(free, false);
+        markSeats(notMine(taken), true);
+    }}
+    
+    if ({'true' if events.ENABLED else 'false'} && window.EventSource) {{
+        const seatEvents = new EventSource('/api/tours/{tour_id}/events');
+        seatEvents.addEventListener('snapshot', function(e) {{ applySnapshot(JSON.parse(e.data).taken); }});
+        seatEvents.addEventListener('taken', function(e) {{ markSeats(JSON.parse(e.data).seats, true); }});
+        seatEvents.addEventListener('held', function(e) {{ markSeats(notMine(JSON.parse(e.data).seats), true); }});
+        seatEvents.addEventListener('released', function(e) {{ markSeats(JSON.parse(e.data).seats, false); }});
+        // 收到 reset 或连接到期后服务端会结束这条流，浏览器自动重连并先收到完整快照
+        seatEvents.addEventListener('closed', function() {{
+            seatEvents.close();
+            showAlert('该班次已取消', 'error');
+        }});
+    }} else {{
+        // 没开实时推送：定时取座位快照，没变化时服务端回304，页面不在前台时不取
+        const seatPoll = setInterval(async function() {{
+            if (document.hidden) return;
+            try {{
+                const response = await fetch('/api/tours/{tour_id}/seats', {{ cache: 'no-cache' }});
+                if (response.status === 404) {{
+                    clearInterval(seatPoll);
+                    showAlert('该班次已取消', 'error');
+                    return;
+                }}
+                const result = await response.json();
+                if (result.success) applySnapshot(result.taken);
+            }} catch (error) {{
+                // 网络错误时下次再取
+            }}
+        }}, {SEAT_POLL_SECONDS * 1000});
     }}
     
     async function submitBooking(event, tourId) {{
@@ -533,6 +535,9 @@ def book_page(tour_id):
         const btn = event.target.querySelector('button[type="submit"]');
         btn.innerHTML = '<i class="fas fa-spinner fa-spin"></i> 提交中...';
         btn.disabled = true;
+        // 等最后一次保留请求完成，拿到最新的保留凭证
+        await holdQueue;
+        submittingSeats = seats.slice();
         
         try {{
             const response = await fetch('/api/book', {{
@@ -542,12 +547,17 @@ def book_page(tour_id):
                     tour_id: tourId, 
                     name: name, 
                     phone: phone, 
-                    seat_numbers: seats  // 改为传递座位号数组
+                    seat_numbers: seats,  // 改为传递座位号数组
+                    hold_token: holdToken
                 }})
             }});
             const result = await response.json();
             
             if (result.success) {{
+                // 这些座位已经是自己的了：清掉选中状态，之后收到的 taken 只把它们标成已订
+                selectedSeats = [];
+                document.querySelectorAll('.seat.selected').forEach(function(el) {{ el.classList.remove('selected'); }});
+                markSeats(seats, true);
                 document.getElementById('bookingForm').innerHTML = `
                     <div style="text-align: center; padding: 40px 20px;">
                         <i class="fas fa-check-circle" style="font-size: 4rem; color: #00b09b;"></i>
@@ -563,6 +573,10 @@ def book_page(tour_id):
                     </div>
                 `;
             }} else {{
+                // 提交期间被别人订走的座位不再保持选中
+                document.querySelectorAll('.seat.selected.unavailable').forEach(function(el) {{
+                    dropSelection(parseInt(el.getAttribute('data-seat')));
+                }});
                 alert('预订失败: ' + result.message);
                 btn.innerHTML = '<i class="fas fa-check-circle"></i> 提交预订';
                 btn.disabled = false;
@@ -572,10 +586,11 @@ def book_page(tour_id):
             btn.innerHTML = '<i class="fas fa-check-circle"></i> 提交预订';
             btn.disabled = false;
         }}
+        submittingSeats = [];
     }}
     </script>
     '''
-    return get_html_template(f'预订 {tour["destination"]}', body_content)
+    return with_cache_headers(get_html_template(f'预订 {tour.destination}', body_content), etag)
 
 # ---------- 管理员登录 ----------
 @app.route('/admin/login', methods=['GET', 'POST'])
@@ -619,61 +634,130 @@ def admin_logout():
     session.pop('is_admin', None)
     return redirect('/')
 
-@app.route('/admin')
-@admin_required
-def admin_page():
-    """管理后台页面（需要密码）"""
-    # 从文件加载最新数据
-    global tours_db, bookings_db
-    app_data = load_data()
-    tours_db = app_data['tours']
-    bookings_db = app_data['bookings']
-    
-    # 生成团期管理表格
-    tours_table_html = ''
-    for t in tours_db:
-        # 检查是否已发车
-        departed = is_tour_departed(t['date'], t['time'])
-        vehicle_model = t.get('vehicle_model', '未指定')
-        
-        tours_table_html += f'''
+# 管理后台每页行数（可用 per_page 参数调整）
+ADMIN_PAGE_SIZE = 50
+ADMIN_MAX_PAGE_SIZE = 500
+# 每攒够这么多行就向浏览器输出一次
+ADMIN_STREAM_CHUNK = 200
+UNKNOWN_TOUR = Tour(None, None, None, '未知', '未知', 0)
+
+def admin_page_url(**changes):
+    """在当前管理后台查询参数的基础上修改若干参数，生成链接"""
+    args = request.args.to_dict()
+    for key, value in changes.items():
+        if value is None:
+            args.pop(key, None)
+        else:
+            args[key] = value
+    return '/admin?' + urlencode(args) if args else '/admin'
+
+def stream_rows(rows, empty_html):
+    """把行片段分块输出，没有行时输出占位行"""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= ADMIN_STREAM_CHUNK:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+    elif empty_html:
+        yield empty_html
+
+def admin_tour_row(t):
+    """团期管理表格的一行"""
+    # 检查是否已发车
+    departed = is_tour_departed(t)
+    vehicle_model = esc(t.vehicle_model)
+    return f'''
         <tr style="border-bottom: 1px solid #eee;">
-            <td style="padding: 12px;">{t['id']}</td>
-            <td style="padding: 12px;"><strong>{t['destination']}</strong></td>
+            <td style="padding: 12px;">{t.id}</td>
+            <td style="padding: 12px;"><strong>{esc(t.destination)}</strong></td>
             <td style="padding: 12px;">{vehicle_model}</td>
-            <td style="padding: 12px;">{t['date']} {t['time']}</td>
-            <td style="padding: 12px;">{t['max_seats']}</td>
-            <td style="padding: 12px;">{t['booked']}</td>
+            <td style="padding: 12px;">{esc(t.date)} {esc(t.time)}</td>
+            <td style="padding: 12px;">{t.max_seats}</td>
+            <td style="padding: 12px;">{t.booked}</td>
             <td style="padding: 12px;">
-                <span class="{'status-departed' if departed else 'status-full' if t['booked'] >= t['max_seats'] else 'status-available'}">
-                    {'已发车' if departed else '已满员' if t['booked'] >= t['max_seats'] else '进行中'}
+                <span class="{'status-departed' if departed else 'status-full' if t.booked >= t.max_seats else 'status-available'}">
+                    {'已发车' if departed else '已满员' if t.booked >= t.max_seats else '进行中'}
                 </span>
             </td>
             <td style="padding: 12px;">
-                <a href="/book/{t['id']}" class="btn" style="padding: 6px 12px; font-size: 0.8rem; margin-right: 5px;">查看</a>
-                <button class="btn" style="padding: 6px 12px; font-size: 0.8rem; background: #e74c3c;" onclick="deleteTour({t['id']})">删除</button>
+                <a href="/book/{t.id}" class="btn" style="padding: 6px 12px; font-size: 0.8rem; margin-right: 5px;">查看</a>
+                <a href="{esc(admin_page_url(tour_id=t.id, bookings_after=None))}#bookings" class="btn" style="padding: 6px 12px; font-size: 0.8rem; margin-right: 5px; background: #00b09b;">预订</a>
+                <a href="/admin/export/tours/{t.id}/manifest.csv" class="btn" style="padding: 6px 12px; font-size: 0.8rem; margin-right: 5px; background: #6a11cb;">名单</a>
+                <button class="btn" style="padding: 6px 12px; font-size: 0.8rem; background: #e74c3c;" onclick="deleteTour({t.id})">删除</button>
             </td>
         </tr>
         '''
-    
-    # 生成预订详情表格（管理员能看到所有信息）
-    bookings_table_html = ''
-    for b in bookings_db:
-        # 找到对应的团期信息
-        tour_info = next((t for t in tours_db if t['id'] == b['tour_id']), {'destination': '未知', 'vehicle_model': '未知'})
-        bookings_table_html += f'''
+
+def admin_booking_row(b, tours):
+    """预订详情表格的一行，团期信息用字典按ID查找"""
+    tour_info = tours.get(b.tour_id, UNKNOWN_TOUR)
+    return f'''
         <tr style="border-bottom: 1px solid #eee;">
-            <td style="padding: 10px;">{b['code']}</td>
-            <td style="padding: 10px;">{b['name']}</td>
-            <td style="padding: 10px;">{b['phone']}</td>
-            <td style="padding: 10px;">{tour_info['destination']}</td>
-            <td style="padding: 10px;">{tour_info.get('vehicle_model', '未指定')}</td>
-            <td style="padding: 10px;">{b.get('seat_numbers', ['无'])}</td>
-            <td style="padding: 10px;">{b['created_at']}</td>
+            <td style="padding: 10px;">{esc(b.code)}</td>
+            <td style="padding: 10px;">{esc(b.name)}</td>
+            <td style="padding: 10px;">{esc(b.phone)}</td>
+            <td style="padding: 10px;">{esc(tour_info.destination)}</td>
+            <td style="padding: 10px;">{esc(tour_info.vehicle_model)}</td>
+            <td style="padding: 10px;">{esc(b.seat_text())}</td>
+            <td style="padding: 10px;">{esc(b.created_at)}</td>
         </tr>
         '''
+
+def admin_pager(has_more, cursor_name, next_cursor, anchor):
+    """分页链接：键集分页只提供“第一页”和“下一页”"""
+    links = []
+    if request.args.get(cursor_name):
+        links.append(f'<a href="{esc(admin_page_url(**{cursor_name: None}))}#{anchor}" class="btn" style="background: #6c757d; padding: 6px 14px;">第一页</a>')
+    if has_more:
+        links.append(f'<a href="{esc(admin_page_url(**{cursor_name: next_cursor}))}#{anchor}" class="btn" style="padding: 6px 14px; margin-left: 10px;">下一页</a>')
+    return f'<div style="margin-top: 15px; text-align: right;">{"".join(links)}</div>' if links else ''
+
+def admin_schedule_row(schedule):
+    """管理后台周期班次表格的一行"""
+    return f'''
+        <tr style="border-bottom: 1px solid #eee;">
+            <td style="padding: 12px;">{schedule['id']}</td>
+            <td style="padding: 12px;">{esc(schedule['destination'])}</td>
+            <td style="padding: 12px;">{esc(schedule['vehicle_model'])}</td>
+            <td style="padding: 12px;">{schedules.weekday_text(schedule['weekdays'])} {esc(schedule['time'])}</td>
+            <td style="padding: 12px;">{esc(schedule['start_date'])} ~ {esc(schedule['end_date'] or '长期')}</td>
+            <td style="padding: 12px;">{schedule['max_seats']}</td>
+            <td style="padding: 12px;">
+                <button class="btn" style="padding: 6px 12px; font-size: 0.8rem; background: #e74c3c;" onclick="deleteSchedule({schedule['id']})">删除</button>
+            </td>
+        </tr>
+        '''
+
+@app.route('/admin')
+@admin_required
+def admin_page():
+    """管理后台页面（需要密码）：团期和预订都按键集游标分页，边生成边输出"""
+    try:
+        per_page = min(max(int(request.args.get('per_page', ADMIN_PAGE_SIZE)), 1), ADMIN_MAX_PAGE_SIZE)
+        tours_after = int(request.args.get('tours_after', 0))
+        bookings_after = int(request.args.get('bookings_after', 0))
+        filter_tour_id = int(request.args['tour_id']) if request.args.get('tour_id') else None
+    except ValueError:
+        return redirect('/admin')
+    filter_date = request.args.get('date') or None
+    export_query = urlencode({k: v for k, v in (('tour_id', filter_tour_id), ('date', filter_date)) if v})
     
-    body_content = f'''
+    # 汇总数字来自进程内缓存；表格内容用数据库的键集分页查询
+    dataset.refresh()
+    tours = dataset.tours
+    tour_page = storage.page_tours(tours_after, per_page + 1, filter_date)
+    schedule_rows = ''.join(admin_schedule_row(sc) for sc in storage.list_schedules()) or \
+        '<tr><td colspan="7" style="text-align:center;padding:20px;color:#666;">暂无周期班次</td></tr>'
+    booking_page = storage.page_bookings(bookings_after, per_page + 1, filter_tour_id, filter_date)
+    tours_more = len(tour_page) > per_page
+    bookings_more = len(booking_page) > per_page
+    tour_page = tour_page[:per_page]
+    booking_page = booking_page[:per_page]
+    
+    summary_html = f'''
     <div style="max-width: 1200px; margin: 0 auto;">
         <div style="display: flex; justify-content: space-between; align-items: center; margin-bottom: 20px;">
             <h1 style="color: white;"><i class="fas fa-cog"></i> 管理后台</h1>
@@ -684,23 +768,49 @@ def admin_page():
         <div style="display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); gap: 20px; margin-bottom: 30px;">
             <div class="card" style="text-align: center;">
                 <h3>总班次数</h3>
-                <p style="font-size: 2rem; color: #6a11cb;">{len(tours_db)}</p>
+                <p style="font-size: 2rem; color: #6a11cb;">{len(tours)}</p>
             </div>
             <div class="card" style="text-align: center;">
                 <h3>总预订数</h3>
-                <p style="font-size: 2rem; color: #00b09b;">{len(bookings_db)}</p>
+                <p style="font-size: 2rem; color: #00b09b;">{len(dataset.bookings)}</p>
             </div>
             <div class="card" style="text-align: center;">
                 <h3>已发车班次</h3>
-                <p style="font-size: 2rem; color: #ff6b6b;">{len([t for t in tours_db if is_tour_departed(t["date"], t["time"])])}</p>
+                <p style="font-size: 2rem; color: #ff6b6b;">{dataset.departed_count()}</p>
             </div>
             <div class="card" style="text-align: center;">
                 <h3>已满员班次</h3>
-                <p style="font-size: 2rem; color: #e74c3c;">{len([t for t in tours_db if t['booked'] >= t['max_seats']])}</p>
+                <p style="font-size: 2rem; color: #e74c3c;">{sum(1 for t in tours.values() if t.booked >= t.max_seats)}</p>
             </div>
         </div>
         
         <div class="card">
+            <h2><i class="fas fa-filter"></i> 筛选</h2>
+            <form method="GET" action="/admin" style="display: grid; grid-template-columns: repeat(auto-fit, minmax(180px, 1fr)); gap: 15px; margin-top: 15px; align-items: end;">
+                <div>
+                    <label style="display: block; margin-bottom: 8px; font-weight: 600;">出发日期</label>
+                    <input type="date" name="date" value="{esc(filter_date)}" style="width: 100%; padding: 10px; border: 2px solid #ddd; border-radius: 8px;">
+                </div>
+                <div>
+                    <label style="display: block; margin-bottom: 8px; font-weight: 600;">班次ID</label>
+                    <input type="number" name="tour_id" min="1" value="{esc(filter_tour_id)}" style="width: 100%; padding: 10px; border: 2px solid #ddd; border-radius: 8px;">
+                </div>
+                <div>
+                    <label style="display: block; margin-bottom: 8px; font-weight: 600;">每页行数</label>
+                    <input type="number" name="per_page" min="1" max="{ADMIN_MAX_PAGE_SIZE}" value="{per_page}" style="width: 100%; padding: 10px; border: 2px solid #ddd; border-radius: 8px;">
+                </div>
+                <div>
+                    <button type="submit" class="btn">筛选</button>
+                    <a href="/admin" class="btn" style="background: #6c757d; margin-left: 5px;">清除</a>
+                </div>
+            </form>
+            <p style="margin-top: 15px;">按当前筛选条件导出预订：
+                <a href="/admin/export/bookings.csv?{esc(export_query)}">CSV</a> |
+                <a href="/admin/export/bookings.ndjson?{esc(export_query)}">NDJSON</a>
+            </p>
+        </div>
+        
+        <div class="card" id="tours">
             <h2><i class="fas fa-bus"></i> 班次管理</h2>
             <div style="overflow-x: auto; margin-top: 20px;">
                 <table style="width: 100%; border-collapse: collapse;">
@@ -717,10 +827,13 @@ def admin_page():
                         </tr>
                     </thead>
                     <tbody>
-                        {tours_table_html if tours_table_html else '<tr><td colspan="8" style="text-align:center;padding:20px;color:#666;">暂无班次</td></tr>'}
+    '''
+    
+    middle_html = f'''
                     </tbody>
                 </table>
             </div>
+            {admin_pager(tours_more, 'tours_after', tour_page[-1].id if tour_page else 0, 'tours')}
         </div>
         
         <!-- 创建班次表单，新增车辆型号输入 -->
@@ -758,9 +871,46 @@ def admin_page():
             </form>
         </div>
         
-        <div class="card">
+        <div class="card" id="schedules">
+            <h2><i class="fas fa-calendar-alt"></i> 周期班次</h2>
+            <p style="color: #666; margin-top: 10px;">固定线路按每周出发日自动生成未来{schedules.WINDOW_DAYS}天内的班次</p>
+            <div style="overflow-x: auto; margin-top: 20px;">
+                <table style="width: 100%; border-collapse: collapse;">
+                    <thead>
+                        <tr style="background: #f8f9fa;">
+                            <th style="padding: 12px; text-align: left;">ID</th>
+                            <th style="padding: 12px; text-align: left;">目的地</th>
+                            <th style="padding: 12px; text-align: left;">车辆型号</th>
+                            <th style="padding: 12px; text-align: left;">出发</th>
+                            <th style="padding: 12px; text-align: left;">日期范围</th>
+                            <th style="padding: 12px; text-align: left;">总座位</th>
+                            <th style="padding: 12px; text-align: left;">操作</th>
+                        </tr>
+                    </thead>
+                    <tbody>{schedule_rows}</tbody>
+                </table>
+            </div>
+            <form onsubmit="createSchedule(event)" style="margin-top: 20px;">
+                <div style="display: grid; grid-template-columns: repeat(auto-fit, minmax(180px, 1fr)); gap: 15px; margin-bottom: 15px;">
+                    <input type="text" id="scheduleDest" required placeholder="目的地" style="padding: 12px; border: 2px solid #ddd; border-radius: 8px;">
+                    <input type="text" id="scheduleVehicle" placeholder="车辆型号" style="padding: 12px; border: 2px solid #ddd; border-radius: 8px;">
+                    <input type="number" id="scheduleSeats" required min="1" max="50" value="6" title="总座位数" style="padding: 12px; border: 2px solid #ddd; border-radius: 8px;">
+                    <input type="time" id="scheduleTime" required value="08:00" style="padding: 12px; border: 2px solid #ddd; border-radius: 8px;">
+                    <input type="date" id="scheduleStart" required title="开始日期" style="padding: 12px; border: 2px solid #ddd; border-radius: 8px;">
+                    <input type="date" id="scheduleEnd" title="结束日期（可不填）" style="padding: 12px; border: 2px solid #ddd; border-radius: 8px;">
+                </div>
+                <div style="margin-bottom: 15px;">
+                    {''.join(f'<label style="margin-right: 12px;"><input type="checkbox" name="scheduleWeekday" value="{i + 1}" checked> 周{name}</label>' for i, name in enumerate(schedules.WEEKDAY_NAMES))}
+                </div>
+                <button type="submit" class="btn" style="width: 100%;">
+                    <i class="fas fa-plus"></i> 创建周期班次
+                </button>
+            </form>
+        </div>
+        
+        <div class="card" id="bookings">
             <h2><i class="fas fa-list-alt"></i> 所有预订详情</h2>
-            <p style="color: #666; margin-bottom: 15px;">这里显示所有客户的完整预订信息</p>
+            <p style="color: #666; margin-bottom: 15px;">这里显示所有客户的完整预订信息{f"（班次 {filter_tour_id}）" if filter_tour_id else ""}</p>
             <div style="overflow-x: auto; margin-top: 20px;">
                 <table style="width: 100%; border-collapse: collapse;">
                     <thead>
@@ -775,10 +925,13 @@ def admin_page():
                         </tr>
                     </thead>
                     <tbody>
-                        {bookings_table_html if bookings_table_html else '<tr><td colspan="7" style="text-align:center;padding:20px;color:#666;">暂无预订记录</td></tr>'}
+    '''
+    
+    footer_html = f'''
                     </tbody>
                 </table>
             </div>
+            {admin_pager(bookings_more, 'bookings_after', booking_page[-1][0] if booking_page else 0, 'bookings')}
         </div>
     </div>
     
@@ -787,6 +940,7 @@ def admin_page():
     const tomorrow = new Date();
     tomorrow.setDate(tomorrow.getDate() + 1);
     document.getElementById('newTourDate').value = tomorrow.toISOString().split('T')[0];
+    document.getElementById('scheduleStart').value = tomorrow.toISOString().split('T')[0];
     
     async function createTour(event) {{
         event.preventDefault();
@@ -811,6 +965,49 @@ def admin_page():
         }}
     }}
     
+    async function createSchedule(event) {{
+        event.preventDefault();
+        const weekdays = Array.from(document.querySelectorAll('input[name="scheduleWeekday"]:checked')).map(el => parseInt(el.value));
+        const response = await fetch('/api/create_schedule', {{
+            method: 'POST',
+            headers: {{ 'Content-Type': 'application/json' }},
+            body: JSON.stringify({{
+                destination: document.getElementById('scheduleDest').value,
+                vehicle_model: document.getElementById('scheduleVehicle').value,
+                max_seats: parseInt(document.getElementById('scheduleSeats').value),
+                time: document.getElementById('scheduleTime').value,
+                start_date: document.getElementById('scheduleStart').value,
+                end_date: document.getElementById('scheduleEnd').value || null,
+                weekdays: weekdays
+            }})
+        }});
+        
+        const result = await response.json();
+        if (result.success) {{
+            alert('创建成功，已生成' + result.tours_created + '个班次！页面将刷新...');
+            location.reload();
+        }} else {{
+            alert('创建失败: ' + result.message);
+        }}
+    }}
+    
+    async function deleteSchedule(scheduleId) {{
+        if (!confirm('确定要删除这个周期班次吗？已生成的班次和预订会保留。')) return;
+        
+        const response = await fetch('/api/delete_schedule', {{
+            method: 'POST',
+            headers: {{ 'Content-Type': 'application/json' }},
+            body: JSON.stringify({{ schedule_id: scheduleId }})
+        }});
+        
+        const result = await response.json();
+        if (result.success) {{
+            location.reload();
+        }} else {{
+            alert('删除失败: ' + result.message);
+        }}
+    }}
+    
     async function deleteTour(tourId) {{
         if (!confirm('确定要删除这个班次吗？相关的所有预订也将被删除！')) return;
         
@@ -830,7 +1027,71 @@ def admin_page():
     }}
     </script>
     '''
-    return get_html_template('管理后台', body_content)
+    
+    shell_head, shell_tail = page_parts('管理后台')
+    
+    def generate():
+        yield shell_head
+        yield summary_html
+        yield from stream_rows((admin_tour_row(t) for t in tour_page),
+                               '<tr><td colspan="8" style="text-align:center;padding:20px;color:#666;">暂无班次</td></tr>')
+        yield middle_html
+        yield from stream_rows((admin_booking_row(b, tours) for _, b in booking_page),
+                               '<tr><td colspan="7" style="text-align:center;padding:20px;color:#666;">暂无预订记录</td></tr>')
+        yield footer_html
+        yield shell_tail
+    
+    return Response(stream_with_context(generate()), mimetype='text/html')
+
+# ---------- 数据导入导出（管理员） ----------
+def export_response(rows, columns, fmt, name):
+    """边生成边输出的下载响应（不设 Content-Length，服务器分块发送）"""
+    return Response(export.chunks(rows, columns, fmt), content_type=export.FORMATS[fmt], headers={
+        'Content-Disposition': f'attachment; filename="{name}.{fmt}"',
+        'Cache-Control': 'no-store',
+    })
+
+@app.route('/admin/export/bookings.<fmt>', methods=['GET'])
+@admin_required
+def admin_export_bookings(fmt):
+    """导出预订：全部，或按班次ID、出发日期（date，或 date_from ~ date_to）筛选"""
+    if fmt not in export.FORMATS:
+        return jsonify({'success': False, 'message': '不支持的导出格式'}), 404
+    try:
+        tour_id = int(request.args['tour_id']) if request.args.get('tour_id') else None
+        date = request.args.get('date')
+        rows = export.booking_rows(dataset.refresh(), tour_id,
+                                   request.args.get('date_from') or date, request.args.get('date_to') or date)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return export_response(rows, export.BOOKING_COLUMNS, fmt, 'bookings')
+
+@app.route('/admin/export/tours/<int:tour_id>/manifest.<fmt>', methods=['GET'])
+@admin_required
+def admin_export_manifest(tour_id, fmt):
+    """导出一个班次的乘客名单（每个座位一行）"""
+    if fmt not in export.FORMATS:
+        return jsonify({'success': False, 'message': '不支持的导出格式'}), 404
+    cache = dataset.refresh()
+    if tour_id not in cache.tours:
+        return jsonify({'success': False, 'message': '班次不存在'}), 404
+    return export_response(export.manifest_rows(cache, tour_id), export.MANIFEST_COLUMNS, fmt,
+                           f'manifest-{tour_id}')
+
+@app.route('/admin/import/<kind>', methods=['POST'])
+@admin_required
+def admin_import(kind):
+    """批量导入团期或预订：请求体是 CSV 或 NDJSON 文件内容，每 importer.BATCH_SIZE 行一个事务"""
+    if kind not in importer.KINDS:
+        return jsonify({'success': False, 'message': '只能导入 tours 或 bookings'}), 404
+    fmt = request.args.get('format') or ('ndjson' if 'json' in request.mimetype else 'csv')
+    if fmt not in importer.FORMATS:
+        return jsonify({'success': False, 'message': '不支持的导入格式'}), 400
+    dry_run = request.args.get('dry_run') == '1'
+    report = importer.run(kind, request.stream, fmt, dry_run)
+    if report['imported']:
+        events.broker.wake()
+    return jsonify(report)
 
 # ---------- API 接口（处理数据）----------
 @app.route('/api/book', methods=['POST'])
@@ -846,67 +1107,115 @@ def api_book():
         if not seat_numbers:
             return jsonify({'success': False, 'message': '请至少选择一个座位'})
         
-        # 从文件加载最新数据
-        app_data = load_data()
-        tours_db = app_data['tours']
-        bookings_db = app_data['bookings']
-        
         # 找到对应团期
-        tour = next((t for t in tours_db if t['id'] == tour_id), None)
+        tour = dataset.refresh().tours.get(tour_id)
         if not tour:
             return jsonify({'success': False, 'message': '班次不存在'})
         
         # 检查班次是否已发车
-        if is_tour_departed(tour['date'], tour['time']):
+        if is_tour_departed(tour):
             return jsonify({'success': False, 'message': '该班次已发车，不能预订'})
         
-        # 检查每个座位是否可用
-        existing_bookings = [b for b in bookings_db if b['tour_id'] == tour_id]
-        all_taken_seats = []
-        for b in existing_bookings:
-            seats = b.get('seat_numbers', [])
-            if isinstance(seats, list):
-                all_taken_seats.extend(seats)
-            elif seats:
-                all_taken_seats.append(seats)
-        
-        for seat in seat_numbers:
-            if seat in all_taken_seats:
-                return jsonify({'success': False, 'message': f'{seat}号座位已被预订'})
-        
-        # 检查是否超过剩余座位数
-        available = tour['max_seats'] - tour['booked']
-        if len(seat_numbers) > available:
-            return jsonify({'success': False, 'message': f'剩余车位不足，仅剩{available}个'})
-        
-        # 生成预订码
-        booking_code = generate_booking_code()
-        
-        # 保存预订
-        booking = {
-            'code': booking_code,
-            'name': name,
-            'phone': phone,
-            'seat_numbers': seat_numbers,  # 保存座位号数组
-            'tour_id': tour_id,
-            'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        }
-        bookings_db.append(booking)
+        # 校验座位号（必须在 1..max_seats 内且不重复）
+        try:
+            seat_numbers = normalize_seats(seat_numbers, tour.max_seats)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)})
         
-        # 更新团期预订人数（增加已选座位数量）
-        tour['booked'] += len(seat_numbers)
+        # 保存预订（座位号数组），预订码在写库的事务里分配，保证不重复
+        booking = Booking(None, name, phone, tour.id, datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                          seat_numbers)
         
-        # ============== 核心修改1：保存数据到文件 ==============
-        app_data['tours'] = tours_db
-        app_data['bookings'] = bookings_db
-        save_data(app_data)
-        # ============== 核心修改1结束 ==============
+        # 在一个写事务里检查座位并保存预订（有座位保留时一并转成预订），冲突时立即返回409
+        try:
+            hold_token = data.get('hold_token')
+            if hold_token:
+                holds.book(booking, hold_token)
+            else:
+                storage.reserve_seats(booking)
+        except storage.BookingConflict as e:
+            return jsonify({'success': False, 'message': str(e)}), 409
+        events.broker.wake()
         
         return jsonify({
             'success': True,
             'message': '预订成功',
-            'booking_code': booking_code,
-            'data': booking
+            'booking_code': booking.code,
+            'data': booking.to_dict()
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+# 一次批量预订最多多少条
+MAX_BATCH_BOOKINGS = 200
+
+def batch_results(bookings, errors):
+    """批量预订每一条的结果：出错的给原因，其余按是否已写入给出预订码"""
+    results = []
+    for i, booking in enumerate(bookings):
+        if i in errors:
+            results.append({'index': i, 'success': False, 'message': errors[i]})
+        elif errors or booking is None:
+            results.append({'index': i, 'success': False, 'message': '同批次其他预订失败，未保存'})
+        else:
+            results.append({'index': i, 'success': True, 'booking_code': booking.code, 'data': booking.to_dict()})
+    return results
+
+@app.route('/api/book_batch', methods=['POST'])
+def api_book_batch():
+    """批量预订（旅行社团体下单）：可跨多个团期，全部成功或全部不保存"""
+    try:
+        data = request.get_json()
+        items = data.get('bookings') if isinstance(data, dict) else None
+        if not isinstance(items, list) or not items:
+            return jsonify({'success': False, 'message': '请提供预订列表'})
+        if len(items) > MAX_BATCH_BOOKINGS:
+            return jsonify({'success': False, 'message': f'一次最多预订{MAX_BATCH_BOOKINGS}条'})
+
+        # 第一遍：逐条校验团期和座位号，全部通过才写库
+        tours = dataset.refresh().tours
+        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        bookings = []
+        errors = {}
+        for i, item in enumerate(items):
+            bookings.append(None)
+            if not isinstance(item, dict):
+                errors[i] = '预订格式错误'
+                continue
+            tour = tours.get(item.get('tour_id'))
+            if not tour:
+                errors[i] = '班次不存在'
+                continue
+            if is_tour_departed(tour):
+                errors[i] = '该班次已发车，不能预订'
+                continue
+            if not item.get('seat_numbers'):
+                errors[i] = '请至少选择一个座位'
+                continue
+            try:
+                seat_numbers = normalize_seats(item['seat_numbers'], tour.max_seats)
+            except ValueError as e:
+                errors[i] = str(e)
+                continue
+            bookings[i] = Booking(None, item.get('name'), item.get('phone'), tour.id,
+                                  created_at, seat_numbers)
+        if errors:
+            return jsonify({'success': False, 'message': '部分预订无效，整批未保存',
+                            'results': batch_results(bookings, errors)})
+
+        # 第二遍：一个写事务里检查所有座位并保存，任何冲突整批回滚
+        try:
+            storage.reserve_batch(bookings)
+        except storage.BookingConflict as e:
+            errors = e.errors or dict.fromkeys(range(len(bookings)), str(e))
+            return jsonify({'success': False, 'message': str(e),
+                            'results': batch_results(bookings, errors)}), 409
+        events.broker.wake()
+
+        return jsonify({
+            'success': True,
+            'message': f'批量预订成功，共{len(bookings)}条',
+            'results': batch_results(bookings, {})
         })
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
@@ -917,13 +1226,6 @@ def api_create_tour():
     try:
         data = request.get_json()
         
-        # 从文件加载最新数据
-        app_data = load_data()
-        tours_db = app_data['tours']
-        
-        # 生成新ID
-        new_id = max([t['id'] for t in tours_db], default=0) + 1
-        
         # 获取自定义座位数，默认为6
         max_seats = int(data.get('max_seats', 6))
         if max_seats < 1:
@@ -935,7 +1237,6 @@ def api_create_tour():
             vehicle_model = '未指定'
         
         new_tour = {
-            'id': new_id,
             'date': data.get('date'),
             'time': data.get('time'),
             'destination': data.get('destination'),
@@ -943,17 +1244,47 @@ def api_create_tour():
             'max_seats': max_seats,  # 使用自定义座位数
             'booked': 0
         }
-        tours_db.append(new_tour)
         
-        # ============== 核心修改1：保存数据到文件 ==============
-        app_data['tours'] = tours_db
-        save_data(app_data)
+        # ============== 核心修改1：插入新团期，ID由数据库按计数器分配（删掉的ID不会重用） ==============
+        new_id = storage.create_tour(new_tour)
         # ============== 核心修改1结束 ==============
         
         return jsonify({'success': True, 'tour_id': new_id})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
+@app.route('/api/schedules', methods=['GET'])
+@admin_required
+def api_list_schedules():
+    """所有周期班次（管理员）"""
+    return jsonify({'success': True, 'data': [dict(s, weekday_text=schedules.weekday_text(s['weekdays']))
+                                              for s in storage.list_schedules()]})
+
+@app.route('/api/create_schedule', methods=['POST'])
+@admin_required
+def api_create_schedule():
+    """新建周期班次（管理员）：只保存规则，立即生成滚动窗口内的团期"""
+    try:
+        schedule = schedules.parse_schedule(request.get_json() or {})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)})
+    schedule_id = storage.create_schedule(schedule)
+    schedules.materializer.invalidate()
+    created = schedules.ensure_materialized()
+    return jsonify({'success': True, 'schedule_id': schedule_id, 'tours_created': created})
+
+@app.route('/api/delete_schedule', methods=['POST'])
+@admin_required
+def api_delete_schedule():
+    """删除周期班次（管理员）：不再生成新团期，已生成的团期和预订保留"""
+    try:
+        schedule_id = int((request.get_json() or {}).get('schedule_id'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': '周期班次ID无效'})
+    if not storage.delete_schedule(schedule_id):
+        return jsonify({'success': False, 'message': '周期班次不存在'})
+    return jsonify({'success': True})
+
 @app.route('/api/delete_tour', methods=['POST'])
 def api_delete_tour():
     """删除班次（管理员功能）"""
@@ -961,21 +1292,9 @@ def api_delete_tour():
         data = request.get_json()
         tour_id = data.get('tour_id')
         
-        # 从文件加载最新数据
-        app_data = load_data()
-        tours_db = app_data['tours']
-        bookings_db = app_data['bookings']
-        
-        # 删除班次
-        tours_db = [t for t in tours_db if t['id'] != tour_id]
-        
-        # 删除与该班次相关的所有预订
-        bookings_db = [b for b in bookings_db if b['tour_id'] != tour_id]
-        
-        # ============== 核心修改1：保存数据到文件 ==============
-        app_data['tours'] = tours_db
-        app_data['bookings'] = bookings_db
-        save_data(app_data)
+        # ============== 核心修改1：删除班次及其所有预订 ==============
+        storage.delete_tour(tour_id)
+        events.broker.wake()
         # ============== 核心修改1结束 ==============
         
         return jsonify({'success': True, 'message': '班次已删除'})
@@ -988,34 +1307,225 @@ def api_get_tour_bookings():
     try:
         tour_id = int(request.args.get('tour_id'))
         
-        # 从文件加载最新数据
-        app_data = load_data()
-        bookings_db = app_data['bookings']
+        # 团期版本号没变就直接返回304；含姓名和手机号，只允许浏览器缓存，CDN 不能存
+        etag = f'{storage.dataset_id()}-bookings-{tour_id}-{dataset.refresh().tour_version(tour_id)}'
+        cached = not_modified(etag, PRIVATE_CACHE_CONTROL)
+        if cached:
+            return cached
         
-        # 过滤出该班次的所有预订
-        tour_bookings = [b for b in bookings_db if b['tour_id'] == tour_id]
+        # 从缓存的 tour_id 索引取该班次的所有预订
+        tour_bookings = dataset.bookings_by_tour.get(tour_id, [])
         
-        return jsonify({'success': True, 'data': tour_bookings})
+        return with_cache_headers(jsonify({'success': True, 'data': [b.to_dict() for b in tour_bookings]}), etag,
+                                  PRIVATE_CACHE_CONTROL)
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
 @app.route('/api/search_booking', methods=['GET'])
 def api_search_booking():
-    """查询预订"""
-    query = request.args.get('q', '').lower()
-    
-    # 从文件加载最新数据
-    app_data = load_data()
-    bookings_db = app_data['bookings']
+    """查询预订：预订码精确匹配、手机号前缀、姓名子串，分页返回"""
+    query = request.args.get('q', '')
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', search.DEFAULT_LIMIT)), 1), search.MAX_LIMIT)
+    except ValueError:
+        return jsonify({'success': False, 'message': '分页参数无效'})
     
-    results = []
-    for booking in bookings_db:
-        if (query in booking['code'].lower() or 
-            query in booking['phone'] or
-            query in booking['name'].lower()):
-            results.append(booking)
+    # 走缓存里维护的索引，不扫描全部预订
+    results, has_more = search.search_bookings(dataset.refresh(), query, offset, limit)
     
-    return jsonify({'success': True, 'data': results})
+    response = {
+        'success': True,
+        'data': [b.to_dict() for b in results],
+        'next_offset': offset + len(results) if has_more else None
+    }
+    # 像预订码但校验位不对、又什么都没搜到：多半是输错了一位
+    if not results and not offset and codes.is_mistyped(query):
+        response['message'] = '预订码校验不通过，请检查是否输错'
+    return jsonify(response)
+
+@app.route('/api/bookings/<code>', methods=['GET'])
+def api_get_booking(code):
+    """按预订码直接查一条预订（检票用）：走缓存里的预订码索引，不做搜索"""
+    cache = dataset.refresh()
+    booking = cache.find_booking(code)
+    if booking is None:
+        if codes.is_mistyped(code):
+            return jsonify({'success': False, 'message': '预订码校验不通过，请检查是否输错'}), 400
+        return jsonify({'success': False, 'message': '预订不存在'}), 404
+
+    # 预订本身创建后不再修改，团期版本号没变就直接返回304
+    etag = f'{storage.dataset_id()}-booking-{booking.code}-{cache.tour_version(booking.tour_id)}'
+    cached = not_modified(etag, PRIVATE_CACHE_CONTROL)
+    if cached:
+        return cached
+
+    tour = cache.tours.get(booking.tour_id)
+    return with_cache_headers(jsonify({
+        'success': True,
+        'data': booking.to_dict(),
+        'tour': {
+            'id': tour.id,
+            'date': tour.date,
+            'time': tour.time,
+            'destination': tour.destination,
+            'vehicle_model': tour.vehicle_model,
+        } if tour else None
+    }), etag, PRIVATE_CACHE_CONTROL)
+
+@app.route('/api/cache_stats', methods=['GET'])
+@admin_required
+def api_cache_stats():
+    """进程内缓存的命中/未命中统计（管理员）"""
+    return jsonify({'success': True, 'data': dataset.stats(), 'events': events.broker.stats()})
+
+@app.route('/admin/metrics', methods=['GET'])
+def admin_metrics():
+    """Prometheus 文本格式的进程内指标（管理员或带抓取令牌）"""
+    bearer = request.headers.get('Authorization', '')
+    if not session.get('is_admin') and not (METRICS_TOKEN and bearer == f'Bearer {METRICS_TOKEN}'):
+        return redirect('/admin/login')
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+@admin_required
+def admin_profiling():
+    """抽样性能分析：GET 查看各路由最耗时的函数，POST 调整抽样比例或清空统计"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            if 'rate' in data:
+                profiler.configure(data['rate'])
+            elif 'enabled' in data:
+                profiler.configure(0.1 if data['enabled'] else 0)
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': '抽样比例无效'})
+        if data.get('reset'):
+            profiler.reset()
+    try:
+        top = min(max(int(request.args.get('top', 20)), 1), 200)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'top 参数无效'})
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in SORT_KEYS:
+        sort = 'cumulative'
+    return jsonify({
+        'success': True,
+        'enabled': profiler.enabled,
+        'rate': profiler.rate,
+        'directory': profiler.directory,
+        'files': len(profiler.files),
+        'routes': profiler.summary(top, sort, request.args.get('route'))
+    })
+
+@app.route('/api/holds', methods=['POST'])
+def api_hold_seats():
+    """选座时临时保留座位；带 hold_token 时替换原来的保留，座位列表为空时取消保留"""
+    try:
+        data = request.get_json()
+        tour_id = data.get('tour_id')
+        hold_token = data.get('hold_token') or None
+        seat_numbers = data.get('seat_numbers') or []
+        
+        tour = dataset.refresh().tours.get(tour_id)
+        if not tour:
+            return jsonify({'success': False, 'message': '班次不存在'})
+        if is_tour_departed(tour):
+            return jsonify({'success': False, 'message': '该班次已发车，不能预订'})
+        try:
+            seat_numbers = normalize_seats(seat_numbers, tour.max_seats)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)})
+        
+        try:
+            token, expires_at = holds.hold(tour_id, seat_numbers, hold_token, request.remote_addr)
+        except storage.BookingConflict as e:
+            return jsonify({'success': False, 'message': str(e)}), 409
+        except storage.HoldLimitExceeded as e:
+            return jsonify({'success': False, 'limited': True, 'message': str(e)}), 429
+        events.broker.wake()
+        return jsonify({
+            'success': True,
+            'hold_token': token,
+            'seat_numbers': seat_numbers,
+            'expires_at': expires_at,
+            'ttl': holds.HOLD_TTL if token else 0
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)})
+
+@app.route('/api/holds/<hold_token>', methods=['DELETE'])
+def api_release_hold(hold_token):
+    """取消座位保留"""
+    seats = holds.cancel(hold_token)
+    if seats is None:
+        return jsonify({'success': False, 'message': '座位保留不存在或已过期'}), 404
+    events.broker.wake()
+    return jsonify({'success': True, 'seat_numbers': seats})
+
+@app.route('/api/hold_stats', methods=['GET'])
+@admin_required
+def api_hold_stats():
+    """座位保留的转化率和过期释放吞吐（管理员）"""
+    return jsonify({'success': True, 'data': holds.reaper.stats()})
+
+# 没开实时推送时预订页多久取一次座位快照（秒）
+SEAT_POLL_SECONDS = int(os.environ.get('BOOKING_SEAT_POLL', '10'))
+
+@app.route('/api/tours/<int:tour_id>/seats', methods=['GET'])
+def api_tour_seats(tour_id):
+    """团期当前的占座快照（预订页轮询用），只有座位号，CDN 可以缓存"""
+    dataset.refresh()
+    tour_version = dataset.tour_version(tour_id)
+    seat_map = dataset.seat_maps.get(tour_id)
+    if tour_id not in dataset.tours or seat_map is None:
+        return jsonify({'success': False, 'message': '班次不存在'}), 404
+    etag = f'{storage.dataset_id()}-seats-{tour_id}-{tour_version}'
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    return with_cache_headers(jsonify({'success': True, 'taken': seat_map.taken_seats(),
+                                       'max_seats': seat_map.max_seats}), etag)
+
+# SSE 响应头：关掉 nginx 等反向代理的缓冲，事件才能立即送达
+EVENT_STREAM_HEADERS = {'Cache-Control': 'no-cache, no-transform', 'X-Accel-Buffering': 'no'}
+
+def open_seat_stream(tour_id):
+    """订阅团期座位变化并取当前占座快照，返回 (订阅者, 版本号, 快照)；班次不存在时返回 None
+
+    连接数已满时抛出 events.BrokerFull。下面的路由和 asgi.py 共用。
+    """
+    if tour_id not in dataset.refresh().tours:
+        return None
+    # 先订阅再取快照，两者之间发生的变化不会漏掉
+    sub = events.broker.subscribe(tour_id)
+    dataset.refresh()
+    version = dataset.version
+    seat_map = dataset.seat_maps.get(tour_id)
+    if seat_map is None:
+        events.broker.unsubscribe(sub)
+        return None
+    return sub, version, {'taken': seat_map.taken_seats(), 'max_seats': seat_map.max_seats}
+
+@app.route('/api/tours/<int:tour_id>/events', methods=['GET'])
+def api_tour_events(tour_id):
+    """团期座位变化的实时推送（SSE）：先发当前占座快照，之后推送 taken/released 增量"""
+    if not events.ENABLED:
+        return jsonify({'success': False, 'message': '未开启座位实时推送'}), 404
+    try:
+        opened = open_seat_stream(tour_id)
+    except events.BrokerFull as e:
+        resp = jsonify({'success': False, 'message': str(e)})
+        resp.headers['Retry-After'] = '30'
+        return resp, 503
+    if opened is None:
+        return jsonify({'success': False, 'message': '班次不存在'}), 404
+    sub, version, seats = opened
+    resp = Response(events.stream(sub, version, seats), mimetype='text/event-stream')
+    resp.headers.update(EVENT_STREAM_HEADERS)
+    # 连接还没开始读就断开时生成器不会运行 finally，这里再退订一次
+    resp.call_on_close(lambda: events.broker.unsubscribe(sub))
+    return resp
 
 # ---------- Vercel 专用启动方式 ----------
 application = app
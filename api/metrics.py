@@ -0,0 +1,186 @@
+"""进程内指标：请求延迟直方图、存储层耗时、读写字节数，以 Prometheus 文本格式导出
+
+每次记录只是一次二分查桶加几个整数自增（持锁），开销在微秒级，可以常开。
+指标按进程统计（gunicorn 每个 worker 各一份），抓取时得到的是处理这次抓取的 worker 的数据。
+"""
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+# 直方图的桶上限（秒），最后隐含一个 +Inf
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增不减的计数，按标签值分组"""
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        with self.lock:
+            return self.values.get(label_values, 0)
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            yield self.name, _label_text(self.labels, key), value
+
+
+class Gauge(Counter):
+    """可以任意设置的数值（抓取时由收集函数填入）"""
+    kind = 'gauge'
+
+    def set(self, *label_values, value):
+        with self.lock:
+            self.values[label_values] = value
+
+
+class Histogram:
+    """累积分桶的直方图，按标签值分组"""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.series = {}  # 标签值 -> [各桶计数..., +Inf 桶计数, 总和]
+
+    def observe(self, value, *label_values):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self.lock:
+            items = sorted((k, list(v)) for k, v in self.series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                labels = _label_text(self.labels + ('le',), key + (_number(bound),))
+                yield self.name + '_bucket', labels, cumulative
+            labels = _label_text(self.labels, key)
+            yield self.name + '_sum', labels, series[-1]
+            yield self.name + '_count', labels, cumulative
+
+
+class Registry:
+    """进程内所有指标，以及抓取时刷新 Gauge 的收集函数"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, func):
+        """登记一个抓取前调用的函数（可当装饰器用）"""
+        self.collectors.append(func)
+        return func
+
+    def render(self):
+        """Prometheus 文本格式（0.0.4）"""
+        for func in self.collectors:
+            func()
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    'booking_http_requests_total', 'HTTP requests by endpoint, method and status.',
+    ('endpoint', 'method', 'status')))
+http_latency = registry.register(Histogram(
+    'booking_http_request_duration_seconds', 'Time from request start until the response body is closed.',
+    ('endpoint', 'method')))
+http_bytes = registry.register(Counter(
+    'booking_http_bytes_total', 'Request and response body bytes (streamed responses are not counted).',
+    ('direction',)))
+storage_latency = registry.register(Histogram(
+    'booking_storage_duration_seconds', 'Time spent in storage operations.', ('op',)))
+storage_bytes = registry.register(Counter(
+    'booking_storage_bytes_total', 'Journal payload bytes read and written.', ('direction',)))
+render_latency = registry.register(Histogram(
+    'booking_render_duration_seconds', 'Time spent assembling HTML pages.', ('template',)))
+cache_lookups = registry.register(Gauge(
+    'booking_cache_lookups', 'Dataset cache refreshes by result since the process started.', ('result',)))
+cache_hit_ratio = registry.register(Gauge(
+    'booking_cache_hit_ratio', 'Share of dataset cache refreshes served without touching the journal.'))
+dataset_size = registry.register(Gauge(
+    'booking_dataset_items', 'Tours and bookings held in the in-process cache.', ('kind',)))
+live_connections = registry.register(Gauge(
+    'booking_sse_subscribers', 'Open seat-map event streams in this process.'))
+active_holds = registry.register(Gauge(
+    'booking_seat_holds', 'Seat holds currently stored (including expired ones not yet reaped).'))
+hold_ends = registry.register(Counter(
+    'booking_seat_hold_ends_total', 'Seat holds ended, by reason (converted, cancelled, replaced, expired).',
+    ('reason',)))
+asgi_pending = registry.register(Gauge(
+    'booking_asgi_pending_requests', 'Requests running in or queued for the ASGI worker thread pool.'))
+asgi_rejected = registry.register(Counter(
+    'booking_asgi_rejected_total', 'Requests answered with 503 because the ASGI worker pool and backlog were full.'))
+
+
+def timed(histogram, label):
+    """装饰器：把函数耗时记到 histogram 的 label 下"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, label)
+        return wrapper
+    return decorator
+
+
+def storage_timed(op):
+    return timed(storage_latency, op)
+
+
+def render_timed(template):
+    return timed(render_latency, template)
@@ -0,0 +1,115 @@
+"""团期和预订的内存记录（__slots__），代替原来的字典
+
+- 每条记录只有固定的几个槽位、没有 __dict__，比同样字段的字典省一半以上内存
+- 预订的座位号在加载时统一成 array('H')：旧数据里 seat_numbers 可能是列表、
+  单个数字或数字字符串，页面和接口直接用 booking.seats，不用再判断类型
+- to_dict() 转回原来的 JSON 结构（seat_numbers 保持原来是列表还是单个数字），
+  用于接口返回、写 journal 和导出
+
+缓存里的记录是各个请求共享的，只读不改；要改字段时用 replace() 复制一份。
+"""
+from array import array
+
+MAX_SEAT = 0xFFFF
+
+# 原始 seat_numbers 的形式
+SEATS_LIST = 0     # 列表（新数据都是这种）
+SEATS_SCALAR = 1   # 单个数字（旧数据）
+SEATS_MISSING = 2  # 没有 seat_numbers 字段（旧数据）
+
+
+def seat_array(value):
+    """把 seat_numbers 统一成 (array('H'), 原始形式)；无法识别或超出范围的座位号丢弃"""
+    form = SEATS_LIST if isinstance(value, list) else SEATS_SCALAR
+    seats = array('H')
+    for seat in value if form == SEATS_LIST else (value,):
+        try:
+            seat = int(seat)
+        except (TypeError, ValueError):
+            continue
+        if 0 <= seat <= MAX_SEAT:
+            seats.append(seat)
+    return seats, form
+
+
+class Tour:
+    """团期"""
+    __slots__ = ('id', 'date', 'time', 'destination', 'vehicle_model', 'max_seats', 'booked', 'departs_at')
+
+    def __init__(self, id, date, time, destination, vehicle_model, max_seats, booked=0, departs_at=None):
+        self.id = id
+        self.date = date
+        self.time = time
+        self.destination = destination
+        self.vehicle_model = vehicle_model
+        self.max_seats = max_seats
+        self.booked = booked
+        self.departs_at = departs_at
+
+    @classmethod
+    def from_dict(cls, data):
+        """从 journal 记录或旧JSON里的团期字典构造"""
+        return cls(data['id'], data.get('date'), data.get('time'), data.get('destination'),
+                   data.get('vehicle_model', '未指定'), data.get('max_seats', 0),
+                   data.get('booked', 0), data.get('departs_at'))
+
+    @property
+    def available(self):
+        """剩余座位数"""
+        return self.max_seats - self.booked
+
+    def replace(self, **changes):
+        """复制一份并修改部分字段"""
+        return Tour(**dict(self.to_dict(), **changes))
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Booking:
+    """预订；seats 是 array('H')，seat_form 记录原始 seat_numbers 的形式"""
+    __slots__ = ('code', 'name', 'phone', 'tour_id', 'created_at', 'seats', 'seat_form')
+
+    def __init__(self, code, name, phone, tour_id, created_at, seats=(), seat_form=SEATS_LIST):
+        self.code = code
+        self.name = name
+        self.phone = phone
+        self.tour_id = tour_id
+        self.created_at = created_at
+        self.seats = seats if isinstance(seats, array) else array('H', seats)
+        self.seat_form = seat_form
+
+    @classmethod
+    def from_dict(cls, data):
+        """从 journal 记录或旧JSON里的预订字典构造"""
+        if 'seat_numbers' in data:
+            seats, form = seat_array(data['seat_numbers'])
+        else:
+            seats, form = (), SEATS_MISSING
+        return cls(data.get('code', ''), data.get('name'), data.get('phone'), data.get('tour_id'),
+                   data.get('created_at'), seats, form)
+
+    @property
+    def seat_numbers(self):
+        """原来 JSON 里的 seat_numbers：列表，或旧数据的单个数字；没有该字段时为 None"""
+        if self.seat_form == SEATS_LIST:
+            return self.seats.tolist()
+        if self.seat_form == SEATS_SCALAR and self.seats:
+            return self.seats[0]
+        return None
+
+    def seat_text(self, empty='无'):
+        """页面上显示的座位号"""
+        return ', '.join(map(str, self.seats)) if self.seats else empty
+
+    def to_dict(self):
+        data = {
+            'code': self.code,
+            'name': self.name,
+            'phone': self.phone,
+            'tour_id': self.tour_id,
+            'created_at': self.created_at,
+        }
+        if self.seat_form != SEATS_MISSING:
+            data['seat_numbers'] = self.seat_numbers
+        return data
@@ -0,0 +1,131 @@
+"""按比例抽样的请求性能分析（cProfile）
+
+默认关闭。用环境变量 BOOKING_PROFILE_RATE（0~1，抽样比例）开启，或由管理员在
+/admin/profiling 临时调整（只影响处理这次请求的进程）。被抽中的请求：
+- 从请求开始一直分析到响应体发送完（流式页面也完整覆盖）
+- 按路由累加到内存里的统计，供 /admin/profiling 查看最耗时的函数
+- 写一份 .prof 文件到 BOOKING_PROFILE_DIR，每个进程最多保留 BOOKING_PROFILE_KEEP 份，
+  可以用 python -m pstats 或 snakeviz 打开
+"""
+import cProfile
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+
+PROFILE_RATE = float(os.environ.get('BOOKING_PROFILE_RATE', '0'))
+PROFILE_DIR = os.environ.get('BOOKING_PROFILE_DIR', '/tmp/booking_profiles')
+PROFILE_KEEP = int(os.environ.get('BOOKING_PROFILE_KEEP', '50'))
+SORT_KEYS = ('cumulative', 'tottime')
+
+logger = logging.getLogger(__name__)
+
+
+class RequestProfiler:
+    """抽样、按路由汇总并落盘 cProfile 结果"""
+
+    def __init__(self, rate=PROFILE_RATE, directory=PROFILE_DIR, keep=PROFILE_KEEP):
+        self.rate = rate
+        self.directory = directory
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.routes = {}      # 路由 -> {'samples': n, 'seconds': s, 'stats': pstats.Stats}
+        self.files = deque()  # 本进程写过的 .prof 文件，按时间顺序
+        self.skipped = 0
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def configure(self, rate):
+        """调整抽样比例（0 关闭）"""
+        self.rate = min(max(float(rate), 0.0), 1.0)
+
+    def reset(self):
+        with self.lock:
+            self.routes = {}
+
+    def start(self):
+        """按抽样比例决定是否分析这个请求，返回已开始的 Profile 或 None"""
+        if self.rate <= 0 or random.random() >= self.rate:
+            return None
+        if sys.getprofile() is not None:
+            # 同一线程已有别的分析器在运行（例如上一个请求的响应还没关闭）
+            self.skipped += 1
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except (ValueError, RuntimeError):
+            self.skipped += 1
+            return None
+        profile.started = time.perf_counter()
+        return profile
+
+    def finish(self, profile, route):
+        """停止分析，累加到路由统计并写 .prof 文件"""
+        profile.disable()
+        seconds = time.perf_counter() - profile.started
+        with self.lock:
+            entry = self.routes.get(route)
+            if entry is None:
+                entry = self.routes[route] = {'samples': 0, 'seconds': 0.0, 'stats': pstats.Stats(profile)}
+            else:
+                entry['stats'].add(profile)
+            entry['samples'] += 1
+            entry['seconds'] += seconds
+        try:
+            self._dump(profile, route)
+        except OSError:
+            logger.exception('写入性能分析文件失败')
+
+    def discard(self, profile):
+        profile.disable()
+
+    def summary(self, top=20, sort='cumulative', route=None):
+        """每个路由最耗时的 top 个函数"""
+        column = 3 if sort == 'cumulative' else 2
+        with self.lock:
+            items = [(r, dict(e)) for r, e in sorted(self.routes.items()) if route is None or r == route]
+        result = {}
+        for name, entry in items:
+            rows = sorted(entry['stats'].stats.items(), key=lambda item: item[1][column], reverse=True)[:top]
+            result[name] = {
+                'samples': entry['samples'],
+                'avg_ms': round(entry['seconds'] / entry['samples'] * 1000, 3),
+                'top': [{
+                    'function': f'{os.path.basename(file)}:{line}({func})',
+                    'ncalls': nc,
+                    'primitive_calls': cc,
+                    'tottime': round(tt, 6),
+                    'cumtime': round(ct, 6),
+                    'percall_ms': round(ct / nc * 1000, 4) if nc else 0.0,
+                } for (file, line, func), (cc, nc, tt, ct, _) in rows],
+            }
+        return result
+
+    def _dump(self, profile, route):
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'
+        path = os.path.join(self.directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-'
+                                            f'{int(time.time() * 1000) % 1000:03d}-{slug}.prof')
+        profile.dump_stats(path)
+        with self.lock:
+            self.files.append(path)
+            expired = []
+            while len(self.files) > self.keep:
+                expired.append(self.files.popleft())
+        for old in expired:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+
+# 进程内唯一的分析器
+profiler = RequestProfiler()
@@ -0,0 +1,214 @@
+"""页面渲染：静态页面框架只在导入时拼好一次，每次请求只拼接标题和正文
+
+用户填写的字段（姓名、手机、目的地等）在插入HTML前必须用 esc() 转义。
+"""
+from html import escape
+
+import metrics
+
+
+def esc(value):
+    """转义要插入HTML的用户数据（None 显示为空）"""
+    return escape('' if value is None else str(value))
+
+
+# 页面框架（CSS/JS 都在这里），按标题和正文的位置切成三段
+_SHELL_HEAD = '''
+<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=5.0">
+    <title>'''
+_SHELL_NAV = ''' - 携程旅游订车助手</title>
+    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css">
+    <style>
+        /* 全局CSS样式 */
+        * { margin: 0; padding: 0; box-sizing: border-box; font-family: 'Segoe UI', 'Microsoft YaHei', sans-serif; }
+        body { background: linear-gradient(135deg, #6a11cb 0%, #2575fc 100%); color: #333; min-height: 100vh; padding: 20px; }
+        .container { max-width: 1200px; margin: 0 auto; }
+        .navbar { background: white; padding: 15px 25px; border-radius: 12px; box-shadow: 0 4px 20px rgba(0,0,0,0.1); display: flex; justify-content: space-between; align-items: center; margin-bottom: 30px; }
+        .logo { font-size: 1.5rem; font-weight: bold; color: #6a11cb; text-decoration: none; }
+        .nav-links a { margin-left: 20px; color: #555; text-decoration: none; font-weight: 500; }
+        .card { background: white; border-radius: 16px; padding: 25px; margin-bottom: 25px; box-shadow: 0 8px 30px rgba(0,0,0,0.12); transition: transform 0.3s; }
+        .card:hover { transform: translateY(-5px); }
+        .btn { display: inline-block; background: linear-gradient(to right, #6a11cb, #2575fc); color: white; padding: 12px 28px; border-radius: 50px; text-decoration: none; font-weight: 600; border: none; cursor: pointer; font-size: 1rem; }
+        .btn:hover { opacity: 0.9; }
+        .tour-card { border-left: 6px solid #6a11cb; }
+        .status-available { background: #d4edda; color: #155724; padding: 5px 15px; border-radius: 20px; font-size: 0.9rem; display: inline-block; }
+        .status-full { background: #f8d7da; color: #721c24; padding: 5px 15px; border-radius: 20px; font-size: 0.9rem; display: inline-block; }
+        .status-departed { background: #e2e3e5; color: #383d41; padding: 5px 15px; border-radius: 20px; font-size: 0.9rem; display: inline-block; }
+        .progress-bar { height: 10px; background: #e9ecef; border-radius: 5px; overflow: hidden; margin: 15px 0; }
+        .progress-fill { height: 100%; background: linear-gradient(to right, #00b09b, #96c93d); border-radius: 5px; }
+        /* 响应式设计 */
+        @media (max-width: 768px) {
+            .container { padding: 0 10px; }
+            .navbar { flex-direction: column; text-align: center; padding: 15px; }
+            .nav-links { margin-top: 15px; }
+            .nav-links a { margin: 0 10px; }
+            .card { padding: 20px; }
+        }
+        /* 座位选择样式 */
+        .seat-map {
+            display: grid;
+            grid-template-columns: repeat(5, 1fr); /* 每行最多5个座位 */
+            gap: 10px;
+            margin: 20px 0;
+        }
+        .seat {
+            padding: 15px;
+            text-align: center;
+            background: #e9ecef;
+            border-radius: 8px;
+            cursor: pointer;
+            font-weight: bold;
+            border: 2px solid #dee2e6;
+            transition: all 0.2s;
+        }
+        .seat:hover {
+            background: #d0ebff;
+            border-color: #74c0fc;
+        }
+        .seat.selected {
+            background: #51cf66;
+            color: white;
+            border-color: #2b8a3e;
+        }
+        .seat.unavailable {
+            background: #ffc9c9;
+            color: #868e96;
+            cursor: not-allowed;
+            border-color: #fa5252;
+        }
+        /* 预订详情表格样式 */
+        .booking-details {
+            margin-top: 20px;
+            border-top: 2px solid #eee;
+            padding-top: 20px;
+        }
+        .booking-table {
+            width: 100%;
+            border-collapse: collapse;
+            margin-top: 10px;
+        }
+        .booking-table th, .booking-table td {
+            padding: 10px;
+            text-align: left;
+            border-bottom: 1px solid #eee;
+        }
+        .booking-table th {
+            background: #f8f9fa;
+        }
+        .booking-table tr:hover {
+            background: #f5f5f5;
+        }
+        /* 管理员登录样式 */
+        .login-container {
+            max-width: 400px;
+            margin: 100px auto;
+            background: white;
+            padding: 40px;
+            border-radius: 16px;
+            box-shadow: 0 8px 30px rgba(0,0,0,0.15);
+        }
+        .login-input {
+            width: 100%;
+            padding: 12px;
+            margin: 15px 0;
+            border: 2px solid #ddd;
+            border-radius: 8px;
+            font-size: 1rem;
+        }
+    </style>
+</head>
+<body>
+    <nav class="navbar">
+        <a href="/" class="logo"><i class="fas fa-bus"></i> 携程旅游订车助手</a>
+        <div class="nav-links">
+            <!-- 这是给客人看的首页链接 -->
+            <a href="/"><i class="fas fa-home"></i> 首页</a>
+            <!-- 这是管理员入口，需要密码验证 -->
+            <a href="/admin"><i class="fas fa-cog"></i> 管理</a>
+        </div>
+    </nav>
+    <div class="container">
+        '''
+_SHELL_TAIL = '''
+    </div>
+    <footer style="text-align: center; color: white; margin-top: 50px; padding: 20px; opacity: 0.8;">
+        <p>© 南野际</p>
+    </footer>
+    <script>
+        function escapeHtml(value) {
+            return String(value ?? '').replace(/[&<>"']/g, c => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c]));
+        }
+        function showAlert(msg, type='success') {
+            alert(msg);
+        }
+        function copyToClipboard(text) {
+            navigator.clipboard.writeText(text).then(() => alert('已复制: ' + text));
+        }
+        function toggleBookingDetails(tourId) {
+            const detailsDiv = document.getElementById('booking-details-' + tourId);
+            const toggleBtn = document.getElementById('toggle-btn-' + tourId);
+            if (detailsDiv.style.display === 'none') {
+                detailsDiv.style.display = 'block';
+                toggleBtn.innerHTML = '<i class="fas fa-chevron-up"></i> 隐藏预订详情';
+                // 如果内容为空，则加载预订详情
+                if (detailsDiv.innerHTML.trim() === '') {
+                    loadBookingDetails(tourId);
+                }
+            } else {
+                detailsDiv.style.display = 'none';
+                toggleBtn.innerHTML = '<i class="fas fa-chevron-down"></i> 查看预订详情';
+            }
+        }
+        
+        async function loadBookingDetails(tourId) {
+            try {
+                const response = await fetch('/api/get_tour_bookings?tour_id=' + tourId);
+                const result = await response.json();
+                
+                if (result.success) {
+                    const detailsDiv = document.getElementById('booking-details-' + tourId);
+                    let html = '';
+                    
+                    if (result.data.length === 0) {
+                        html = '<p style="text-align: center; color: #666;">暂无预订记录</p>';
+                    } else {
+                        html = '<table class="booking-table">';
+                        html += '<tr><th>预订码</th><th>姓名</th><th>手机</th><th>座位号</th><th>预订时间</th></tr>';
+                        for (const booking of result.data) {
+                            html += `<tr>
+                                <td><strong>${escapeHtml(booking.code)}</strong></td>
+                                <td>${escapeHtml(booking.name)}</td>
+                                <td>${escapeHtml(booking.phone)}</td>
+                                <td>${escapeHtml(Array.isArray(booking.seat_numbers) ? booking.seat_numbers.join(', ') : booking.seat_numbers)}</td>
+                                <td>${escapeHtml(booking.created_at)}</td>
+                            </tr>`;
+                        }
+                        html += '</table>';
+                    }
+                    
+                    detailsDiv.innerHTML = html;
+                }
+            } catch (error) {
+                console.error('加载预订详情失败:', error);
+            }
+        }
+    </script>
+</body>
+</html>
+'''
+
+
+@metrics.render_timed('page_parts')
+def page_parts(title):
+    """返回 (正文之前的部分, 正文之后的部分)，供流式输出使用"""
+    return _SHELL_HEAD + esc(title) + _SHELL_NAV, _SHELL_TAIL
+
+
+@metrics.render_timed('page')
+def get_html_template(title, body_content):
+    """生成完整的HTML页面框架"""
+    return ''.join((_SHELL_HEAD, esc(title), _SHELL_NAV, body_content, _SHELL_TAIL))
@@ -0,0 +1,127 @@
+"""周期班次：按“每周几 + 出发时间 + 日期范围”定义的固定线路，按需生成团期
+
+- 定义存在 schedules 表里，不预先生成几年的团期
+- 只生成从今天起 BOOKING_SCHEDULE_DAYS 天内的团期（滚动窗口）；每个周期班次记着已经生成到哪天，
+  之后只补新进入窗口的日期，不重新生成
+- 由后台清理线程（sweeper.start_sweeper）定期调用 ensure_materialized()，同一进程每天只真正写一次库；
+  新建周期班次时立即生成一次。页面请求只读，不触发写库
+- 不跑后台线程的部署用定时任务（cron）生成：python api/schedules.py
+"""
+import logging
+import os
+import threading
+from datetime import date, timedelta
+
+import storage
+from models import MAX_SEAT
+
+WINDOW_DAYS = int(os.environ.get('BOOKING_SCHEDULE_DAYS', '30'))
+WEEKDAY_NAMES = '一二三四五六日'
+
+logger = logging.getLogger(__name__)
+
+
+class Materializer:
+    """记录本进程已经把团期生成到哪天，窗口没往前滚就什么都不做"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.done_through = None
+        self.runs = 0
+        self.created = 0
+
+    def ensure(self, today=None):
+        """保证窗口内的团期都已生成，返回这次新建的团期数；出错时只记日志，下次再试"""
+        today = date.today() if today is None else today
+        last = (today + timedelta(days=WINDOW_DAYS - 1)).isoformat()
+        if self.done_through == last:
+            return 0
+        with self.lock:
+            if self.done_through == last:
+                return 0
+            try:
+                created = storage.materialize_schedules(today.isoformat(), last)
+            except Exception:
+                logger.exception('生成周期班次的团期失败')
+                return 0
+            self.done_through = last
+            self.runs += 1
+            self.created += created
+            if created:
+                logger.info('周期班次生成了 %d 个团期（至 %s）', created, last)
+            return created
+
+    def invalidate(self):
+        """周期班次有变化，下次 ensure 时重新检查"""
+        self.done_through = None
+
+
+# 进程内唯一的实例
+materializer = Materializer()
+
+
+def ensure_materialized():
+    return materializer.ensure()
+
+
+def parse_weekdays(value):
+    """每周几出发：[1, 3, 5]、'135' 或 '1,3,5'（1 是周一）-> '135'"""
+    if value is None or value == '':
+        return '1234567'
+    if isinstance(value, str):
+        value = [ch for ch in value if not ch.isspace() and ch != ',']
+    if not isinstance(value, list):
+        raise ValueError('每周出发日格式不对')
+    days = set()
+    for day in value:
+        if isinstance(day, bool) or str(day) not in '1234567' or len(str(day)) != 1:
+            raise ValueError(f'每周出发日无效: {day}')
+        days.add(str(day))
+    if not days:
+        raise ValueError('请至少选择一个出发日')
+    return ''.join(sorted(days))
+
+
+def parse_schedule(data):
+    """校验新建周期班次的请求，返回 storage.create_schedule 要的字典"""
+    destination = str(data.get('destination') or '').strip()
+    if not destination:
+        raise ValueError('请填写目的地')
+    departure = storage.parse_departure('2000-01-01', str(data.get('time') or '').strip())
+    if departure is None:
+        raise ValueError('出发时间格式应为 HH:MM')
+    try:
+        max_seats = int(data.get('max_seats', 6))
+    except (TypeError, ValueError):
+        raise ValueError('座位数应为整数')
+    if not 1 <= max_seats <= MAX_SEAT:
+        raise ValueError('座位数无效')
+    try:
+        start_date = date.fromisoformat(data.get('start_date') or date.today().isoformat()).isoformat()
+        end_date = date.fromisoformat(data['end_date']).isoformat() if data.get('end_date') else None
+    except (TypeError, ValueError):
+        raise ValueError('日期格式应为 YYYY-MM-DD')
+    if end_date and end_date < start_date:
+        raise ValueError('结束日期不能早于开始日期')
+    return {
+        'destination': destination,
+        'vehicle_model': str(data.get('vehicle_model') or '').strip() or '未指定',
+        'max_seats': max_seats,
+        'time': departure.strftime('%H:%M'),
+        'weekdays': parse_weekdays(data.get('weekdays')),
+        'start_date': start_date,
+        'end_date': end_date,
+    }
+
+
+def weekday_text(weekdays):
+    """'135' -> '周一、周三、周五'；每天都开时为 '每天'"""
+    if weekdays == '1234567':
+        return '每天'
+    return '、'.join('周' + WEEKDAY_NAMES[int(day) - 1] for day in weekdays)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    storage.init_db()
+    print(f'周期班次生成了 {ensure_materialized()} 个团期')
@@ -0,0 +1,158 @@
+"""预订搜索索引：预订码精确匹配、手机号前缀、姓名子串（支持中文）
+
+- 手机号：按 (手机号, 序号) 排好序的列表，前缀查询用二分定位，O(log n)
+- 姓名：长度 1~3 的字符 n-gram 倒排表。查询不超过3个字时直接取对应倒排表；
+  更长的查询取其中最短的三元组倒排表做候选，再逐个确认子串，找够一页就停
+
+索引由 cache.DatasetCache 在重放 journal 时增量维护。
+"""
+from bisect import bisect_left, insort
+from itertools import islice
+
+MAX_GRAM = 3
+# 搜索结果每页默认/最多多少条
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# 倒排表里失效的序号超过总数的这个比例（且至少 COMPACT_MIN 个）时清理一次
+COMPACT_RATIO = 0.25
+COMPACT_MIN = 10000
+
+
+def name_grams(name):
+    """姓名的所有长度 1~3 的子串（已转小写、去重）"""
+    name = name.lower()
+    grams = set()
+    for size in range(1, MAX_GRAM + 1):
+        for i in range(len(name) - size + 1):
+            grams.add(name[i:i + size])
+    return grams
+
+
+class BookingSearchIndex:
+    """手机号前缀和姓名子串的内存索引"""
+
+    def __init__(self):
+        self._next_key = 0
+        self._keys = {}      # id(预订) -> 序号（序号按加入顺序递增）
+        self._bookings = {}  # 序号 -> 预订
+        self._phones = []    # 排好序的 (手机号, 序号)
+        self._grams = {}     # n-gram -> 递增的序号列表（删除后惰性过滤）
+        self._postings = 0   # 倒排表里的序号总数
+        self._dead = 0       # 其中已删除预订的序号数
+
+    def rebuild(self, bookings):
+        """按给定的预订列表整体重建"""
+        self.__init__()
+        phones = []
+        for booking in bookings:
+            key = self._register(booking)
+            phones.append((booking.phone or '', key))
+        phones.sort()
+        self._phones = phones
+
+    def add(self, booking):
+        """加入一条新预订"""
+        key = self._register(booking)
+        insort(self._phones, (booking.phone or '', key))
+
+    def remove_many(self, bookings):
+        """删除一批预订：手机号列表只过滤重建一次，O(n)，不逐条删除
+
+        倒排表里的序号先留着（查询时跳过），失效的超过 COMPACT_RATIO 后再一次性清理，
+        长时间运行的进程里倒排表不会越积越长。
+        """
+        removed = set()
+        for booking in bookings:
+            key = self._keys.pop(id(booking), None)
+            if key is not None:
+                del self._bookings[key]
+                removed.add(key)
+                self._dead += len(name_grams(booking.name or ''))
+        if removed:
+            self._phones = [entry for entry in self._phones if entry[1] not in removed]
+        if self._dead > max(COMPACT_MIN, self._postings * COMPACT_RATIO):
+            self._compact()
+
+    def phone_prefix(self, prefix):
+        """按手机号顺序返回手机号以 prefix 开头的预订"""
+        phones = self._phones
+        i = bisect_left(phones, (prefix,))
+        while i < len(phones) and phones[i][0].startswith(prefix):
+            booking = self._bookings.get(phones[i][1])
+            if booking is not None:
+                yield booking
+            i += 1
+
+    def name_contains(self, text):
+        """按创建顺序返回姓名包含 text 的预订"""
+        text = text.lower()
+        if len(text) <= MAX_GRAM:
+            candidates = self._grams.get(text, ())
+            verify = False
+        else:
+            postings = [self._grams.get(text[i:i + MAX_GRAM], ())
+                        for i in range(len(text) - MAX_GRAM + 1)]
+            candidates = min(postings, key=len)
+            verify = True
+        for key in candidates:
+            booking = self._bookings.get(key)
+            if booking is None:
+                continue
+            if verify and text not in (booking.name or '').lower():
+                continue
+            yield booking
+
+    def _register(self, booking):
+        key = self._next_key
+        self._next_key += 1
+        self._keys[id(booking)] = key
+        self._bookings[key] = booking
+        grams = name_grams(booking.name or '')
+        for gram in grams:
+            self._grams.setdefault(gram, []).append(key)
+        self._postings += len(grams)
+        return key
+
+    def _compact(self):
+        """从倒排表里去掉已删除预订的序号，空的倒排表整个去掉"""
+        live = self._bookings
+        grams = {}
+        for gram, keys in self._grams.items():
+            keys = [key for key in keys if key in live]
+            if keys:
+                grams[gram] = keys
+        self._grams = grams
+        self._postings -= self._dead
+        self._dead = 0
+
+
+def search_bookings(dataset, query, offset=0, limit=DEFAULT_LIMIT):
+    """在缓存的数据集里搜索预订，返回 (本页结果, 是否还有下一页)
+
+    顺序：预订码精确匹配 -> 手机号前缀匹配 -> 姓名子串匹配，同一预订只出现一次。
+    空查询按创建顺序返回全部预订。
+    """
+    query = query.strip()
+    if not query:
+        matches = iter(dataset.bookings)
+    else:
+        matches = _unique(_chain_matches(dataset, query))
+    page = list(islice(matches, offset, offset + limit + 1))
+    return page[:limit], len(page) > limit
+
+
+def _chain_matches(dataset, query):
+    booking = dataset.find_booking(query)
+    if booking is not None:
+        yield booking
+    if query.isdigit():
+        yield from dataset.search.phone_prefix(query)
+    yield from dataset.search.name_contains(query)
+
+
+def _unique(bookings):
+    seen = set()
+    for booking in bookings:
+        if id(booking) not in seen:
+            seen.add(id(booking))
+            yield booking
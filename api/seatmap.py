@@ -0,0 +1,100 @@
+"""团期座位占用表：每个座位一个字节，座位号从1开始
+
+随团期一起存进数据库（tours.seat_map），预订/取消时在同一事务里更新，
+\"某个座位是否空闲\"和\"剩余座位数\"都是 O(1)，不再扫描预订记录。
+被临时保留（HELD）的座位对其他人不可选，但不计入已预订人数。
+"""
+
+FREE = 0
+BOOKED = 1
+HELD = 2
+
+
+def normalize_seats(seat_numbers, max_seats):
+    """把请求里的座位号整理成不重复的整数列表，越界或重复时抛出 ValueError"""
+    if not isinstance(seat_numbers, list):
+        seat_numbers = [seat_numbers]
+    seats = []
+    for seat in seat_numbers:
+        if isinstance(seat, bool):
+            raise ValueError(f'座位号无效: {seat}')
+        try:
+            seat = int(seat)
+        except (TypeError, ValueError):
+            raise ValueError(f'座位号无效: {seat}')
+        if not 1 <= seat <= max_seats:
+            raise ValueError(f'座位号无效: {seat}')
+        if seat in seats:
+            raise ValueError(f'{seat}号座位重复选择')
+        seats.append(seat)
+    return seats
+
+
+class SeatMap:
+    """一个团期的座位占用表，同时维护已占座位数（含保留）和保留座位数"""
+    __slots__ = ('states', 'taken', 'held')
+
+    def __init__(self, max_seats, data=None):
+        if data is None:
+            self.states = bytearray(max_seats)
+            self.taken = 0
+            self.held = 0
+        else:
+            self.states = bytearray(data)
+            if len(self.states) < max_seats:
+                # 团期座位数被调大时补齐空位
+                self.states.extend(bytes(max_seats - len(self.states)))
+            self.taken = len(self.states) - self.states.count(FREE)
+            self.held = self.states.count(HELD)
+
+    @property
+    def max_seats(self):
+        return len(self.states)
+
+    def is_free(self, seat):
+        """座位是否空闲"""
+        return self.states[seat - 1] == FREE
+
+    @property
+    def booked(self):
+        """已预订座位数（不含保留）"""
+        return self.taken - self.held
+
+    def free_count(self):
+        """剩余空位数"""
+        return len(self.states) - self.taken
+
+    def take(self, seats):
+        """占用一组座位（调用前应已确认都空闲）"""
+        self._set(seats, BOOKED)
+
+    def hold(self, seats):
+        """临时保留一组座位（调用前应已确认都空闲）"""
+        self._set(seats, HELD)
+
+    def release(self, seats):
+        """释放一组座位"""
+        for seat in seats:
+            if 1 <= seat <= len(self.states) and self.states[seat - 1] != FREE:
+                if self.states[seat - 1] == HELD:
+                    self.held -= 1
+                self.states[seat - 1] = FREE
+                self.taken -= 1
+
+    def taken_seats(self):
+        """按座位号顺序返回所有已占座位"""
+        return [i + 1 for i, state in enumerate(self.states) if state != FREE]
+
+    def to_bytes(self):
+        return bytes(self.states)
+
+    def _set(self, seats, state):
+        for seat in seats:
+            old = self.states[seat - 1]
+            if old == FREE:
+                self.taken += 1
+            elif old == HELD:
+                self.held -= 1
+            if state == HELD:
+                self.held += 1
+            self.states[seat - 1] = state
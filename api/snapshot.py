@@ -0,0 +1,395 @@
+"""数据集快照：紧凑的二进制列式格式，进程冷启动时代替逐行读库
+
+文件布局（小端）：
+    头部  magic 'BKSNAP' | 格式版本 u16 | 数据集版本(journal 序号) i64 | 数据库标识 16字节 |
+          字符串数 u32 | 团期数 u32 | 预订数 u32
+    之后是若干段，每段前面一个 u64 字节长度：
+    1. 字符串表：各字符串在正文里的结束位置（u64，按字符计）+ UTF-8 正文。没有字符串含 NUL 时
+       正文用 NUL 分隔、位置段留空，读取时一次 split 即可。
+       日期、时间、目的地、车型、姓名、手机号等所有字符串都只存一份，其它列存下标（0 表示 None）
+    2. 团期列：id、座位数、出发时间戳(NaN 表示 None)、日期/时间/目的地/车型下标、占用表长度、占用表字节
+    3. 预订列：团期ID、预订码/姓名/手机/创建时间下标、座位数（-1 表示没有座位字段，-2 表示单个数字，
+       -3 表示单个无效值）、座位号
+
+读取时用 mmap 映射文件，每列一次性拷进 array，再拼成和 storage.load_all 一样的记录。
+
+后台线程定期把进程内缓存（cache.DatasetCache，本来就跟着 journal 增量更新）写成快照
+（DB_FILE.snap），不重新读库；多个进程里只有拿到 DB_FILE.snap.lock 文件锁的那一个写，
+其余进程的线程只是定期尝试接手（写快照的进程退出后锁自动释放）。
+DatasetCache 冷启动时如果快照属于同一个库、且 journal 仍完整保留着快照之后的修改，
+就先加载快照再重放 journal，不用逐行读库。
+
+命令行：
+    python api/snapshot.py export /tmp/booking_data.snap out.json                  # 快照 -> JSON（调试用）
+    python api/snapshot.py dump [out.snap]                                         # 数据库 -> 快照
+    python api/snapshot.py info /tmp/booking_data.snap
+"""
+import argparse
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+
+import storage
+from models import SEATS_LIST, SEATS_MISSING, SEATS_SCALAR, Booking, Tour
+from seatmap import SeatMap
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有，每个进程都会写（最后一份会覆盖前面的，不影响正确性）
+    fcntl = None
+
+SNAPSHOT_FILE = os.environ.get('BOOKING_SNAPSHOT_FILE', storage.DB_FILE + '.snap')
+# 多久检查一次是否需要重写快照（秒），0 表示不在后台写
+SNAPSHOT_INTERVAL = float(os.environ.get('BOOKING_SNAPSHOT_INTERVAL', '600'))
+
+MAGIC = b'BKSNAP'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<6sHq16sIII')
+SECTION = struct.Struct('<Q')
+NO_SEATS = -1      # 预订没有 seat_numbers 字段
+SCALAR_SEAT = -2   # seat_numbers 是单个数字而不是列表
+NULL_SEAT = -3     # seat_numbers 是 null 或无法识别的单个值
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotError(Exception):
+    """快照文件损坏或格式不对"""
+
+
+class Header:
+    """快照头部信息"""
+    __slots__ = ('format_version', 'version', 'dataset_id', 'strings', 'tours', 'bookings')
+
+    def __init__(self, format_version, version, dataset_id, strings, tours, bookings):
+        self.format_version = format_version
+        self.version = version
+        self.dataset_id = dataset_id
+        self.strings = strings
+        self.tours = tours
+        self.bookings = bookings
+
+
+class _StringTable:
+    """写快照时给字符串编号，相同的字符串只存一次；0 号留给 None"""
+
+    def __init__(self):
+        self.index = {}
+        self.strings = []
+
+    def __call__(self, value):
+        if value is None:
+            return 0
+        value = str(value)
+        i = self.index.get(value)
+        if i is None:
+            self.strings.append(value)
+            i = self.index[value] = len(self.strings)
+        return i
+
+
+def _le(arr):
+    """数组按小端存储（在大端机器上翻转字节序）"""
+    if sys.byteorder != 'little':
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr
+
+
+# ---------- 写 ----------
+def write(path, version, tours, bookings, dataset_id=None):
+    """把 (版本号, [(团期, 座位占用表)], [预订]) 写成快照；先写临时文件再原子替换"""
+    intern = _StringTable()
+
+    tour_ids = array('q')
+    tour_seats = array('I')
+    tour_departs = array('d')
+    tour_text = [array('I') for _ in range(4)]
+    map_lengths = array('I')
+    maps = bytearray()
+    for tour, seat_map in tours:
+        tour_ids.append(tour.id)
+        tour_seats.append(tour.max_seats or 0)
+        tour_departs.append(math.nan if tour.departs_at is None else tour.departs_at)
+        for column, value in zip(tour_text, (tour.date, tour.time, tour.destination, tour.vehicle_model)):
+            column.append(intern(value))
+        data = seat_map.to_bytes()
+        map_lengths.append(len(data))
+        maps += data
+
+    booking_tours = array('q')
+    booking_text = [array('I') for _ in range(4)]
+    seat_counts = array('i')
+    seats = array('H')
+    for booking in bookings:
+        booking_tours.append(booking.tour_id if booking.tour_id is not None else 0)
+        for column, value in zip(booking_text, (booking.code, booking.name, booking.phone, booking.created_at)):
+            column.append(intern(value))
+        if booking.seat_form == SEATS_MISSING:
+            seat_counts.append(NO_SEATS)
+        elif booking.seat_form == SEATS_SCALAR:
+            seat_counts.append(SCALAR_SEAT if booking.seats else NULL_SEAT)
+        else:
+            seat_counts.append(len(booking.seats))
+        seats.extend(booking.seats)
+
+    offsets = array('Q')
+    if any('\x00' in text for text in intern.strings):
+        total = 0
+        for text in intern.strings:
+            total += len(text)
+            offsets.append(total)
+        body = ''.join(intern.strings).encode('utf-8')
+    else:
+        body = '\x00'.join(intern.strings).encode('utf-8')
+
+    sections = [_le(offsets).tobytes(), body,
+                _le(tour_ids).tobytes(), _le(tour_seats).tobytes(), _le(tour_departs).tobytes()]
+    sections += [_le(column).tobytes() for column in tour_text]
+    sections += [_le(map_lengths).tobytes(), bytes(maps), _le(booking_tours).tobytes()]
+    sections += [_le(column).tobytes() for column in booking_text]
+    sections += [_le(seat_counts).tobytes(), _le(seats).tobytes()]
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, version, bytes.fromhex(dataset_id) if dataset_id else bytes(16),
+                         len(intern.strings), len(tour_ids), len(booking_tours))
+    tmp = f'{path}.tmp-{os.getpid()}'
+    with open(tmp, 'wb') as f:
+        f.write(header)
+        for data in sections:
+            f.write(SECTION.pack(len(data)))
+            f.write(data)
+    os.replace(tmp, path)
+    return os.path.getsize(path)
+
+
+# ---------- 读 ----------
+def read_header(path):
+    """只读头部，文件不是快照时抛出 SnapshotError"""
+    with open(path, 'rb') as f:
+        data = f.read(HEADER.size)
+    return _parse_header(data)
+
+
+def _parse_header(data):
+    if len(data) < HEADER.size:
+        raise SnapshotError('快照文件太短')
+    magic, format_version, version, dataset_id, strings, tours, bookings = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise SnapshotError('不是快照文件')
+    if format_version != FORMAT_VERSION:
+        raise SnapshotError(f'不支持的快照格式版本: {format_version}')
+    return Header(format_version, version, dataset_id.hex() if any(dataset_id) else None,
+                  strings, tours, bookings)
+
+
+def read(path):
+    """读快照，返回 (头部, [(Tour, 座位占用表)], [Booking])，结构与 storage.load_all 相同"""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        header = _parse_header(mm[:HEADER.size])
+        reader = _SectionReader(mm, HEADER.size)
+        try:
+            offsets = reader.array('Q')
+            body = reader.bytes().decode('utf-8')
+            tour_ids = reader.array('q')
+            tour_seats = reader.array('I')
+            tour_departs = reader.array('d')
+            tour_text = [reader.array('I') for _ in range(4)]
+            map_lengths = reader.array('I')
+            maps = reader.bytes()
+            booking_tours = reader.array('q')
+            booking_text = [reader.array('I') for _ in range(4)]
+            seat_counts = reader.array('i')
+            seats = reader.array('H')
+        except (struct.error, ValueError) as e:
+            raise SnapshotError(f'快照文件损坏: {e}')
+    if offsets:
+        ends = offsets.tolist()
+        strings = [None] + [body[start:end] for start, end in zip([0] + ends, ends)]
+    else:
+        strings = [None] + body.split('\x00') if header.strings else [None]
+    if len(strings) != header.strings + 1 or len(tour_ids) != header.tours or len(booking_tours) != header.bookings:
+        raise SnapshotError('快照文件损坏: 行数与头部不符')
+
+    tours = []
+    dates, times, destinations, vehicles = tour_text
+    pos = 0
+    for i in range(header.tours):
+        length = map_lengths[i]
+        seat_map = SeatMap(tour_seats[i], maps[pos:pos + length])
+        pos += length
+        departs_at = tour_departs[i]
+        tours.append((Tour(tour_ids[i], strings[dates[i]], strings[times[i]], strings[destinations[i]],
+                           strings[vehicles[i]], tour_seats[i], seat_map.booked,
+                           None if math.isnan(departs_at) else departs_at), seat_map))
+
+    bookings = []
+    append = bookings.append
+    pos = 0
+    columns = [column.tolist() for column in booking_text]
+    for code, name, phone, created, tour_id, count in zip(*columns, booking_tours.tolist(), seat_counts.tolist()):
+        if count >= 0:
+            booking_seats, form = seats[pos:pos + count], SEATS_LIST
+            pos += count
+        elif count == SCALAR_SEAT:
+            booking_seats, form = seats[pos:pos + 1], SEATS_SCALAR
+            pos += 1
+        else:
+            booking_seats, form = array('H'), SEATS_SCALAR if count == NULL_SEAT else SEATS_MISSING
+        append(Booking(strings[code], strings[name], strings[phone], tour_id, strings[created], booking_seats, form))
+    return header, tours, bookings
+
+
+class _SectionReader:
+    def __init__(self, mm, pos):
+        self.mm = mm
+        self.pos = pos
+
+    def bytes(self):
+        (length,) = SECTION.unpack_from(self.mm, self.pos)
+        start = self.pos + SECTION.size
+        if start + length > len(self.mm):
+            raise ValueError('段长度超出文件')
+        self.pos = start + length
+        return self.mm[start:self.pos]
+
+    def array(self, typecode):
+        arr = array(typecode)
+        arr.frombytes(self.bytes())
+        if sys.byteorder != 'little':
+            arr.byteswap()
+        return arr
+
+
+# ---------- 与数据库/缓存配合 ----------
+def load_usable(path=None):
+    """冷启动用：快照属于当前数据库、且 journal 还保留着之后的全部修改时返回
+    (版本号, 团期, 预订)，否则返回 None（调用方改为整库读取）"""
+    path = SNAPSHOT_FILE if path is None else path
+    if not os.path.exists(path):
+        return None
+    try:
+        header = read_header(path)
+        if header.dataset_id is None or header.dataset_id != storage.dataset_id():
+            return None
+        if header.version > storage.current_version() or storage.read_journal(header.version, limit=1) is None:
+            return None
+        header, tours, bookings = read(path)
+    except (OSError, SnapshotError):
+        logger.exception('快照文件不可用，改为从数据库加载')
+        return None
+    return header.version, tours, bookings
+
+
+def dump(path=None):
+    """把数据库当前内容写成快照（整库读取，命令行用），返回 (版本号, 文件大小)"""
+    path = SNAPSHOT_FILE if path is None else path
+    version, tours, bookings = storage.load_all()
+    return version, write(path, version, tours, bookings, storage.dataset_id())
+
+
+def dump_cache(cache, path=None):
+    """把进程内缓存的数据集写成快照（不读库），返回 (版本号, 文件大小)"""
+    path = SNAPSHOT_FILE if path is None else path
+    version, tours, bookings = cache.export()
+    return version, write(path, version, tours, bookings, storage.dataset_id())
+
+
+# 本进程拿到的写快照文件锁（拿到后一直持有到进程退出）
+_writer_lock = None
+
+
+def _is_writer(path):
+    """是否由本进程写快照：第一个拿到文件锁的进程负责写，其它进程不写"""
+    global _writer_lock
+    if _writer_lock is not None or fcntl is None:
+        return True
+    lock = open(path + '.lock', 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return False
+    _writer_lock = lock
+    return True
+
+
+def refresh(cache, path=None):
+    """本进程负责写快照、且数据集比快照新时重写快照。返回是否写了"""
+    path = SNAPSHOT_FILE if path is None else path
+    if not _is_writer(path):
+        return False
+    try:
+        header = read_header(path)
+        if header.dataset_id == storage.dataset_id() and header.version >= storage.current_version():
+            return False
+    except (OSError, SnapshotError):
+        pass
+    dump_cache(cache, path)
+    return True
+
+
+def start_snapshotter(cache, interval=None):
+    """启动后台快照线程（守护线程，每个进程一个，只有一个进程真正写）"""
+    interval = SNAPSHOT_INTERVAL if interval is None else interval
+    if interval <= 0:
+        return None
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                refresh(cache)
+            except Exception:
+                logger.exception('写快照失败')
+
+    thread = threading.Thread(target=run, name='dataset-snapshotter', daemon=True)
+    thread.start()
+    return thread
+
+
+# ---------- 旧JSON文件 ----------
+def to_legacy(tours, bookings):
+    """转回旧JSON文件的结构"""
+    return {
+        'tours': [{key: getattr(tour, key) for key in ('id', 'date', 'time', 'destination', 'vehicle_model',
+                                                       'max_seats', 'booked')}
+                  for tour, _ in tours],
+        'bookings': [b.to_dict() for b in bookings],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='数据集快照工具')
+    sub = parser.add_subparsers(dest='command', required=True)
+    export = sub.add_parser('export', help='快照 -> JSON（调试用）')
+    export.add_argument('source', nargs='?', default=SNAPSHOT_FILE)
+    export.add_argument('target')
+    dump_cmd = sub.add_parser('dump', help='数据库 -> 快照')
+    dump_cmd.add_argument('target', nargs='?', default=SNAPSHOT_FILE)
+    info = sub.add_parser('info', help='查看快照头部')
+    info.add_argument('source', nargs='?', default=SNAPSHOT_FILE)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        header, tours, bookings = read(args.source)
+        with open(args.target, 'w', encoding='utf-8') as f:
+            json.dump(to_legacy(tours, bookings), f, ensure_ascii=False, indent=2)
+        print(f'版本 {header.version}：{len(tours)} 个团期、{len(bookings)} 条预订 -> {args.target}')
+    elif args.command == 'dump':
+        storage.init_db()
+        version, size = dump(args.target)
+        print(f'版本 {version} -> {args.target}（{size} 字节）')
+    else:
+        header = read_header(args.source)
+        print(json.dumps({key: getattr(header, key) for key in Header.__slots__}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
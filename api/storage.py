@@ -0,0 +1,913 @@
+"""数据存储层：用 SQLite（WAL 模式）保存团期和预订记录
+
+每条路由只读写自己涉及的行，不再整文件解析/重写 JSON。
+读出来的团期和预订是 models.Tour / models.Booking 记录，journal 里仍存原来的字典结构。
+
+每次修改（预订、建团、删团、过期清理）都在同一事务里追加一条 journal 记录，
+journal 的序号就是数据集版本号，其它模块可以据此增量重放变化。
+提交只写 WAL（synchronous=NORMAL，fsync 合并到检查点），后台线程定期做检查点
+并裁剪旧的 journal 记录；崩溃后 SQLite 打开数据库时自动重放 WAL。
+"""
+import json
+import logging
+import math
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+from datetime import date, datetime, timedelta
+
+import codes
+import metrics
+from models import SEATS_MISSING, Booking, Tour, seat_array
+from seatmap import HELD, SeatMap, normalize_seats
+
+# 数据库文件默认放在Vercel的可写临时目录，可用环境变量覆盖
+DB_FILE = os.environ.get('BOOKING_DB_FILE', '/tmp/booking_data.db')
+# 旧版的JSON数据文件，首次启动时自动导入
+LEGACY_DATA_FILE = os.environ.get('BOOKING_LEGACY_FILE', '/tmp/booking_data.json')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tours (
+    id INTEGER PRIMARY KEY,
+    date TEXT,
+    time TEXT,
+    destination TEXT,
+    vehicle_model TEXT,
+    max_seats INTEGER NOT NULL,
+    booked INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0,
+    seat_map BLOB,
+    departs_at REAL
+);
+CREATE TABLE IF NOT EXISTS bookings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    code TEXT NOT NULL,
+    name TEXT,
+    phone TEXT,
+    seat_numbers TEXT,
+    tour_id INTEGER NOT NULL,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_bookings_tour ON bookings(tour_id);
+CREATE INDEX IF NOT EXISTS idx_bookings_code ON bookings(code);
+CREATE INDEX IF NOT EXISTS idx_tours_date ON tours(date);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS holds (
+    token TEXT PRIMARY KEY,
+    tour_id INTEGER NOT NULL,
+    seats TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    client TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_holds_expires ON holds(expires_at);
+CREATE INDEX IF NOT EXISTS idx_holds_tour ON holds(tour_id, expires_at);
+CREATE TABLE IF NOT EXISTS schedules (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    destination TEXT NOT NULL,
+    vehicle_model TEXT,
+    max_seats INTEGER NOT NULL,
+    time TEXT NOT NULL,
+    weekdays TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    end_date TEXT,
+    materialized_until TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    op TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+'''
+
+TOUR_COLUMNS = 'id, date, time, destination, vehicle_model, max_seats, booked, departs_at'
+BOOKING_COLUMNS = 'code, name, phone, seat_numbers, tour_id, created_at'
+SCHEDULE_COLUMNS = 'id, destination, vehicle_model, max_seats, time, weekdays, start_date, end_date, materialized_until'
+# meta 里记着已经分配到的最大团期ID
+TOUR_SEQ_KEY = 'tour_id_seq'
+
+# 后台压缩：多久做一次检查点、journal 至少保留多少条
+COMPACT_INTERVAL = float(os.environ.get('BOOKING_COMPACT_INTERVAL', '300'))
+JOURNAL_KEEP = int(os.environ.get('BOOKING_JOURNAL_KEEP', '10000'))
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_dataset_id = None
+# 进程内每个团期一把锁：同进程的线程在这里排队，避免在SQLite写锁上忙等退避
+_tour_locks = {}
+_tour_locks_guard = threading.Lock()
+
+
+class ImportRolledBack(Exception):
+    """这一批导入有出错的行（或只是试运行），事务已回滚；imported 是本来会写入的行数"""
+
+    def __init__(self, imported):
+        super().__init__('导入已回滚')
+        self.imported = imported
+
+
+class HoldLimitExceeded(Exception):
+    """座位保留超出了每个客户端或每个团期的上限"""
+
+
+class BookingConflict(Exception):
+    """预订冲突：座位已被别人订走或剩余座位不足
+
+    批量预订时 errors 为 {批次下标: 原因}，单条预订时为空。
+    """
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or {}
+
+
+def get_conn():
+    """获取当前线程的数据库连接（fork 之后的子进程会重新建立连接）"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        # isolation_level=None：自动提交，事务由 transaction() 显式控制
+        conn = sqlite3.connect(DB_FILE, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+@contextmanager
+def transaction():
+    """写事务：BEGIN IMMEDIATE 立即拿到写锁，出错时回滚"""
+    conn = get_conn()
+    conn.execute('BEGIN IMMEDIATE')
+    _local.hold_ends = []
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    else:
+        conn.execute('COMMIT')
+        # 保留的结束原因在提交后才计数，回滚的事务不算
+        for reason in _local.hold_ends:
+            metrics.hold_ends.inc(reason)
+
+
+def row_to_tour(row):
+    """把数据库行转换成团期记录"""
+    return Tour(row['id'], row['date'], row['time'], row['destination'], row['vehicle_model'],
+                row['max_seats'], row['booked'], row['departs_at'])
+
+
+def row_to_booking(row):
+    """把数据库行转换成预订记录（座位号统一成数组，并记下原来是列表还是单个数字）"""
+    if row['seat_numbers'] is None:
+        seats, form = (), SEATS_MISSING
+    else:
+        seats, form = seat_array(json.loads(row['seat_numbers']))
+    return Booking(row['code'], row['name'], row['phone'], row['tour_id'], row['created_at'], seats, form)
+
+
+def init_db():
+    """建表并补齐旧数据（每次启动都执行）；旧的JSON数据文件只在第一次导入"""
+    conn = get_conn()
+    conn.executescript(SCHEMA)
+    _migrate(conn)
+    with transaction() as conn:
+        _import_legacy_once(conn)
+    with transaction() as conn:
+        _build_missing_seat_maps(conn)
+        _fill_departures(conn)
+        # 数据库的唯一标识，快照文件靠它确认属于这个库
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('dataset_id', ?)", (uuid.uuid4().hex,))
+
+
+def _import_legacy_once(conn):
+    """旧JSON数据文件只导入一次（以 meta.legacy_imported 为准）"""
+    if conn.execute("SELECT 1 FROM meta WHERE key = 'legacy_imported'").fetchone():
+        return
+    if os.path.exists(LEGACY_DATA_FILE):
+        try:
+            with open(LEGACY_DATA_FILE, 'r', encoding='utf-8') as f:
+                legacy = json.load(f)
+        except ValueError:
+            # 旧文件损坏（例如写到一半崩溃）：不当作空数据导入，移到一边等人工恢复
+            corrupt_file = f'{LEGACY_DATA_FILE}.corrupt-{int(time.time())}'
+            os.replace(LEGACY_DATA_FILE, corrupt_file)
+            logger.error('旧数据文件无法解析，已移动到 %s，未导入', corrupt_file)
+            return
+        _import_legacy(conn, legacy)
+    conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_imported', '1')")
+
+
+def dataset_id():
+    """数据库的唯一标识（32位十六进制），同一个库不会变，读到后缓存在进程里"""
+    global _dataset_id
+    if _dataset_id is None:
+        row = get_conn().execute("SELECT value FROM meta WHERE key = 'dataset_id'").fetchone()
+        _dataset_id = row[0] if row else None
+    return _dataset_id
+
+
+def _append_journal(conn, op, payload):
+    """在当前事务里追加一条修改记录，O(1)"""
+    text = json.dumps(payload, ensure_ascii=False)
+    conn.execute('INSERT INTO journal (op, payload, created_at) VALUES (?, ?, ?)',
+                 (op, text, time.time()))
+    metrics.storage_bytes.inc('written', amount=len(text.encode()))
+
+
+def _append_journal_many(conn, op, payloads):
+    """批量导入时一次追加多条修改记录"""
+    now = time.time()
+    texts = [json.dumps(payload, ensure_ascii=False) for payload in payloads]
+    conn.executemany('INSERT INTO journal (op, payload, created_at) VALUES (?, ?, ?)',
+                     [(op, text, now) for text in texts])
+    metrics.storage_bytes.inc('written', amount=sum(len(text.encode()) for text in texts))
+
+
+@metrics.storage_timed('current_version')
+def current_version():
+    """数据集版本号：最后一条 journal 的序号（裁剪后也不会回退）"""
+    row = get_conn().execute("SELECT seq FROM sqlite_sequence WHERE name = 'journal'").fetchone()
+    return row[0] if row else 0
+
+
+@metrics.storage_timed('read_journal')
+def read_journal(after_seq, limit=1000):
+    """按顺序返回 seq > after_seq 的修改记录 [(seq, op, payload), ...]
+
+    如果 after_seq 之后的记录已被压缩裁剪，返回 None，调用方应整体重新加载。
+    """
+    conn = get_conn()
+    rows = conn.execute('SELECT seq, op, payload FROM journal WHERE seq > ? ORDER BY seq LIMIT ?',
+                        (after_seq, limit)).fetchall()
+    if rows and rows[0]['seq'] != after_seq + 1:
+        return None
+    if not rows and current_version() > after_seq:
+        return None
+    if rows:
+        metrics.storage_bytes.inc('read', amount=sum(len(r['payload'].encode()) for r in rows))
+    return [(r['seq'], r['op'], json.loads(r['payload'])) for r in rows]
+
+
+@metrics.storage_timed('compact')
+def compact(keep=None):
+    """压缩：裁剪旧的 journal 记录，并把 WAL 合并回主库文件"""
+    keep = JOURNAL_KEEP if keep is None else keep
+    with transaction() as conn:
+        conn.execute('DELETE FROM journal WHERE seq <= ?', (current_version() - keep,))
+    get_conn().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+
+def start_compactor(interval=None):
+    """启动后台压缩线程（守护线程，每个进程一个）"""
+    interval = COMPACT_INTERVAL if interval is None else interval
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                compact()
+            except sqlite3.Error:
+                logger.exception('后台压缩失败')
+
+    thread = threading.Thread(target=run, name='storage-compactor', daemon=True)
+    thread.start()
+    return thread
+
+
+def _migrate(conn):
+    """给旧版本建的表补上新增的列"""
+    tour_columns = {r['name'] for r in conn.execute('PRAGMA table_info(tours)')}
+    if 'version' not in tour_columns:
+        conn.execute('ALTER TABLE tours ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+    if 'seat_map' not in tour_columns:
+        conn.execute('ALTER TABLE tours ADD COLUMN seat_map BLOB')
+    if 'departs_at' not in tour_columns:
+        conn.execute('ALTER TABLE tours ADD COLUMN departs_at REAL')
+    # 旧库的 tours 没有 departs_at 列，这个索引不能放在 SCHEMA 里
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tours_departs_at ON tours(departs_at)')
+    hold_columns = {r['name'] for r in conn.execute('PRAGMA table_info(holds)')}
+    if 'client' not in hold_columns:
+        conn.execute('ALTER TABLE holds ADD COLUMN client TEXT')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_holds_client ON holds(client, expires_at)')
+
+
+def _fill_departures(conn):
+    """为还没有出发时间戳的团期解析一次日期和时间"""
+    rows = conn.execute('SELECT id, date, time FROM tours WHERE departs_at IS NULL').fetchall()
+    updates = [(departure_timestamp(r['date'], r['time']), r['id']) for r in rows]
+    conn.executemany('UPDATE tours SET departs_at = ? WHERE id = ?',
+                     [u for u in updates if u[0] is not None])
+
+
+def _build_missing_seat_maps(conn):
+    """为还没有座位占用表的团期按已有预订生成一份，并用它校正已预订人数"""
+    tours = conn.execute('SELECT id, max_seats FROM tours WHERE seat_map IS NULL').fetchall()
+    for tour in tours:
+        seat_map = SeatMap(tour['max_seats'])
+        for (seat_json,) in conn.execute(
+                'SELECT seat_numbers FROM bookings WHERE tour_id = ? AND seat_numbers IS NOT NULL',
+                (tour['id'],)):
+            for seat in _int_seats(json.loads(seat_json)):
+                if 1 <= seat <= seat_map.max_seats:
+                    seat_map.take([seat])
+        conn.execute('UPDATE tours SET seat_map = ?, booked = ? WHERE id = ?',
+                     (seat_map.to_bytes(), seat_map.booked, tour['id']))
+
+
+def _import_legacy(conn, legacy):
+    """把旧JSON文件里的团期和预订写入数据库"""
+    conn.executemany(
+        'INSERT OR REPLACE INTO tours (id, date, time, destination, vehicle_model, max_seats, booked) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+        [(t['id'], t.get('date'), t.get('time'), t.get('destination'),
+          t.get('vehicle_model') or '未指定', t.get('max_seats', 0), t.get('booked', 0))
+         for t in legacy.get('tours', [])]
+    )
+    conn.executemany(
+        f'INSERT INTO bookings ({BOOKING_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)',
+        [(b.get('code', ''), b.get('name'), b.get('phone'),
+          json.dumps(b['seat_numbers']) if 'seat_numbers' in b else None,
+          b.get('tour_id'), b.get('created_at'))
+         for b in legacy.get('bookings', [])]
+    )
+
+
+# ---------- 团期 ----------
+@metrics.storage_timed('get_tour')
+def get_tour(tour_id):
+    """按ID查找团期，不存在返回None"""
+    row = get_conn().execute(f'SELECT {TOUR_COLUMNS} FROM tours WHERE id = ?', (tour_id,)).fetchone()
+    return row_to_tour(row) if row else None
+
+
+@metrics.storage_timed('page_tours')
+def page_tours(after_id=0, limit=50, date=None):
+    """按ID做键集分页读取团期（id > after_id），可按出发日期过滤"""
+    sql = f'SELECT {TOUR_COLUMNS} FROM tours WHERE id > ?'
+    params = [after_id]
+    if date:
+        sql += ' AND date = ?'
+        params.append(date)
+    sql += ' ORDER BY id LIMIT ?'
+    params.append(limit)
+    return [row_to_tour(r) for r in get_conn().execute(sql, params)]
+
+
+def _allocate_tour_ids(conn, count):
+    """在调用方的写事务里分配 count 个连续的新团期ID，返回第一个
+
+    分配到哪了记在 meta 里，只增不减：最新的团期被删掉后它的ID也不会再分配出去，
+    旧的 /book/<id> 链接和按团期ID算的 ETag 不会指到另一个团期上。
+    旧库还没有这条记录时从当前最大ID接着分配。
+    """
+    row = conn.execute('SELECT value FROM meta WHERE key = ?', (TOUR_SEQ_KEY,)).fetchone()
+    last = max(int(row['value']) if row else 0,
+               conn.execute('SELECT COALESCE(MAX(id), 0) FROM tours').fetchone()[0])
+    conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (TOUR_SEQ_KEY, str(last + count)))
+    return last + 1
+
+
+@metrics.storage_timed('create_tour')
+def create_tour(tour):
+    """新建团期，返回新ID（由 _allocate_tour_ids 分配，删掉的ID不会重用）"""
+    departs_at = departure_timestamp(tour['date'], tour['time'])
+    with transaction() as conn:
+        tour_id = _allocate_tour_ids(conn, 1)
+        conn.execute(
+            'INSERT INTO tours (id, date, time, destination, vehicle_model, max_seats, booked, seat_map, departs_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)',
+            (tour_id, tour['date'], tour['time'], tour['destination'], tour['vehicle_model'],
+             tour['max_seats'], SeatMap(tour['max_seats']).to_bytes(), departs_at)
+        )
+        new_tour = dict(tour, id=tour_id, booked=0, departs_at=departs_at)
+        _append_journal(conn, 'create_tour', new_tour)
+        return tour_id
+
+
+@metrics.storage_timed('delete_tour')
+def delete_tour(tour_id):
+    """删除班次以及该班次的所有预订"""
+    with transaction() as conn:
+        conn.execute('DELETE FROM bookings WHERE tour_id = ?', (tour_id,))
+        conn.execute('DELETE FROM holds WHERE tour_id = ?', (tour_id,))
+        conn.execute('DELETE FROM tours WHERE id = ?', (tour_id,))
+        _append_journal(conn, 'delete_tour', {'tour_id': tour_id})
+
+
+@metrics.storage_timed('purge_tours')
+def purge_tours(tour_ids):
+    """过期清理：在一个事务里删除一批班次、它们的预订以及所有孤立的预订
+
+    返回实际删除的班次数；没有任何变化时不写 journal。
+    """
+    with transaction() as conn:
+        deleted = 0
+        for tour_id in tour_ids:
+            deleted += conn.execute('DELETE FROM tours WHERE id = ?', (tour_id,)).rowcount
+            conn.execute('DELETE FROM bookings WHERE tour_id = ?', (tour_id,))
+        orphans = conn.execute(
+            'DELETE FROM bookings WHERE tour_id NOT IN (SELECT id FROM tours)').rowcount
+        conn.execute('DELETE FROM holds WHERE tour_id NOT IN (SELECT id FROM tours)')
+        if deleted or orphans:
+            _append_journal(conn, 'purge', {'tour_ids': list(tour_ids)})
+        return deleted
+
+
+@metrics.storage_timed('load_all')
+def load_all():
+    """在同一个读快照里读出 (版本号, [(团期, 座位占用表)], [预订])"""
+    conn = get_conn()
+    conn.execute('BEGIN')
+    try:
+        version = current_version()
+        tours = [(row_to_tour(r), SeatMap(r['max_seats'], r['seat_map']))
+                 for r in conn.execute(f'SELECT {TOUR_COLUMNS}, seat_map FROM tours ORDER BY id')]
+        bookings = [row_to_booking(r)
+                    for r in conn.execute(f'SELECT {BOOKING_COLUMNS} FROM bookings ORDER BY id')]
+    finally:
+        conn.execute('COMMIT')
+    return version, tours, bookings
+
+
+# ---------- 预订 ----------
+@metrics.storage_timed('page_bookings')
+def page_bookings(after_id=0, limit=50, tour_id=None, date=None):
+    """按预订自增ID做键集分页读取，可按班次或出发日期过滤，返回 [(id, 预订)]"""
+    sql = f'SELECT id, {BOOKING_COLUMNS} FROM bookings WHERE id > ?'
+    params = [after_id]
+    if tour_id is not None:
+        sql += ' AND tour_id = ?'
+        params.append(tour_id)
+    if date:
+        sql += ' AND tour_id IN (SELECT id FROM tours WHERE date = ?)'
+        params.append(date)
+    sql += ' ORDER BY id LIMIT ?'
+    params.append(limit)
+    return [(r['id'], row_to_booking(r)) for r in get_conn().execute(sql, params)]
+
+
+@metrics.storage_timed('get_tour_bookings')
+def get_tour_bookings(tour_id):
+    """返回指定班次的所有预订（走 tour_id 索引）"""
+    rows = get_conn().execute(
+        f'SELECT {BOOKING_COLUMNS} FROM bookings WHERE tour_id = ? ORDER BY id', (tour_id,)
+    )
+    return [row_to_booking(r) for r in rows]
+
+
+def parse_departure(tour_date, tour_time):
+    """把团期的日期和时间解析成 datetime，格式不对时返回 None"""
+    try:
+        return datetime.strptime(f'{tour_date} {tour_time}', '%Y-%m-%d %H:%M')
+    except (TypeError, ValueError):
+        return None
+
+
+def departure_timestamp(tour_date, tour_time):
+    """出发时间的时间戳（本地时间），建团时算一次存进 tours.departs_at"""
+    departure = parse_departure(tour_date, tour_time)
+    return departure.timestamp() if departure else None
+
+
+def _seat_list(seats):
+    """把 seat_numbers（列表或单个数字）统一成列表"""
+    if isinstance(seats, list):
+        return seats
+    return [seats] if seats else []
+
+
+def _int_seats(seats):
+    """旧数据里的座位号可能是字符串，转成整数并跳过无法识别的值"""
+    result = []
+    for seat in _seat_list(seats):
+        try:
+            result.append(int(seat))
+        except (TypeError, ValueError):
+            continue
+    return result
+
+
+def tour_lock(tour_id):
+    """返回指定团期的进程内锁"""
+    with _tour_locks_guard:
+        lock = _tour_locks.get(tour_id)
+        if lock is None:
+            lock = _tour_locks[tour_id] = threading.Lock()
+        return lock
+
+
+def reserve_seats(booking, hold_token=None):
+    """原子地检查座位并保存预订
+
+    booking 是 models.Booking，座位号需已用 seatmap.normalize_seats 校验过。
+    整个"检查座位占用表 -> 写入预订 -> 更新占用表和已预订人数"在同一个
+    BEGIN IMMEDIATE 事务里完成，已预订人数始终等于占用表里的已占座位数。SQLite 的写锁跨线程、跨进程互斥，所以多个 gunicorn 进程同时
+    抢同一个座位时只有一个能成功，其余的立即得到 BookingConflict。
+    团期的 version 在每次座位变化时加一，并用它做比较交换，防止覆盖别人的写入。
+    同一进程内的线程先在团期锁上排队，只有跨进程竞争才会用到SQLite的忙等。
+    带 hold_token 时在同一事务里把这份座位保留转成预订，返回是否真的用上了保留。
+    """
+    return reserve_batch([booking], hold_token)
+
+
+@metrics.storage_timed('reserve_batch')
+def reserve_batch(bookings, hold_token=None):
+    """在一个事务里原子地保存一批预订（可跨多个团期），要么全部成功要么全部不写
+
+    先按团期ID顺序拿齐所有团期锁（避免两个批次互相等待），每个团期只读一次
+    座位占用表；批次内后面的预订能看到前面预订占掉的座位。任何一条冲突时抛出
+    BookingConflict，其 errors 为 {批次下标: 原因}，整个事务回滚。
+    每个团期只做一次比较交换更新，每条预订仍写一条 book journal。
+    code 为空的预订在写入前分配预订码（codes.allocate）。
+    已过期的座位保留在这里顺带释放；hold_token 对应的保留先释放，再按普通预订检查，
+    保留已过期或不存在时就是一次普通预订。返回是否用上了 hold_token 的保留。
+    """
+    tour_ids = sorted({b.tour_id for b in bookings})
+    with ExitStack() as stack:
+        for tour_id in tour_ids:
+            stack.enter_context(tour_lock(tour_id))
+        conn = stack.enter_context(transaction())
+
+        now = time.time()
+        tours = {}
+        for tour_id in tour_ids:
+            row = conn.execute('SELECT max_seats, version, seat_map FROM tours WHERE id = ?',
+                               (tour_id,)).fetchone()
+            seat_map = None
+            if row is not None:
+                seat_map = SeatMap(row['max_seats'], row['seat_map'])
+                _expire_tour_holds(conn, tour_id, seat_map, now)
+            tours[tour_id] = (row, seat_map)
+        converted = False
+        if hold_token is not None:
+            hold = conn.execute('SELECT tour_id FROM holds WHERE token = ?', (hold_token,)).fetchone()
+            # 只认本批次涉及（已加锁）的团期上的保留
+            if hold is not None and tours.get(hold['tour_id'], (None, None))[1] is not None:
+                _drop_hold(conn, hold_token, tours[hold['tour_id']][1], 'converted')
+                converted = True
+
+        errors = {}
+        for i, booking in enumerate(bookings):
+            row, seat_map = tours[booking.tour_id]
+            if row is None:
+                errors[i] = '班次不存在'
+                continue
+            seats = booking.seats
+            taken = [seat for seat in seats if not seat_map.is_free(seat)]
+            if taken:
+                errors[i] = _taken_message(seat_map, taken[0])
+                continue
+            available = seat_map.free_count()
+            if len(seats) > available:
+                errors[i] = f'剩余车位不足，仅剩{available}个'
+                continue
+            seat_map.take(seats)
+        if errors:
+            raise BookingConflict(errors[min(errors)], errors)
+
+        for tour_id, (row, seat_map) in tours.items():
+            _save_seat_map(conn, tour_id, seat_map, row['version'])
+        # 还没有预订码的在这里分配（与写入在同一事务里，保证不重复）
+        unassigned = [b for b in bookings if not b.code]
+        for booking, code in zip(unassigned, codes.allocate(conn, len(unassigned))):
+            booking.code = code
+        conn.executemany(
+            f'INSERT INTO bookings ({BOOKING_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)',
+            [(b.code, b.name, b.phone, json.dumps(b.seat_numbers), b.tour_id, b.created_at)
+             for b in bookings]
+        )
+        for booking in bookings:
+            _append_journal(conn, 'book', booking.to_dict())
+        return converted
+
+
+def _taken_message(seat_map, seat):
+    if seat_map.states[seat - 1] == HELD:
+        return f'{seat}号座位已被别人选中，请选择其他座位'
+    return f'{seat}号座位已被预订'
+
+
+def _save_seat_map(conn, tour_id, seat_map, version):
+    """按 version 做比较交换写回座位占用表和已预订人数"""
+    cur = conn.execute(
+        'UPDATE tours SET seat_map = ?, booked = ?, version = version + 1 WHERE id = ? AND version = ?',
+        (seat_map.to_bytes(), seat_map.booked, tour_id, version)
+    )
+    if cur.rowcount != 1:
+        raise BookingConflict('班次已被修改，请刷新后重试')
+
+
+# ---------- 周期班次 ----------
+def create_schedule(schedule):
+    """新建周期班次，返回ID（团期由 materialize_schedules 按需生成）"""
+    start = date.fromisoformat(schedule['start_date'])
+    with transaction() as conn:
+        cur = conn.execute(
+            'INSERT INTO schedules (destination, vehicle_model, max_seats, time, weekdays, start_date, end_date, '
+            'materialized_until) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (schedule['destination'], schedule['vehicle_model'], schedule['max_seats'], schedule['time'],
+             schedule['weekdays'], schedule['start_date'], schedule.get('end_date'),
+             (start - timedelta(days=1)).isoformat())
+        )
+        return cur.lastrowid
+
+
+def list_schedules():
+    """按ID顺序返回所有周期班次（字典）"""
+    return [dict(r) for r in get_conn().execute(f'SELECT {SCHEDULE_COLUMNS} FROM schedules ORDER BY id')]
+
+
+def delete_schedule(schedule_id):
+    """删除周期班次（已经生成的团期保留），返回是否存在"""
+    with transaction() as conn:
+        return conn.execute('DELETE FROM schedules WHERE id = ?', (schedule_id,)).rowcount > 0
+
+
+@metrics.storage_timed('materialize_schedules')
+def materialize_schedules(first_date, last_date):
+    """把周期班次在 [first_date, last_date] 里还没生成过的日期生成团期，返回新建的团期数
+
+    每个周期班次记着已经生成到哪天（materialized_until），只补这之后的日期，
+    生成过的日期即使团期后来被删掉也不会再生成；早于 first_date 的日期直接跳过。
+    整个过程在一个写事务里，多个进程同时调用也不会重复生成。
+    """
+    with transaction() as conn:
+        schedules = conn.execute(
+            f'SELECT {SCHEDULE_COLUMNS} FROM schedules WHERE materialized_until < ? '
+            'AND (end_date IS NULL OR materialized_until < end_date)', (last_date,)
+        ).fetchall()
+        if not schedules:
+            return 0
+        occurrences = []
+        for schedule in schedules:
+            until = min(last_date, schedule['end_date'] or last_date)
+            day = max(date.fromisoformat(schedule['materialized_until']) + timedelta(days=1),
+                      date.fromisoformat(schedule['start_date']), date.fromisoformat(first_date))
+            end = date.fromisoformat(until)
+            while day <= end:
+                if str(day.isoweekday()) in schedule['weekdays']:
+                    occurrences.append((day.isoformat(), schedule['time'], schedule['id'], schedule))
+                day += timedelta(days=1)
+            conn.execute('UPDATE schedules SET materialized_until = ? WHERE id = ?', (until, schedule['id']))
+        # 新团期按出发时间顺序分配ID
+        occurrences.sort(key=lambda o: o[:3])
+        if not occurrences:
+            return 0
+        next_id = _allocate_tour_ids(conn, len(occurrences))
+        rows = []
+        payloads = []
+        for tour_date, tour_time, _, schedule in occurrences:
+            departs_at = departure_timestamp(tour_date, tour_time)
+            tour = {'date': tour_date, 'time': tour_time, 'destination': schedule['destination'],
+                    'vehicle_model': schedule['vehicle_model'], 'max_seats': schedule['max_seats']}
+            rows.append((next_id, tour_date, tour_time, tour['destination'], tour['vehicle_model'],
+                         tour['max_seats'], SeatMap(tour['max_seats']).to_bytes(), departs_at))
+            payloads.append(dict(tour, id=next_id, booked=0, departs_at=departs_at))
+            next_id += 1
+        conn.executemany('INSERT INTO tours (id, date, time, destination, vehicle_model, max_seats, booked, '
+                         'seat_map, departs_at) VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)', rows)
+        _append_journal_many(conn, 'create_tour', payloads)
+        return len(rows)
+
+
+# ---------- 批量导入 ----------
+@metrics.storage_timed('import_tours')
+def import_tours(tours, dry_run=False):
+    """在一个事务里建一批团期，返回 (第一个新ID, 新建数量)
+
+    tours 是已校验的团期字典（date/time/destination/vehicle_model/max_seats），
+    新ID由 _allocate_tour_ids 连续分配。dry_run 时抛出 ImportRolledBack，什么都不写。
+    """
+    with transaction() as conn:
+        first_id = _allocate_tour_ids(conn, len(tours))
+        rows = []
+        payloads = []
+        for tour_id, tour in enumerate(tours, first_id):
+            departs_at = departure_timestamp(tour['date'], tour['time'])
+            rows.append((tour_id, tour['date'], tour['time'], tour['destination'], tour['vehicle_model'],
+                         tour['max_seats'], SeatMap(tour['max_seats']).to_bytes(), departs_at))
+            payloads.append(dict(tour, id=tour_id, booked=0, departs_at=departs_at))
+        conn.executemany('INSERT INTO tours (id, date, time, destination, vehicle_model, max_seats, booked, '
+                         'seat_map, departs_at) VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)', rows)
+        _append_journal_many(conn, 'create_tour', payloads)
+        if dry_run:
+            raise ImportRolledBack(len(rows))
+        return first_id, len(rows)
+
+
+@metrics.storage_timed('import_bookings')
+def import_bookings(items, errors, dry_run=False, claimed=None):
+    """在一个事务里保存一批预订，返回保存的条数
+
+    items 是 (行号, 字段字典) 列表，字段为 tour_id/name/phone/seat_numbers/code/created_at。
+    按团期检查座位（和 reserve_batch 一样，后面的行能看到前面的行占掉的座位），
+    给出的预订码要求不重复，没给的用 codes.allocate 分配。出错的行记进 errors；
+    errors 非空（包括调用方已经记进去的解析错误）或 dry_run 时抛出 ImportRolledBack，这一批什么都不写。
+    claimed（{'seats': {团期ID: [座位]}, 'codes': set()}）是试运行时前面各批本会占掉的座位和预订码，
+    这一批校验通过时也记进去，整份文件的试运行结果才和真正导入一致。
+    """
+    with transaction() as conn:
+        now = time.time()
+        tours = {}
+        seen_codes = set(claimed['codes']) if claimed else set()
+        bookings = []
+        for row_no, item in items:
+            tour_id = item['tour_id']
+            if tour_id not in tours:
+                row = conn.execute('SELECT max_seats, version, seat_map FROM tours WHERE id = ?',
+                                   (tour_id,)).fetchone()
+                seat_map = None
+                if row is not None:
+                    seat_map = SeatMap(row['max_seats'], row['seat_map'])
+                    _expire_tour_holds(conn, tour_id, seat_map, now)
+                    if claimed and tour_id in claimed['seats']:
+                        seat_map.take(claimed['seats'][tour_id])
+                tours[tour_id] = (row, seat_map)
+            row, seat_map = tours[tour_id]
+            if row is None:
+                errors[row_no] = '班次不存在'
+                continue
+            try:
+                seats = normalize_seats(item['seat_numbers'], row['max_seats'])
+            except ValueError as e:
+                errors[row_no] = str(e)
+                continue
+            taken = [seat for seat in seats if not seat_map.is_free(seat)]
+            if taken:
+                errors[row_no] = _taken_message(seat_map, taken[0])
+                continue
+            code = item['code']
+            if code and (code in seen_codes or conn.execute('SELECT 1 FROM bookings WHERE code = ?',
+                                                            (code,)).fetchone()):
+                errors[row_no] = f'预订码 {code} 已存在'
+                continue
+            seat_map.take(seats)
+            if code:
+                seen_codes.add(code)
+            bookings.append(Booking(code, item['name'], item['phone'], tour_id, item['created_at'], seats))
+        if errors:
+            raise ImportRolledBack(len(bookings))
+        if dry_run:
+            if claimed is not None:
+                claimed['codes'] = seen_codes
+                for b in bookings:
+                    claimed['seats'].setdefault(b.tour_id, []).extend(b.seats)
+            raise ImportRolledBack(len(bookings))
+        unassigned = [b for b in bookings if not b.code]
+        for booking, code in zip(unassigned, codes.allocate(conn, len(unassigned))):
+            booking.code = code
+        conn.executemany(
+            f'INSERT INTO bookings ({BOOKING_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)',
+            [(b.code, b.name, b.phone, json.dumps(b.seat_numbers), b.tour_id, b.created_at)
+             for b in bookings]
+        )
+        _append_journal_many(conn, 'book', [b.to_dict() for b in bookings])
+        for tour_id, (row, seat_map) in tours.items():
+            if row is not None:
+                _save_seat_map(conn, tour_id, seat_map, row['version'])
+        return len(bookings)
+
+
+# ---------- 座位保留 ----------
+@metrics.storage_timed('hold_seats')
+def hold_seats(tour_id, seats, expires_at, token=None, client=None, limits=None):
+    """临时保留一组座位到 expires_at（时间戳），返回新的保留凭证
+
+    传入已有的 token 时在同一事务里替换原来的保留（先释放旧座位再保留新座位），
+    seats 为空时只取消旧的保留并返回 None。座位已被占用时抛出 BookingConflict。
+    seats 需已用 seatmap.normalize_seats 校验过。
+    limits 为 (每个客户端最多几份保留, 每个客户端最多保留几个座位, 每个团期最多保留几成座位)，
+    按 client（客户端地址）统计未过期的保留，超出时抛出 HoldLimitExceeded，原来的保留不变。
+    """
+    seats = _seat_list(seats)
+    with tour_lock(tour_id), transaction() as conn:
+        row = conn.execute('SELECT max_seats, version, seat_map FROM tours WHERE id = ?',
+                           (tour_id,)).fetchone()
+        if row is None:
+            raise BookingConflict('班次不存在')
+        seat_map = SeatMap(row['max_seats'], row['seat_map'])
+        _expire_tour_holds(conn, tour_id, seat_map, time.time())
+        if token is not None:
+            hold = conn.execute('SELECT tour_id FROM holds WHERE token = ?', (token,)).fetchone()
+            if hold is not None and hold['tour_id'] == tour_id:
+                _drop_hold(conn, token, seat_map, 'replaced')
+
+        for seat in seats:
+            if not seat_map.is_free(seat):
+                raise BookingConflict(_taken_message(seat_map, seat))
+        if seats and limits is not None:
+            _check_hold_limits(conn, seat_map, len(seats), client, limits)
+        new_token = None
+        if seats:
+            new_token = secrets.token_urlsafe(16)
+            seat_map.hold(seats)
+            conn.execute('INSERT INTO holds (token, tour_id, seats, expires_at, created_at, client) '
+                         'VALUES (?, ?, ?, ?, ?, ?)',
+                         (new_token, tour_id, json.dumps(seats), expires_at, time.time(), client))
+            _append_journal(conn, 'hold', {'token': new_token, 'tour_id': tour_id,
+                                           'seats': seats, 'expires_at': expires_at})
+        _save_seat_map(conn, tour_id, seat_map, row['version'])
+        return new_token
+
+
+def _check_hold_limits(conn, seat_map, count, client, limits):
+    """新保留 count 个座位前检查上限（被替换的旧保留此时已经释放，不计在内）"""
+    max_holds, max_seats, tour_share = limits
+    if seat_map.held + count > max(1, math.ceil(seat_map.max_seats * tour_share)):
+        raise HoldLimitExceeded('该班次被临时保留的座位太多，请直接提交预订')
+    if client is None:
+        return
+    holds, held = conn.execute(
+        'SELECT COUNT(*), COALESCE(SUM(json_array_length(seats)), 0) FROM holds '
+        'WHERE client = ? AND expires_at > ?', (client, time.time())).fetchone()
+    if holds + 1 > max_holds or held + count > max_seats:
+        raise HoldLimitExceeded('同时保留的座位太多，请先提交或取消已选的座位')
+
+
+@metrics.storage_timed('release_hold')
+def release_hold(token, reason='cancelled'):
+    """取消一份座位保留，返回释放的座位；保留不存在（已过期或已转成预订）时返回 None"""
+    hold = get_conn().execute('SELECT tour_id FROM holds WHERE token = ?', (token,)).fetchone()
+    if hold is None:
+        return None
+    tour_id = hold['tour_id']
+    with tour_lock(tour_id), transaction() as conn:
+        row = conn.execute('SELECT max_seats, version, seat_map FROM tours WHERE id = ?',
+                           (tour_id,)).fetchone()
+        if row is None:
+            conn.execute('DELETE FROM holds WHERE token = ?', (token,))
+            return None
+        seat_map = SeatMap(row['max_seats'], row['seat_map'])
+        seats = _drop_hold(conn, token, seat_map, reason)
+        if seats is not None:
+            _save_seat_map(conn, tour_id, seat_map, row['version'])
+        return seats
+
+
+@metrics.storage_timed('expire_holds')
+def expire_holds(now=None, limit=500):
+    """释放到期的座位保留（按 expires_at 索引取，不扫全表），返回释放的份数"""
+    now = time.time() if now is None else now
+    rows = get_conn().execute('SELECT DISTINCT tour_id FROM holds WHERE expires_at <= ? LIMIT ?',
+                              (now, limit)).fetchall()
+    expired = 0
+    for r in rows:
+        tour_id = r['tour_id']
+        with tour_lock(tour_id), transaction() as conn:
+            row = conn.execute('SELECT max_seats, version, seat_map FROM tours WHERE id = ?',
+                               (tour_id,)).fetchone()
+            if row is None:
+                count = conn.execute('DELETE FROM holds WHERE tour_id = ?', (tour_id,)).rowcount
+                _local.hold_ends.extend(['expired'] * count)
+                expired += count
+                continue
+            seat_map = SeatMap(row['max_seats'], row['seat_map'])
+            count = _expire_tour_holds(conn, tour_id, seat_map, now)
+            if count:
+                _save_seat_map(conn, tour_id, seat_map, row['version'])
+            expired += count
+    return expired
+
+
+@metrics.storage_timed('count_holds')
+def count_holds():
+    """当前还在表里的座位保留份数（可能包含尚未清理的过期保留）"""
+    return get_conn().execute('SELECT COUNT(*) FROM holds').fetchone()[0]
+
+
+def _expire_tour_holds(conn, tour_id, seat_map, now):
+    """在当前事务里释放一个团期已到期的保留（只改 seat_map，由调用方写回），返回份数"""
+    tokens = [r['token'] for r in conn.execute(
+        'SELECT token FROM holds WHERE tour_id = ? AND expires_at <= ?', (tour_id, now))]
+    for token in tokens:
+        _drop_hold(conn, token, seat_map, 'expired')
+    return len(tokens)
+
+
+def _drop_hold(conn, token, seat_map, reason):
+    """删除一份保留并在 seat_map 上释放它的座位，返回座位列表"""
+    hold = conn.execute('SELECT tour_id, seats FROM holds WHERE token = ?', (token,)).fetchone()
+    if hold is None:
+        return None
+    # 保留的座位别人不能再订，所以仍处于保留状态的一定是这份保留自己的座位
+    seats = [seat for seat in json.loads(hold['seats'])
+             if seat <= seat_map.max_seats and seat_map.states[seat - 1] == HELD]
+    seat_map.release(seats)
+    conn.execute('DELETE FROM holds WHERE token = ?', (token,))
+    _append_journal(conn, 'unhold', {'token': token, 'tour_id': hold['tour_id'],
+                                     'seats': seats, 'reason': reason})
+    # 所有结束保留的路径（转成预订、取消、替换、各处顺带的过期释放）都经过这里，只在这里计数
+    _local.hold_ends.append(reason)
+    return seats
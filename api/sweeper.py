@@ -0,0 +1,67 @@
+"""过期班次清理：发车超过一周的班次连同它们的预订一起删除
+
+不再在首页请求里清理。可以两种方式运行：
+- 进程内后台线程：start_sweeper()，每 BOOKING_SWEEP_INTERVAL 秒清理一次，
+  顺带生成周期班次在滚动窗口内的团期（schedules.ensure_materialized）
+- 定时任务（cron）：python api/sweeper.py
+"""
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+import schedules
+import storage
+from cache import dataset
+
+# 发车后保留多久（超过一周，即 timedelta.days > 7 的班次会被清理）
+KEEP_AFTER_DEPARTURE = timedelta(days=8)
+SWEEP_INTERVAL = float(os.environ.get('BOOKING_SWEEP_INTERVAL', '600'))
+
+logger = logging.getLogger(__name__)
+
+
+def expiry_cutoff(now=None):
+    """出发时间戳不晚于这个值的班次算过期"""
+    now = time.time() if now is None else now
+    return now - KEEP_AFTER_DEPARTURE.total_seconds()
+
+
+def expired_tour_ids(now=None):
+    """在按出发时间排序的索引上二分，返回所有应清理的班次ID"""
+    return dataset.refresh().departed_before(expiry_cutoff(now))
+
+
+def sweep(now=None):
+    """清理一次，返回删除的班次数"""
+    tour_ids = expired_tour_ids(now)
+    if not tour_ids:
+        return 0
+    deleted = storage.purge_tours(tour_ids)
+    logger.info('已清理 %d 个过期班次', deleted)
+    return deleted
+
+
+def start_sweeper(interval=None):
+    """启动后台清理线程（守护线程，每个进程一个），同时负责生成周期班次的团期"""
+    interval = SWEEP_INTERVAL if interval is None else interval
+
+    def run():
+        while True:
+            schedules.ensure_materialized()
+            try:
+                sweep()
+            except Exception:
+                logger.exception('过期班次清理失败')
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name='expiry-sweeper', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    storage.init_db()
+    print(f'已清理 {sweep()} 个过期班次')
@@ -0,0 +1,277 @@
+"""同步（WSGI 线程池）和异步（ASGI）两种服务方式在大量并发连接下的对比
+
+两种方式用同样大小的线程池（--threads），都通过真实的 TCP 连接压测：
+- sync：werkzeug 的 WSGI 服务器，每条连接交给固定大小线程池里的一个线程处理
+  （和 gunicorn 线程 worker 一样，保持连接期间一直占着这个线程，包括 SSE 长连接）
+- asgi：api/asgi.py，由 uvicorn 提供服务
+
+每一轮先打开 --sse 条座位推送长连接，再用 N 条保持连接的客户端连接循环请求 --duration 秒：
+
+    python bench/bench_asgi.py --size 1k --connections 10,100,1000
+    python bench/bench_asgi.py --connections 200 --sse 500 --out bench/results/asgi.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from bench_routes import SIZES, git_revision, make_requests, percentile, seed
+from stress_book import load_app
+
+MODES = ['sync', 'asgi']
+ROUTES = ['home', 'book_page', 'api_book', 'search']
+HOST = '127.0.0.1'
+
+
+def raise_file_limit():
+    """上千条连接需要的文件描述符"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard if hard != resource.RLIM_INFINITY else 65536, hard))
+        except (ValueError, OSError):
+            pass
+
+
+# ---------- 被压测的服务器（子进程） ----------
+def serve(mode, db_file, port, threads):
+    raise_file_limit()
+    os.environ['BOOKING_ASGI_THREADS'] = str(threads)
+    index = load_app(db_file)
+    index.dataset.refresh()
+    if mode == 'sync':
+        from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+        class QuietHandler(WSGIRequestHandler):
+            def log(self, type, message, *args):
+                pass
+
+        class PooledWSGIServer(BaseWSGIServer):
+            """连接交给固定大小线程池处理的 WSGI 服务器"""
+            multithread = True
+            request_queue_size = 2048
+
+            def __init__(self, app):
+                super().__init__(HOST, port, app, handler=QuietHandler)
+                self.pool = ThreadPoolExecutor(threads)
+
+            def process_request(self, request, client_address):
+                self.pool.submit(self.process_in_pool, request, client_address)
+
+            def process_in_pool(self, request, client_address):
+                try:
+                    self.finish_request(request, client_address)
+                except Exception:
+                    self.handle_error(request, client_address)
+                finally:
+                    self.shutdown_request(request)
+
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        PooledWSGIServer(index.app).serve_forever()
+        return
+    import asgi
+    import uvicorn
+    uvicorn.run(asgi.app, host=HOST, port=port, log_level='warning', backlog=2048)
+
+
+def start_server(mode, db_file, threads):
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        port = s.getsockname()[1]
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', mode, '--db', db_file,
+                             '--port', str(port), '--threads', str(threads)])
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        try:
+            socket.create_connection((HOST, port), timeout=1).close()
+            return proc, port
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    sys.exit(f'{mode} 服务器没有启动')
+
+
+# ---------- 客户端 ----------
+async def read_response(reader):
+    """读一个完整响应，返回 (状态码, 能否继续复用连接)"""
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head[:-4].decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ')[1])
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip().lower()
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    elif status not in (204, 304):
+        await reader.read()
+        return status, False
+    return status, headers.get('connection') != 'close'
+
+
+def encode_request(method, url, body, close):
+    data = json.dumps(body).encode('utf-8') if body is not None else b''
+    lines = [f'{method} {quote(url, safe="/?=&")} HTTP/1.1', f'Host: {HOST}', f'Content-Length: {len(data)}']
+    if body is not None:
+        lines.append('Content-Type: application/json')
+    if close:
+        lines.append('Connection: close')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + data
+
+
+async def client(port, make_request, deadline, close, result):
+    """一条连接：在截止时间前不停发请求；一个响应都没等到的连接算“饿死”"""
+    writer = None
+    done = 0
+    try:
+        while time.perf_counter() < deadline:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(asyncio.open_connection(HOST, port),
+                                                        deadline - time.perf_counter())
+            started = time.perf_counter()
+            writer.write(encode_request(*make_request(), close))
+            status, keep_alive = await asyncio.wait_for(read_response(reader), deadline - started)
+            result['latencies'].append(time.perf_counter() - started)
+            done += 1
+            # 座位冲突（409）是预期结果，不算错误
+            if status >= 400 and status != 409:
+                result['errors'] += 1
+            if not keep_alive:
+                writer.close()
+                writer = None
+    except (asyncio.TimeoutError, ValueError):
+        # 截止时还没回来的请求不计入；整轮都没被服务过的连接单独统计
+        result['starved'] += 0 if done else 1
+    except (OSError, asyncio.IncompleteReadError):
+        result['errors'] += 1
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def open_stream(port, tour_id, opened):
+    """打开一条座位推送长连接；收到响应头就算建立成功，之后一直挂着"""
+    reader, writer = await asyncio.open_connection(HOST, port)
+    writer.write(encode_request('GET', f'/api/tours/{tour_id}/events', None, False))
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 5)
+        if b' 200 ' in head.split(b'\r\n', 1)[0]:
+            opened.append(writer)
+            return
+    except (asyncio.TimeoutError, OSError, asyncio.IncompleteReadError):
+        pass
+    opened.append(None)
+    writer.close()
+
+
+async def run_load(port, connections, duration, close, sse, tour_ids, route, seed_value):
+    rng = random.Random(seed_value)
+    make_request = make_requests(tour_ids, rng)[route]
+    opened = []
+    streams = [asyncio.ensure_future(open_stream(port, rng.choice(tour_ids), opened)) for _ in range(sse)]
+    await asyncio.gather(*streams, return_exceptions=True)
+    result = {'latencies': [], 'errors': 0, 'starved': 0}
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*[client(port, make_request, deadline, close, result) for _ in range(connections)])
+    seconds = time.perf_counter() - started
+    for writer in opened:
+        if writer is not None:
+            writer.close()
+    latencies = sorted(result['latencies'])
+    return {
+        'connections': connections,
+        'requests': len(latencies),
+        'errors': result['errors'],
+        'starved_connections': result['starved'],
+        'sse_streams': sum(1 for w in opened if w is not None),
+        'throughput_rps': round(len(latencies) / seconds, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='WSGI/ASGI 并发连接基准测试')
+    parser.add_argument('--size', choices=sorted(SIZES), default='1k', help='预订条数')
+    parser.add_argument('--route', choices=ROUTES, default='book_page')
+    parser.add_argument('--connections', default='10,100,1000', help='逗号分隔的并发连接数')
+    parser.add_argument('--duration', type=float, default=10, help='每一轮的秒数')
+    parser.add_argument('--sse', type=int, default=0, help='同时挂着的座位推送长连接数')
+    parser.add_argument('--threads', type=int, default=32, help='两种服务器的工作线程数')
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--close', action='store_true', help='每个请求一条新连接（不保持连接）')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', help='结果 JSON 文件')
+    parser.add_argument('--serve', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    # 基准测试期间不需要后台压缩和过期清理
+    os.environ.setdefault('BOOKING_COMPACT_INTERVAL', '86400')
+    os.environ.setdefault('BOOKING_SWEEP_INTERVAL', '86400')
+    # 座位推送默认关闭，这里要压测长连接，两种服务器都打开
+    os.environ.setdefault('BOOKING_SSE', '1')
+    if args.serve:
+        serve(args.serve, args.db, args.port, args.threads)
+        return
+    raise_file_limit()
+
+    db_file = os.path.join(tempfile.mkdtemp(prefix='bench_asgi_'), 'booking.db')
+    os.environ['BOOKING_DB_FILE'] = db_file
+    os.environ.setdefault('BOOKING_LEGACY_FILE', db_file + '.legacy.json')
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+    import storage
+    storage.init_db()
+    tour_ids = seed(storage, SIZES[args.size], random.Random(args.seed))
+
+    results = {}
+    for mode in [m for m in args.modes.split(',') if m]:
+        proc, port = start_server(mode, db_file, args.threads)
+        try:
+            results[mode] = [asyncio.run(run_load(port, int(n), args.duration, args.close, args.sse, tour_ids,
+                                                  args.route, args.seed))
+                             for n in args.connections.split(',') if n]
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'size': args.size,
+        'route': args.route,
+        'threads': args.threads,
+        'duration': args.duration,
+        'sse': args.sse,
+        'keep_alive': not args.close,
+        'results': results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+"""热点路由基准测试：生成合成数据集，测量各路由的吞吐和 p50/p95/p99 延迟
+
+用 Flask 的 test_client 直接调用应用（不经过网络），结果写成 JSON，方便不同版本之间对比：
+
+    python bench/bench_routes.py --size 100k --out bench/results/100k.json
+    python bench/bench_routes.py --size 1m --processes 4
+    python bench/bench_routes.py --size 100k --compare bench/results/100k.json
+
+--compare 时任何路由的 p95 比基线慢超过 --threshold（默认 20%）就以状态码 1 退出。
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from stress_book import load_app
+
+SIZES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+ROUTES = ['home', 'book_page', 'api_book', 'search', 'lookup', 'admin']
+# 每个团期的座位数和预先订出的座位数（留出空位给 POST /api/book）
+SEATS_PER_TOUR = 40
+BOOKED_PER_TOUR = 30
+
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗'
+GIVEN = '伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英'
+DESTINATIONS = ['黄山', '西湖', '千岛湖', '乌镇', '普陀山', '三清山', '婺源', '周庄']
+CODE_ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def booking_code(i):
+    """按序号生成不重复的6位预订码"""
+    chars = []
+    for _ in range(6):
+        i, r = divmod(i, 36)
+        chars.append(CODE_ALPHABET[r])
+    return 'BK' + ''.join(reversed(chars))
+
+
+def seed(storage, bookings, rng):
+    """直接写库生成 bookings 条预订（每条一个座位），返回团期ID列表"""
+    from seatmap import SeatMap
+
+    tour_count = (bookings + BOOKED_PER_TOUR - 1) // BOOKED_PER_TOUR
+    tour_rows = []
+    booking_rows = []
+    n = 0
+    for tour_id in range(1, tour_count + 1):
+        day = 1 + tour_id % 365
+        date = time.strftime('%Y-%m-%d', time.gmtime(4102444800 + day * 86400))  # 2100年起
+        tour_time = f'{6 + tour_id % 12:02d}:00'
+        seat_map = SeatMap(SEATS_PER_TOUR)
+        seats = rng.sample(range(1, SEATS_PER_TOUR + 1), min(BOOKED_PER_TOUR, bookings - n))
+        seat_map.take(seats)
+        for seat in seats:
+            name = rng.choice(SURNAMES) + rng.choice(GIVEN) + rng.choice(GIVEN)
+            phone = f'1{rng.randint(3, 9)}{rng.randint(0, 999999999):09d}'
+            booking_rows.append((booking_code(n), name, phone, json.dumps([seat]), tour_id,
+                                 '2024-01-01 08:00:00'))
+            n += 1
+        tour_rows.append((tour_id, date, tour_time, rng.choice(DESTINATIONS), '大巴', SEATS_PER_TOUR,
+                          seat_map.booked, seat_map.to_bytes(),
+                          storage.departure_timestamp(date, tour_time)))
+    with storage.transaction() as conn:
+        conn.executemany('INSERT INTO tours (id, date, time, destination, vehicle_model, max_seats, booked, '
+                         'seat_map, departs_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', tour_rows)
+        conn.executemany(f'INSERT INTO bookings ({storage.BOOKING_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)',
+                         booking_rows)
+    return [row[0] for row in tour_rows]
+
+
+def make_requests(tour_ids, rng):
+    """每个路由一次请求的生成函数：返回 (方法, URL, JSON 请求体)"""
+    def home():
+        return 'GET', '/', None
+
+    def book_page():
+        return 'GET', f'/book/{rng.choice(tour_ids)}', None
+
+    def api_book():
+        return 'POST', '/api/book', {
+            'tour_id': rng.choice(tour_ids), 'name': '压测', 'phone': '13800000000',
+            'seat_numbers': [rng.randint(1, SEATS_PER_TOUR)],
+        }
+
+    def search():
+        query = rng.choice([
+            f'13{rng.randint(0, 99):02d}',        # 手机号前缀
+            rng.choice(SURNAMES) + rng.choice(GIVEN),  # 姓名子串
+            booking_code(rng.randint(0, 999)),   # 预订码
+        ])
+        return 'GET', f'/api/search_booking?q={query}', None
+
+    def lookup():
+        # seed 生成的预订码按序号连续，取前面一定存在的那部分
+        return 'GET', f'/api/bookings/{booking_code(rng.randrange(len(tour_ids) * BOOKED_PER_TOUR // 2))}', None
+
+    def admin():
+        return 'GET', '/admin', None
+
+    return {'home': home, 'book_page': book_page, 'api_book': api_book, 'search': search, 'lookup': lookup,
+            'admin': admin}
+
+
+def run_routes(index, tour_ids, routes, requests, seed_value):
+    """依次压测每个路由，返回 {路由: {'latencies': [...], 'errors': n, 'seconds': s}}"""
+    rng = random.Random(seed_value)
+    makers = make_requests(tour_ids, rng)
+    client = index.app.test_client()
+    with client.session_transaction() as sess:
+        sess['is_admin'] = True
+    results = {}
+    for route in routes:
+        latencies = []
+        errors = 0
+        started = time.perf_counter()
+        for _ in range(requests):
+            method, url, body = makers[route]()
+            t0 = time.perf_counter()
+            resp = client.open(url, method=method, json=body)
+            resp.get_data()  # 流式响应要读完才算结束
+            resp.close()
+            latencies.append(time.perf_counter() - t0)
+            # 座位冲突（409）是预期结果，不算错误
+            if resp.status_code >= 400 and resp.status_code != 409:
+                errors += 1
+        results[route] = {'latencies': latencies, 'errors': errors,
+                          'seconds': time.perf_counter() - started}
+    return results
+
+
+def worker(db_file, tour_ids, routes, requests, seed_value, start_event, queue):
+    index = load_app(db_file)
+    start_event.wait()
+    queue.put(run_routes(index, tour_ids, routes, requests, seed_value))
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    i = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[i]
+
+
+def summarize(parts, processes):
+    """合并各进程的结果；吞吐按最慢进程的耗时算（各进程同时开始）"""
+    summary = {}
+    for route in parts[0]:
+        latencies = sorted(x for part in parts for x in part[route]['latencies'])
+        seconds = max(part[route]['seconds'] for part in parts)
+        summary[route] = {
+            'requests': len(latencies),
+            'errors': sum(part[route]['errors'] for part in parts),
+            'throughput_rps': round(len(latencies) / seconds, 1) if seconds else 0.0,
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'processes': processes,
+        }
+    return summary
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline_file, threshold):
+    """和基线比较 p95，返回变慢超过阈值的路由说明"""
+    with open(baseline_file, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('size') != report['size']:
+        sys.exit(f"基线数据集是 {baseline.get('size')}，本次是 {report['size']}，无法比较")
+    regressions = []
+    for route, stats in report['routes'].items():
+        old = baseline.get('routes', {}).get(route)
+        if not old or not old['p95_ms']:
+            continue
+        change = stats['p95_ms'] / old['p95_ms'] - 1
+        stats['p95_change'] = round(change, 4)
+        if change > threshold:
+            regressions.append(f"{route}: p95 {old['p95_ms']}ms -> {stats['p95_ms']}ms (+{change:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='热点路由基准测试')
+    parser.add_argument('--size', choices=sorted(SIZES), default='1k', help='预订条数')
+    parser.add_argument('--requests', type=int, default=200, help='每个路由每个进程的请求数')
+    parser.add_argument('--routes', default=','.join(ROUTES), help='逗号分隔的路由名')
+    parser.add_argument('--processes', type=int, default=1, help='大于1时用多进程同时压测')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', help='结果 JSON 文件')
+    parser.add_argument('--compare', help='基线结果 JSON 文件')
+    parser.add_argument('--threshold', type=float, default=0.2, help='p95 允许变慢的比例')
+    args = parser.parse_args()
+    routes = [r for r in args.routes.split(',') if r]
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        parser.error(f'未知路由: {", ".join(sorted(unknown))}')
+
+    db_file = os.path.join(tempfile.mkdtemp(prefix='bench_routes_'), 'booking.db')
+    # 基准测试期间不需要后台压缩和过期清理
+    os.environ.setdefault('BOOKING_COMPACT_INTERVAL', '86400')
+    os.environ.setdefault('BOOKING_SWEEP_INTERVAL', '86400')
+    os.environ['BOOKING_DB_FILE'] = db_file
+    os.environ.setdefault('BOOKING_LEGACY_FILE', db_file + '.legacy.json')
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+    import storage
+    storage.init_db()
+    started = time.perf_counter()
+    tour_ids = seed(storage, SIZES[args.size], random.Random(args.seed))
+    seed_seconds = time.perf_counter() - started
+
+    index = load_app(db_file)
+    started = time.perf_counter()
+    index.dataset.refresh()
+    load_seconds = time.perf_counter() - started
+
+    if args.processes > 1:
+        ctx = multiprocessing.get_context('fork')
+        start_event = ctx.Event()
+        queue = ctx.Queue()
+        procs = [ctx.Process(target=worker, args=(db_file, tour_ids, routes, args.requests,
+                                                  args.seed + i, start_event, queue))
+                 for i in range(args.processes)]
+        for p in procs:
+            p.start()
+        start_event.set()
+        parts = [queue.get() for _ in procs]
+        for p in procs:
+            p.join()
+    else:
+        parts = [run_routes(index, tour_ids, routes, args.requests, args.seed)]
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'size': args.size,
+        'bookings': SIZES[args.size],
+        'tours': len(tour_ids),
+        'seed_seconds': round(seed_seconds, 2),
+        'cache_load_seconds': round(load_seconds, 2),
+        'routes': summarize(parts, args.processes),
+    }
+    regressions = compare(report, args.compare, args.threshold) if args.compare else []
+    report['regressions'] = regressions
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
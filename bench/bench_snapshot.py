@@ -0,0 +1,77 @@
+"""快照格式基准：同一份合成数据集在旧JSON文件、数据库逐行读取、二进制快照三种方式下的大小和加载耗时
+
+    python bench/bench_snapshot.py --size 1m
+    python bench/bench_snapshot.py --size 100k --out bench/results/snapshot-100k.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from bench_routes import SIZES, seed
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, round(time.perf_counter() - started, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='快照格式基准测试')
+    parser.add_argument('--size', choices=sorted(SIZES), default='100k', help='预订条数')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', help='结果 JSON 文件')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_snapshot_')
+    db_file = os.path.join(workdir, 'booking.db')
+    os.environ['BOOKING_DB_FILE'] = db_file
+    os.environ.setdefault('BOOKING_LEGACY_FILE', db_file + '.legacy.json')
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+    import snapshot
+    import storage
+    storage.init_db()
+    seed(storage, SIZES[args.size], random.Random(args.seed))
+
+    (version, tours, bookings), db_seconds = timed(storage.load_all)
+
+    # 旧格式：整个数据集一个 JSON 文件（与原来 save_data 的写法一致）
+    legacy_file = os.path.join(workdir, 'booking_data.json')
+    with open(legacy_file, 'w', encoding='utf-8') as f:
+        json.dump(snapshot.to_legacy(tours, bookings), f, ensure_ascii=False, indent=2)
+
+    def load_legacy():
+        with open(legacy_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    _, json_seconds = timed(load_legacy)
+
+    snap_file = os.path.join(workdir, 'booking.snap')
+    _, write_seconds = timed(snapshot.write, snap_file, version, tours, bookings, storage.dataset_id())
+    (_, snap_tours, snap_bookings), read_seconds = timed(snapshot.read, snap_file)
+    if ([b.to_dict() for b in snap_bookings] != [b.to_dict() for b in bookings]
+            or [t.to_dict() for t, _ in snap_tours] != [t.to_dict() for t, _ in tours]):
+        sys.exit('快照读回的数据与数据库不一致')
+
+    report = {
+        'size': args.size,
+        'tours': len(tours),
+        'bookings': len(bookings),
+        'legacy_json': {'bytes': os.path.getsize(legacy_file), 'load_seconds': json_seconds},
+        'sqlite_load_all': {'bytes': os.path.getsize(db_file), 'load_seconds': db_seconds},
+        'snapshot': {'bytes': os.path.getsize(snap_file), 'write_seconds': write_seconds,
+                     'load_seconds': read_seconds},
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""并发抢座压力测试：多个进程 × 多个线程同时预订同一个班次
+
+检查两件事：
+1. 没有座位被重复卖出（每个座位最多出现在一条预订里）
+2. 没有丢失的写入（成功响应的预订都在数据库里，团期已预订人数与座位数一致）
+
+用法：
+    python bench/stress_book.py --processes 4 --threads 50 --seats 50
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api')
+
+
+def load_app(db_file):
+    """在当前进程里用指定的数据库文件加载应用"""
+    os.environ['BOOKING_DB_FILE'] = db_file
+    os.environ.setdefault('BOOKING_LEGACY_FILE', db_file + '.legacy.json')
+    sys.path.insert(0, API_DIR)
+    import index
+    return index
+
+
+def worker(db_file, tour_id, threads, max_seats, start_event, results):
+    """一个进程：启动多个线程，每个线程发一次预订请求"""
+    index = load_app(db_file)
+    barrier = threading.Barrier(threads)
+    local_results = []
+    lock = threading.Lock()
+
+    def book(i):
+        client = index.app.test_client()
+        seat = random.randint(1, max_seats)
+        barrier.wait()
+        started = time.perf_counter()
+        resp = client.post('/api/book', json={
+            'tour_id': tour_id, 'name': f'压测{os.getpid()}-{i}',
+            'phone': '13800000000', 'seat_numbers': [seat],
+        })
+        elapsed = time.perf_counter() - started
+        body = resp.get_json()
+        with lock:
+            local_results.append((resp.status_code, body.get('success'),
+                                  body.get('booking_code'), seat, elapsed))
+
+    start_event.wait()
+    pool = [threading.Thread(target=book, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    results.put(local_results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='并发抢座压力测试')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=50)
+    parser.add_argument('--seats', type=int, default=50)
+    args = parser.parse_args()
+
+    db_file = os.path.join(tempfile.mkdtemp(prefix='stress_book_'), 'booking.db')
+    index = load_app(db_file)
+    tour_id = index.storage.create_tour({
+        'date': '2099-01-01', 'time': '08:00', 'destination': '压测',
+        'vehicle_model': '压测车', 'max_seats': args.seats,
+    })
+
+    ctx = multiprocessing.get_context('fork')
+    start_event = ctx.Event()
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(db_file, tour_id, args.threads, args.seats,
+                                              start_event, results))
+             for _ in range(args.processes)]
+    for p in procs:
+        p.start()
+    start_event.set()
+    responses = []
+    for _ in procs:
+        responses.extend(results.get())
+    for p in procs:
+        p.join()
+
+    ok = [r for r in responses if r[1]]
+    conflicts = [r for r in responses if r[0] == 409]
+    latencies = sorted(r[4] for r in responses)
+
+    stored = index.storage.get_tour_bookings(tour_id)
+    tour = index.storage.get_tour(tour_id)
+    sold = [s for b in stored for s in b.seats]
+    errors = []
+    if len(sold) != len(set(sold)):
+        errors.append(f'重复卖出的座位: {sorted(s for s in set(sold) if sold.count(s) > 1)}')
+    stored_codes = {b.code for b in stored}
+    lost = [r[2] for r in ok if r[2] not in stored_codes]
+    if lost:
+        errors.append(f'丢失的预订: {lost}')
+    if len(stored) != len(ok):
+        errors.append(f'成功响应 {len(ok)} 条，数据库里有 {len(stored)} 条')
+    if tour.booked != len(sold):
+        errors.append(f"团期已预订 {tour.booked}，实际座位 {len(sold)}")
+
+    print(json.dumps({
+        'requests': len(responses),
+        'succeeded': len(ok),
+        'conflicts': len(conflicts),
+        'seats_sold': len(sold),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+        'errors': errors,
+    }, ensure_ascii=False, indent=2))
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()